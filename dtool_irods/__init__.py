@@ -1,6 +1,7 @@
 """dtool_irods package."""
 
 import sys
+import errno
 import logging
 from subprocess import Popen, PIPE
 
@@ -14,10 +15,16 @@ class IinitRuntimeError(RuntimeError):
 
 
 class CommandWrapper(object):
-    """Class for creating API calls from command line tools."""
+    """Class for creating API calls from command line tools.
 
-    def __init__(self, args):
+    :param args: command line arguments
+    :param stdin: bytes written to the standard input of the command, or
+                  iterable of bytes written to it as they are produced
+    """
+
+    def __init__(self, args, stdin=None):
         self.args = args
+        self.stdin = stdin
 
     def success(self):
         """Return True if the command line tool was run successfully."""
@@ -36,7 +43,22 @@ class CommandWrapper(object):
         # Calling this command with newline as stdin as the
         # iCommnads hangs waiting for user input if the password
         # has not been set or has timed out.
-        self.stdout, self.stderr = p.communicate("\n".encode())
+        stdin = self.stdin
+        if stdin is None:
+            stdin = "\n".encode()
+        if isinstance(stdin, bytes):
+            self.stdout, self.stderr = p.communicate(stdin)
+        else:
+            # The commands reading their input this way only write their
+            # output, if any, once it is exhausted.
+            try:
+                for chunk in stdin:
+                    p.stdin.write(chunk)
+            except IOError as e:
+                # The command exited early; its stderr tells why.
+                if e.errno != errno.EPIPE:
+                    raise
+            self.stdout, self.stderr = p.communicate()
         self.stdout = self.stdout.decode("utf-8")
         self.stderr = self.stderr.decode("utf-8")
         self.returncode = p.returncode
@@ -67,3 +89,15 @@ class CommandWrapper(object):
             else:
                 logger.info("Command failed: {}".format(self.args))
                 logger.info(self.stderr)
+
+
+def get_config_flag(key, config_path=None, default=False):
+    """Return boolean configuration value.
+
+    The values "true", "yes", "on" and "1" are interpreted as True.
+    """
+    from dtoolcore.utils import get_config_value
+    value = get_config_value(key, config_path=config_path, default=default)
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("true", "yes", "on", "1")
@@ -0,0 +1,452 @@
+"""Size bounded cache of item content downloaded from iRODS.
+
+Items are downloaded into ``DTOOL_CACHE_DIRECTORY/<uuid>/``. The
+:class:`CacheManager` keeps an index of the cached files, their sizes and
+when they were last accessed, in an SQLite database in the cache directory.
+When the total size of the cached files exceeds the quota the least recently
+used items, or whole datasets, are evicted. Files of pinned datasets, and
+files that a process has open, are never evicted.
+
+Optionally the content of the items is stored once, under
+``DTOOL_CACHE_DIRECTORY/sha256/``, by its hash and hard linked into the
+dataset directories. The index then records the links of each stored file;
+a stored file is evicted together with all its links.
+
+The index is shared by all the processes using the cache directory;
+evictions take place in an exclusive transaction on the index.
+"""
+
+import os
+import time
+import errno
+import atexit
+import shutil
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "dtool-irods-cache-index.sqlite"
+
+EVICT_ITEMS = "item"
+EVICT_DATASETS = "dataset"
+
+# Directory of the content addressed store, also used as its dataset name
+# in the index.
+CONTENT_DIRECTORY = "sha256"
+
+# Number of buffered access times that triggers a write to the index.
+MAX_PENDING_ACCESSES = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    path TEXT PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    atime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_atime ON items (atime);
+CREATE INDEX IF NOT EXISTS items_dataset ON items (dataset);
+CREATE TABLE IF NOT EXISTS pins (
+    dataset TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS links (
+    path TEXT PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS links_content ON links (content);
+CREATE INDEX IF NOT EXISTS links_dataset ON links (dataset);
+"""
+
+
+def content_abspath(cache_abspath, hexdigest):
+    """Return path of the content with the hash in the content store."""
+    return os.path.join(
+        cache_abspath,
+        CONTENT_DIRECTORY,
+        hexdigest[:2],
+        hexdigest
+    )
+
+
+def _open_files(prefix):
+    """Return the set of paths below prefix that processes have open.
+
+    Both open file descriptors and memory mapped files are taken into
+    account. Uses the Linux ``/proc`` file system; processes owned by other
+    users cannot be inspected.
+    """
+    open_paths = set()
+    try:
+        pids = os.listdir("/proc")
+    except OSError:
+        return open_paths
+    for pid in pids:
+        if not pid.isdigit():
+            continue
+        fd_dir = os.path.join("/proc", pid, "fd")
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            fds = []
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            if target.startswith(prefix):
+                open_paths.add(target)
+        try:
+            with open(os.path.join("/proc", pid, "maps")) as fh:
+                for line in fh:
+                    fields = line.split(None, 5)
+                    if len(fields) == 6:
+                        target = fields[5].rstrip("\n")
+                        if target.startswith(prefix):
+                            open_paths.add(target)
+        except (IOError, OSError):
+            continue
+    return open_paths
+
+
+def _remove_file(abspath):
+    """Remove a file, returning False if it could not be removed."""
+    try:
+        os.unlink(abspath)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            logger.warning("Failed to evict {}: {}".format(abspath, e))
+            return False
+    return True
+
+
+class CacheManager(object):
+    """Keep the size of a cache directory within a quota.
+
+    :param cache_abspath: absolute path to the cache directory
+    :param quota: maximum size of the cache in bytes, None for no limit
+    :param eviction: evict least recently used items ("item") or datasets
+                     ("dataset")
+    """
+
+    def __init__(self, cache_abspath, quota=None, eviction=EVICT_ITEMS):
+        if eviction not in (EVICT_ITEMS, EVICT_DATASETS):
+            raise(ValueError(
+                "Unknown cache eviction policy: {}".format(eviction)
+            ))
+        self.cache_abspath = os.path.realpath(cache_abspath)
+        self.quota = quota
+        self.eviction = eviction
+        self._lock = threading.RLock()
+        self._connection = None
+        self._pid = None
+        self._pending = {}
+
+    @property
+    def index_abspath(self):
+        return os.path.join(self.cache_abspath, INDEX_NAME)
+
+    def _connect(self):
+        # Connections must not be shared with forked processes.
+        if self._connection is None or self._pid != os.getpid():
+            if not os.path.isdir(self.cache_abspath):
+                os.makedirs(self.cache_abspath)
+            self._connection = sqlite3.connect(
+                self.index_abspath,
+                timeout=60,
+                isolation_level=None,
+                check_same_thread=False
+            )
+            self._connection.executescript(_SCHEMA)
+            self._pid = os.getpid()
+        return self._connection
+
+    @contextmanager
+    def _transaction(self):
+        """Exclusive transaction on the index; writes buffered accesses."""
+        with self._lock:
+            connection = self._connect()
+            cursor = connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_pending(cursor)
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+
+    def _relpath(self, abspath):
+        return os.path.relpath(os.path.realpath(abspath), self.cache_abspath)
+
+    def _write_pending(self, cursor):
+        pending, self._pending = self._pending, {}
+        for relpath, (dataset, atime) in pending.items():
+            cursor.execute(
+                "UPDATE items SET atime = ? WHERE path = ?",
+                (atime, relpath)
+            )
+            if cursor.rowcount == 0:
+                cursor.execute(
+                    "UPDATE items SET atime = ? WHERE path IN "
+                    "(SELECT content FROM links WHERE path = ?)",
+                    (atime, relpath)
+                )
+            if cursor.rowcount == 0:
+                # Cached before the index existed.
+                abspath = os.path.join(self.cache_abspath, relpath)
+                try:
+                    size = os.path.getsize(abspath)
+                except OSError:
+                    continue
+                cursor.execute(
+                    "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?)",
+                    (relpath, dataset, size, atime)
+                )
+
+    def record_access(self, dataset_uuid, abspath):
+        """Record that a cached file has been accessed.
+
+        Access times are buffered in memory and written to the index in
+        batches.
+        """
+        with self._lock:
+            self._pending[self._relpath(abspath)] = (dataset_uuid, time.time())
+            if len(self._pending) >= MAX_PENDING_ACCESSES:
+                with self._transaction():
+                    pass
+
+    def add(self, dataset_uuid, abspath, content_abspath=None):
+        """Add a newly cached file to the index and enforce the quota.
+
+        The file itself is never evicted by this call.
+
+        :param dataset_uuid: UUID of the dataset the file belongs to
+        :param abspath: absolute path to the file
+        :param content_abspath: absolute path to the file in the content
+                                store if abspath is a hard link to it
+        """
+        relpath = self._relpath(abspath)
+        keep = set([relpath])
+        with self._transaction() as cursor:
+            if content_abspath is None:
+                cursor.execute(
+                    "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?)",
+                    (
+                        relpath,
+                        dataset_uuid,
+                        os.path.getsize(abspath),
+                        time.time()
+                    )
+                )
+            else:
+                content_relpath = self._relpath(content_abspath)
+                keep.add(content_relpath)
+                cursor.execute(
+                    "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?)",
+                    (
+                        content_relpath,
+                        CONTENT_DIRECTORY,
+                        os.path.getsize(content_abspath),
+                        time.time()
+                    )
+                )
+                cursor.execute(
+                    "INSERT OR REPLACE INTO links VALUES (?, ?, ?)",
+                    (relpath, dataset_uuid, content_relpath)
+                )
+            to_remove = self._evict(cursor, keep=keep)
+        self._remove_directories(to_remove)
+
+    def flush(self):
+        """Write buffered access times to the index."""
+        with self._lock:
+            if self._pending:
+                with self._transaction():
+                    pass
+
+    def size_in_bytes(self):
+        """Return the total size of the files in the index."""
+        with self._transaction() as cursor:
+            cursor.execute("SELECT COALESCE(SUM(size), 0) FROM items")
+            return cursor.fetchone()[0]
+
+    def pin(self, dataset_uuid):
+        """Never evict the items of the dataset."""
+        with self._transaction() as cursor:
+            cursor.execute(
+                "INSERT OR IGNORE INTO pins VALUES (?)",
+                (dataset_uuid,)
+            )
+
+    def unpin(self, dataset_uuid):
+        """Allow the items of the dataset to be evicted again."""
+        with self._transaction() as cursor:
+            cursor.execute(
+                "DELETE FROM pins WHERE dataset = ?",
+                (dataset_uuid,)
+            )
+
+    def pinned_datasets(self):
+        """Return the sorted list of UUIDs of the pinned datasets."""
+        with self._transaction() as cursor:
+            cursor.execute("SELECT dataset FROM pins ORDER BY dataset")
+            return [row[0] for row in cursor.fetchall()]
+
+    def enforce_quota(self):
+        """Evict least recently used content until within the quota."""
+        with self._transaction() as cursor:
+            to_remove = self._evict(cursor, keep=set())
+        self._remove_directories(to_remove)
+
+    def _evict(self, cursor, keep):
+        """Evict content within a transaction.
+
+        Returns the list of directories of evicted datasets, renamed out of
+        the way, to be removed once the transaction has been committed.
+        """
+        if self.quota is None:
+            return []
+        cursor.execute("SELECT COALESCE(SUM(size), 0) FROM items")
+        excess = cursor.fetchone()[0] - self.quota
+        if excess <= 0:
+            return []
+
+        open_relpaths = set(
+            os.path.relpath(p, self.cache_abspath)
+            for p in _open_files(self.cache_abspath + os.sep)
+        )
+        protected = keep | open_relpaths
+
+        if self.eviction == EVICT_DATASETS:
+            return self._evict_datasets(cursor, excess, protected)
+        self._evict_items(cursor, excess, protected)
+        return []
+
+    def _evict_items(self, cursor, excess, protected):
+        # Stored content linked into a pinned dataset counts as pinned.
+        cursor.execute(
+            "SELECT path, size FROM items "
+            "WHERE dataset NOT IN (SELECT dataset FROM pins) "
+            "AND path NOT IN (SELECT content FROM links "
+            "WHERE dataset IN (SELECT dataset FROM pins)) "
+            "ORDER BY atime"
+        )
+        for relpath, size in cursor.fetchall():
+            if excess <= 0:
+                break
+            cursor.execute(
+                "SELECT path FROM links WHERE content = ?",
+                (relpath,)
+            )
+            links = [row[0] for row in cursor.fetchall()]
+            if any(p in protected for p in [relpath] + links):
+                continue
+            if not all(
+                _remove_file(os.path.join(self.cache_abspath, p))
+                for p in links + [relpath]
+            ):
+                continue
+            logger.debug("Evicted {}".format(relpath))
+            cursor.execute("DELETE FROM links WHERE content = ?", (relpath,))
+            cursor.execute("DELETE FROM items WHERE path = ?", (relpath,))
+            excess -= size
+
+    def _evict_datasets(self, cursor, excess, protected):
+        # Datasets are ordered by the most recent access of the files in
+        # their directory, and of the stored content linked into it.
+        cursor.execute(
+            "SELECT dataset FROM ("
+            "SELECT dataset, atime FROM items WHERE dataset != ? "
+            "UNION ALL "
+            "SELECT links.dataset, items.atime FROM links "
+            "JOIN items ON links.content = items.path"
+            ") WHERE dataset NOT IN (SELECT dataset FROM pins) "
+            "GROUP BY dataset ORDER BY MAX(atime)",
+            (CONTENT_DIRECTORY,)
+        )
+        to_remove = []
+        for (dataset,) in cursor.fetchall():
+            if excess <= 0:
+                break
+            if any(p.split(os.sep)[0] == dataset for p in protected):
+                continue
+            # Renaming the directory removes all the items of the dataset
+            # from the cache in one step.
+            dataset_abspath = os.path.join(self.cache_abspath, dataset)
+            evicted_abspath = "{}.evicted-{}".format(
+                dataset_abspath,
+                os.getpid()
+            )
+            try:
+                os.rename(dataset_abspath, evicted_abspath)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    logger.warning(
+                        "Failed to evict {}: {}".format(dataset, e)
+                    )
+                    continue
+            else:
+                to_remove.append(evicted_abspath)
+            logger.debug("Evicted dataset {}".format(dataset))
+            cursor.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM items WHERE dataset = ?",
+                (dataset,)
+            )
+            excess -= cursor.fetchone()[0]
+            cursor.execute("DELETE FROM items WHERE dataset = ?", (dataset,))
+            cursor.execute("DELETE FROM links WHERE dataset = ?", (dataset,))
+            excess -= self._evict_unlinked_content(cursor, protected)
+        return to_remove
+
+    def _evict_unlinked_content(self, cursor, protected):
+        """Evict stored content no longer linked into any dataset.
+
+        Returns the number of bytes freed.
+        """
+        cursor.execute(
+            "SELECT path, size FROM items WHERE dataset = ? "
+            "AND path NOT IN (SELECT content FROM links)",
+            (CONTENT_DIRECTORY,)
+        )
+        freed = 0
+        for relpath, size in cursor.fetchall():
+            if relpath in protected:
+                continue
+            if _remove_file(os.path.join(self.cache_abspath, relpath)):
+                cursor.execute("DELETE FROM items WHERE path = ?", (relpath,))
+                freed += size
+        return freed
+
+    def _remove_directories(self, abspaths):
+        for abspath in abspaths:
+            shutil.rmtree(abspath, ignore_errors=True)
+
+
+_CACHE_MANAGERS = {}
+_CACHE_MANAGERS_LOCK = threading.Lock()
+
+
+def get_cache_manager(cache_abspath, quota=None, eviction=EVICT_ITEMS):
+    """Return the cache manager of the cache directory.
+
+    Cache managers are shared by all the storage brokers of the process
+    using the same cache directory and settings.
+    """
+    key = (os.path.realpath(cache_abspath), quota, eviction)
+    with _CACHE_MANAGERS_LOCK:
+        if key not in _CACHE_MANAGERS:
+            _CACHE_MANAGERS[key] = CacheManager(cache_abspath, quota, eviction)
+        return _CACHE_MANAGERS[key]
+
+
+@atexit.register
+def _flush_cache_managers():
+    for cache_manager in list(_CACHE_MANAGERS.values()):
+        try:
+            cache_manager.flush()
+        except Exception as e:
+            logger.warning("Failed to update cache index: {}".format(e))
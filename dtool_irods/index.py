@@ -0,0 +1,339 @@
+"""Local index of the datasets stored in iRODS.
+
+The index is an SQLite database, in the dtool cache directory, recording the
+UUID, name, creator, freeze time, size and tags of the datasets in the base
+URIs that have been indexed. It allows datasets to be listed and searched for
+without talking to iRODS.
+
+Refreshing the index of a base URI is incremental. Two catalog queries look
+up the modification times of the admin metadata and the tags of all the
+datasets; only the admin metadata that changed since the last refresh is
+downloaded again, and the manifest only when a dataset is first seen frozen.
+"""
+
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "dtool-irods-datasets.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    uri TEXT PRIMARY KEY,
+    base_uri TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    name TEXT NOT NULL,
+    creator TEXT,
+    frozen_at REAL,
+    size_in_bytes INTEGER,
+    modify_time INTEGER NOT NULL,
+    admin_metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS datasets_base_uri ON datasets (base_uri);
+CREATE TABLE IF NOT EXISTS tags (
+    uri TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (uri, tag)
+);
+CREATE TABLE IF NOT EXISTS base_uris (
+    base_uri TEXT PRIMARY KEY,
+    refreshed_at REAL NOT NULL
+);
+"""
+
+_COLUMNS = [
+    "uri",
+    "base_uri",
+    "uuid",
+    "name",
+    "creator",
+    "frozen_at",
+    "size_in_bytes",
+]
+
+
+def _irods_uri(irods_path):
+    return "irods:{}".format(irods_path.rstrip("/"))
+
+
+class DatasetIndex(object):
+    """SQLite index of datasets in iRODS.
+
+    :param index_abspath: absolute path to the SQLite database
+    """
+
+    def __init__(self, index_abspath):
+        self.index_abspath = index_abspath
+        self._lock = threading.RLock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        # Connections must not be shared with forked processes.
+        if self._connection is None or self._pid != os.getpid():
+            dirname = os.path.dirname(self.index_abspath)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            self._connection = sqlite3.connect(
+                self.index_abspath,
+                timeout=60,
+                isolation_level=None,
+                check_same_thread=False
+            )
+            self._connection.executescript(_SCHEMA)
+            self._pid = os.getpid()
+        return self._connection
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            cursor = self._connect().cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+
+    def refreshed_at(self, irods_path):
+        """Return time of the last refresh of the base path, or None."""
+        with self._transaction() as cursor:
+            cursor.execute(
+                "SELECT refreshed_at FROM base_uris WHERE base_uri = ?",
+                (_irods_uri(irods_path),)
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def is_stale(self, irods_path, max_age):
+        """Return True if the base path was not refreshed in max_age seconds.
+        """
+        refreshed_at = self.refreshed_at(irods_path)
+        return refreshed_at is None or time.time() - refreshed_at > max_age
+
+    def refresh(self, irods_path, transport, max_workers=1):
+        """Bring the index of the datasets in the base path up to date.
+
+        :param irods_path: iRODS path of the base collection
+        :param transport: transport used to talk to iRODS
+        :param max_workers: number of concurrent downloads of the admin
+                            metadata and manifests of changed datasets
+        :returns: number of datasets added or updated
+        """
+        irods_path = irods_path.rstrip("/")
+        base_uri = _irods_uri(irods_path)
+        timestamps = transport.query_dataset_timestamps(irods_path)
+        tags = transport.query_dataset_tags(irods_path)
+
+        refreshed_at = self.refreshed_at(irods_path)
+        with self._transaction() as cursor:
+            cursor.execute(
+                "SELECT uri, uuid, modify_time, size_in_bytes FROM datasets "
+                "WHERE base_uri = ?",
+                (base_uri,)
+            )
+            indexed = dict((row[0], row[1:]) for row in cursor.fetchall())
+
+        def is_changed(uri, modify_time):
+            if uri not in indexed or indexed[uri][1] != modify_time:
+                return True
+            # Modification times have a resolution of a second; admin
+            # metadata modified around the previous refresh may have changed
+            # again since.
+            return refreshed_at is not None \
+                and modify_time >= int(refreshed_at) - 1
+
+        changed = []
+        for dataset_path, modify_time in timestamps.items():
+            uri = _irods_uri(dataset_path)
+            if is_changed(uri, modify_time):
+                changed.append((dataset_path, modify_time, indexed.get(uri)))
+
+        def fetch(args):
+            dataset_path, modify_time, previous = args
+            admin_metadata = transport.get_obj(
+                os.path.join(dataset_path, ".dtool", "dtool")
+            )
+            size_in_bytes = None
+            if admin_metadata.get("frozen_at") is not None:
+                # The manifest of a frozen dataset never changes.
+                already_sized = previous is not None \
+                    and previous[0] == admin_metadata["uuid"] \
+                    and previous[2] is not None
+                if already_sized:
+                    size_in_bytes = previous[2]
+                else:
+                    manifest = transport.get_obj(
+                        os.path.join(dataset_path, ".dtool", "manifest.json")
+                    )
+                    size_in_bytes = sum(
+                        item["size_in_bytes"]
+                        for item in manifest["items"].values()
+                    )
+            return dataset_path, modify_time, admin_metadata, size_in_bytes
+
+        if max_workers > 1 and len(changed) > 1:
+            pool = ThreadPool(max_workers)
+            try:
+                updates = pool.map(fetch, changed)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            updates = [fetch(args) for args in changed]
+
+        with self._transaction() as cursor:
+            current = set(_irods_uri(p) for p in timestamps)
+            for uri in set(indexed) - current:
+                cursor.execute("DELETE FROM datasets WHERE uri = ?", (uri,))
+            for dataset_path, modify_time, admin_metadata, size in updates:
+                cursor.execute(
+                    "INSERT OR REPLACE INTO datasets "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        _irods_uri(dataset_path),
+                        base_uri,
+                        admin_metadata["uuid"],
+                        admin_metadata["name"],
+                        admin_metadata.get("creator_username"),
+                        admin_metadata.get("frozen_at"),
+                        size,
+                        modify_time,
+                        json.dumps(admin_metadata)
+                    )
+                )
+            cursor.execute(
+                "DELETE FROM tags WHERE uri IN "
+                "(SELECT uri FROM datasets WHERE base_uri = ?) "
+                "OR uri NOT IN (SELECT uri FROM datasets)",
+                (base_uri,)
+            )
+            for dataset_path, dataset_tags in tags.items():
+                uri = _irods_uri(dataset_path)
+                if uri not in current:
+                    continue
+                for tag in dataset_tags:
+                    cursor.execute(
+                        "INSERT INTO tags VALUES (?, ?)",
+                        (uri, tag)
+                    )
+            cursor.execute(
+                "INSERT OR REPLACE INTO base_uris VALUES (?, ?)",
+                (base_uri, time.time())
+            )
+
+        logger.info("Indexed {} datasets in {}".format(len(updates), base_uri))
+        return len(updates)
+
+    def list_uris(self, irods_path):
+        """Return sorted list of the URIs of the indexed datasets in the base
+        path."""
+        with self._transaction() as cursor:
+            cursor.execute(
+                "SELECT uri FROM datasets WHERE base_uri = ? ORDER BY uri",
+                (_irods_uri(irods_path),)
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def get_admin_metadata(self, uri):
+        """Return indexed admin metadata of the dataset, or None."""
+        with self._transaction() as cursor:
+            cursor.execute(
+                "SELECT admin_metadata FROM datasets "
+                "WHERE uri = ? AND modify_time >= 0",
+                (uri,)
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def invalidate(self, uri):
+        """Mark the admin metadata of the dataset as out of date.
+
+        The dataset is still listed, but its admin metadata is downloaded
+        again by the next refresh.
+        """
+        with self._transaction() as cursor:
+            cursor.execute(
+                "UPDATE datasets SET modify_time = -1 WHERE uri = ?",
+                (uri,)
+            )
+
+    def search(self, irods_paths=None, name=None, creator=None, tag=None,
+               frozen_after=None, frozen_before=None):
+        """Return list of dictionaries describing the matching datasets.
+
+        :param irods_paths: base paths to search, all indexed ones if None
+        :param name: shell style pattern the dataset name must match
+        :param creator: user name of the creator
+        :param tag: tag the dataset must have
+        :param frozen_after: earliest freeze time, as a UTC timestamp
+        :param frozen_before: latest freeze time, as a UTC timestamp
+        :returns: dictionaries with the keys uri, base_uri, uuid, name,
+                  creator, frozen_at, size_in_bytes and tags, ordered by uri
+        """
+        conditions = []
+        parameters = []
+        if irods_paths is not None:
+            base_uris = [_irods_uri(p) for p in irods_paths]
+            conditions.append(
+                "base_uri IN ({})".format(", ".join("?" * len(base_uris)))
+            )
+            parameters.extend(base_uris)
+        if name is not None:
+            conditions.append("name GLOB ?")
+            parameters.append(name)
+        if creator is not None:
+            conditions.append("creator = ?")
+            parameters.append(creator)
+        if tag is not None:
+            conditions.append(
+                "uri IN (SELECT uri FROM tags WHERE tag = ?)"
+            )
+            parameters.append(tag)
+        if frozen_after is not None:
+            conditions.append("frozen_at >= ?")
+            parameters.append(frozen_after)
+        if frozen_before is not None:
+            conditions.append("frozen_at <= ?")
+            parameters.append(frozen_before)
+
+        query = "SELECT {} FROM datasets".format(", ".join(_COLUMNS))
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY uri"
+
+        with self._transaction() as cursor:
+            cursor.execute(query, parameters)
+            results = [dict(zip(_COLUMNS, row)) for row in cursor.fetchall()]
+            for result in results:
+                cursor.execute(
+                    "SELECT tag FROM tags WHERE uri = ? ORDER BY tag",
+                    (result["uri"],)
+                )
+                result["tags"] = [row[0] for row in cursor.fetchall()]
+        return results
+
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_dataset_index(cache_abspath):
+    """Return the dataset index stored in the cache directory."""
+    index_abspath = os.path.join(cache_abspath, INDEX_NAME)
+    with _INDEXES_LOCK:
+        if index_abspath not in _INDEXES:
+            _INDEXES[index_abspath] = DatasetIndex(index_abspath)
+        return _INDEXES[index_abspath]
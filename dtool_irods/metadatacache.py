@@ -0,0 +1,139 @@
+"""Persistent cache of the metadata of datasets stored in iRODS.
+
+The text of the metadata files of a dataset (admin metadata, manifest,
+README, overlays, annotations, ...) is stored on disk in
+``DTOOL_CACHE_DIRECTORY/irods-metadata/<uuid>/``.
+
+Once the cached admin metadata records that the dataset has been frozen the
+immutable files, e.g. the manifest, are served from disk without talking to
+iRODS at all. The other files can be edited after freezing; they are served
+from disk as long as their size and modification time, looked up for all the
+metadata files of the dataset in a single catalog query, are unchanged.
+"""
+
+import os
+import json
+import logging
+import threading
+
+from dtoolcore.utils import mkdir_parents
+
+logger = logging.getLogger(__name__)
+
+METADATA_DIRECTORY = "irods-metadata"
+
+
+class MetadataCache(object):
+    """On-disk cache of the metadata text of a dataset.
+
+    :param cache_abspath: absolute path to the dtool cache directory
+    :param dataset_abspath: iRODS path of the dataset
+    :param transport: transport used to look up modification times
+    :param admin_metadata_key: iRODS path of the admin metadata
+    :param immutable_keys: iRODS paths of the files that do not change once
+                           the dataset has been frozen
+    :param exclude: iRODS path of the collection holding the item data,
+                    which is never cached
+    """
+
+    def __init__(self, cache_abspath, dataset_abspath, transport,
+                 admin_metadata_key, immutable_keys, exclude):
+        # Datasets in iRODS are stored in collections named by their UUID.
+        self._abspath = os.path.join(
+            cache_abspath,
+            METADATA_DIRECTORY,
+            os.path.basename(dataset_abspath)
+        )
+        self._dataset_abspath = dataset_abspath
+        self._transport = transport
+        self._admin_metadata_key = admin_metadata_key
+        self._immutable_keys = set(immutable_keys)
+        self._exclude = exclude
+        self._lock = threading.RLock()
+        self._frozen = None
+        self._tree = None
+
+    def _entry_abspath(self, key):
+        relpath = os.path.relpath(key, self._dataset_abspath)
+        return os.path.join(self._abspath, relpath + ".json")
+
+    def _load(self, key):
+        try:
+            with open(self._entry_abspath(key)) as fh:
+                entry = json.load(fh)
+        except (IOError, OSError, ValueError):
+            return None
+        # Guard against another dataset stored under the same name.
+        if entry.get("key") != key:
+            return None
+        return entry
+
+    def _store(self, key, text, stamp):
+        entry_abspath = self._entry_abspath(key)
+        tmp_entry_abspath = "{}.{}-{}.tmp".format(
+            entry_abspath,
+            os.getpid(),
+            threading.current_thread().ident
+        )
+        try:
+            mkdir_parents(os.path.dirname(entry_abspath))
+            with open(tmp_entry_abspath, "w") as fh:
+                json.dump({"key": key, "stamp": stamp, "text": text}, fh)
+            os.rename(tmp_entry_abspath, entry_abspath)
+        except (IOError, OSError) as e:
+            logger.warning("Failed to cache {}: {}".format(key, e))
+
+    def _is_frozen(self):
+        if not self._frozen:
+            entry = self._load(self._admin_metadata_key)
+            if entry is not None:
+                admin_metadata = json.loads(entry["text"])
+                self._frozen = admin_metadata.get("frozen_at") is not None
+        return self._frozen
+
+    def tree(self):
+        """Return dict mapping the metadata files to (size, timestamp) tuples.
+
+        The catalog is only queried the first time.
+        """
+        with self._lock:
+            if self._tree is None:
+                self._tree = self._transport.query_tree(
+                    self._dataset_abspath,
+                    exclude=self._exclude
+                )
+            return self._tree
+
+    def get_text(self, key, fetch):
+        """Return text of the metadata file, from disk if valid.
+
+        :param key: iRODS path of the metadata file
+        :param fetch: callable fetching the text from iRODS
+        """
+        with self._lock:
+            entry = self._load(key)
+            if key in self._immutable_keys and self._is_frozen():
+                if entry is not None:
+                    return entry["text"]
+                text = fetch(key)
+                self._store(key, text, None)
+                return text
+
+            stamp = self.tree().get(key)
+            if stamp is None:
+                return fetch(key)
+            stamp = list(stamp)
+            if entry is not None and entry["stamp"] == stamp:
+                return entry["text"]
+            text = fetch(key)
+            self._store(key, text, stamp)
+            return text
+
+    def invalidate(self, key):
+        """Forget cached text and modification times after key changed."""
+        with self._lock:
+            self._tree = None
+            try:
+                os.unlink(self._entry_abspath(key))
+            except OSError:
+                pass
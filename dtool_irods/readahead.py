@@ -0,0 +1,111 @@
+"""Read-ahead of dataset items expected to be accessed next."""
+
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger(__name__)
+
+
+class ReadAhead(object):
+    """Fetch items on background threads ahead of sequential access.
+
+    When an item is requested straight after the one preceding it in
+    ``order`` the access is assumed to be sequential and the next ``depth``
+    items are fetched in the background, as long as the total size of the
+    items fetched ahead, but not yet requested, stays within ``budget``
+    bytes.
+
+    :param fetch: callable taking an identifier, fetching the item and
+                  returning its absolute path
+    :param order: list of identifiers in the expected order of access
+    :param sizes: dictionary mapping identifiers to sizes in bytes
+    :param depth: number of items to fetch ahead
+    :param budget: maximum number of bytes fetched ahead
+    :param max_workers: number of background threads
+    """
+
+    def __init__(self, fetch, order, sizes, depth, budget, max_workers):
+        self._fetch = fetch
+        self._order = order
+        self._positions = dict((i, n) for n, i in enumerate(order))
+        self._sizes = sizes
+        self._depth = depth
+        self._budget = budget
+        self._max_workers = max_workers
+        self._pool = None
+        self._lock = threading.Lock()
+        self._previous_position = None
+        self._in_flight = {}
+        self._bytes_ahead = 0
+
+    def _fetch_in_background(self, identifier):
+        try:
+            return self._fetch(identifier), None
+        # Failures are dealt with when the item is requested.
+        except (Exception, SystemExit) as e:
+            return None, e
+
+    def _schedule(self, position):
+        """Fetch the items following position that fit in the budget."""
+        if self._pool is None:
+            self._pool = ThreadPool(self._max_workers)
+        end = min(position + 1 + self._depth, len(self._order))
+        for identifier in self._order[position + 1:end]:
+            if identifier in self._in_flight:
+                continue
+            size = self._sizes.get(identifier, 0)
+            if self._bytes_ahead + size > self._budget:
+                break
+            logger.debug("Reading ahead: {}".format(identifier))
+            self._in_flight[identifier] = self._pool.apply_async(
+                self._fetch_in_background,
+                (identifier,)
+            )
+            self._bytes_ahead += size
+
+    def _forget(self, identifier):
+        result = self._in_flight.pop(identifier)
+        self._bytes_ahead -= self._sizes.get(identifier, 0)
+        return result
+
+    def get(self, identifier):
+        """Return absolute path of the item, fetching it if need be."""
+        with self._lock:
+            position = self._positions.get(identifier)
+            sequential = position is not None \
+                and self._previous_position is not None \
+                and position == self._previous_position + 1
+            self._previous_position = position
+
+            result = None
+            if identifier in self._in_flight:
+                result = self._forget(identifier)
+
+            if sequential:
+                self._schedule(position)
+            else:
+                # The access pattern changed; stop accounting for items
+                # fetched ahead that may never be requested.
+                for other in list(self._in_flight.keys()):
+                    self._forget(other)
+
+        if result is not None:
+            abspath, error = result.get()
+            if error is None:
+                return abspath
+            logger.info(
+                "Read-ahead of {} failed: {}".format(identifier, error)
+            )
+
+        return self._fetch(identifier)
+
+    def close(self):
+        """Stop the background threads."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+            self._in_flight = {}
+            self._bytes_ahead = 0
@@ -1,13 +1,18 @@
 """iRODS storage broker."""
 
 import os
-import sys
 import json
+import time
+import uuid
+import errno
+import hashlib
+import atexit
+import shutil
 import logging
 import tempfile
-import time
-import datetime
-import re
+import threading
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 
 from dtoolcore.utils import (
     generate_identifier,
@@ -20,10 +25,64 @@ from dtoolcore.utils import (
 from dtoolcore.filehasher import FileHasher, sha256sum_hexdigest
 from dtoolcore.storagebroker import StorageBrokerOSError, BaseStorageBroker
 
-from dtool_irods import CommandWrapper, __version__, IinitRuntimeError
+from dtool_irods import __version__, get_config_flag
+from dtool_irods.cache import (
+    get_cache_manager,
+    content_abspath,
+    EVICT_ITEMS,
+)
+from dtool_irods.index import get_dataset_index
+from dtool_irods.metadatacache import MetadataCache
+from dtool_irods.readahead import ReadAhead
+from dtool_irods.streaming import (
+    iter_chunks,
+    RangeReader,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_BLOCK_SIZE,
+    DEFAULT_CACHE_BLOCKS,
+)
+from dtool_irods.transport import (  # NOQA
+    get_transport,
+    transfer_threads,
+    IrodsNoMetaDataSetError,
+    _run_cmd,
+    _get_file,
+    _get_file_forcefully,
+    _get_text,
+    _put_text,
+    _get_obj,
+    _put_obj,
+    _path_exists,
+    _mkdir,
+    _mkdir_if_missing,
+    _cp,
+    _rm,
+    _rm_if_exists,
+    _ls,
+    _ls_abspaths,
+    _put_metadata,
+    _verify_chksum,
+    _get_checksum,
+)
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_READ_AHEAD_BUDGET = 1024 ** 3
+DEFAULT_DATASET_INDEX_MAX_AGE = 600
+DEFAULT_ITEM_METADATA_BATCH_SIZE = 10000
+
+# Modes of reading items straight from the vault file system.
+VAULT_READ_PATH = "path"
+VAULT_READ_LINK = "link"
+
+# Tags and annotations are mirrored as AVUs on the dataset collection.
+TAG_AVU_PREFIX = "dtool.tag."
+ANNOTATION_AVU_PREFIX = "dtool.annotation."
+
+# Longest value the iRODS catalog stores in an AVU.
+MAX_AVU_VALUE_LENGTH = 2700
+
 _STRUCTURE_PARAMETERS = {
     "data_directory": ["data"],
     "dataset_readme_relpath": ["README.yml"],
@@ -70,187 +129,164 @@ Dataset tags metadata: .dtool/tags/
 
 
 #############################################################################
-# iRODS helper functions.
+# iRODS storage broker.
 #############################################################################
 
-# The exit_on_failure argument should default to True!
-# Otherwise bad things can happen, like a _cp command failing silently.
-def _run_cmd(cmd, exit_on_failure=True):
-    try:
-        stdout = cmd(exit_on_failure=exit_on_failure)  # NOQA
-        return cmd
-    except IinitRuntimeError:
-        print("There was an issue communicating with iRODS")
-        print("Try running the iRODS command: iinit")
-        sys.exit(800)
-
-
-def _get_file(irods_path, local_abspath):
-    cmd = CommandWrapper(["iget", irods_path, local_abspath])
-    _run_cmd(cmd)
-
-
-def _get_file_forcefully(irods_path, local_abspath):
-    cmd = CommandWrapper(["iget", "-f", irods_path, local_abspath])
-    _run_cmd(cmd)
-
-
-def _get_text(irods_path):
-    """Get raw text from iRODS."""
-    # Command to get contents of file to stdout.
-    cmd = CommandWrapper([
-        "iget",
-        irods_path,
-        "-"
-    ])
-    return _run_cmd(cmd).stdout
-
-
-def _put_text(irods_path, text):
-    """Put raw text into iRODS."""
-    with tempfile.NamedTemporaryFile() as fh:
-        fpath = fh.name
 
-        try:
-            # Make Python2 compatible.
-            text = unicode(text, "utf-8")
-        except (NameError, TypeError):
-            # NameError: We are running Python3 => text already unicode.
-            # TypeError: text is already of type unicode.
-            pass
-
-        fh.write(text.encode("utf-8"))
-        fh.flush()
-        cmd = CommandWrapper([
-            "iput",
-            "-f",
-            fpath,
-            irods_path
-        ])
-        _run_cmd(cmd)
-    assert not os.path.isfile(fpath)
-
-
-def _get_obj(irods_path):
-    """Return object from JSON text stored in iRODS."""
-    return json.loads(_get_text(irods_path))
-
-
-def _put_obj(irods_path, obj):
-    """Put python object into iRODS as JSON text."""
-    text = json.dumps(obj, indent=2)
-    _put_text(irods_path, text)
-
-
-def _path_exists(irods_path):
-    cmd = CommandWrapper(["ils", irods_path])
-    cmd = _run_cmd(cmd, exit_on_failure=False)
-    return cmd.success()
-
-
-def _mkdir(irods_path):
-    cmd = CommandWrapper(["imkdir", irods_path])
-    _run_cmd(cmd)
-
-
-def _mkdir_if_missing(irods_path):
-    if not _path_exists(irods_path):
-        _mkdir(irods_path)
-
-
-def _cp(fpath, irods_path):
-    cmd = CommandWrapper(["iput", "-f", fpath, irods_path])
-    _run_cmd(cmd)
+class IrodsChecksumMismatchError(StorageBrokerOSError):
+    pass
 
 
-def _rm(irods_path):
-    cmd = CommandWrapper(["irm", "-rf", irods_path])
-    _run_cmd(cmd)
+class TransferRecord(namedtuple(
+    "TransferRecord",
+    ["identifier", "direction", "size_in_bytes", "seconds", "threads"]
+)):
+    """Size, duration and number of parallel streams of an item transfer.
 
+    The direction is "get" or "put"; threads is None if the number of
+    streams was left to iRODS.
+    """
 
-def _rm_if_exists(irods_path):
-    if _path_exists(irods_path):
-        _rm(irods_path)
+    __slots__ = ()
+
+    @property
+    def bytes_per_second(self):
+        if self.seconds <= 0:
+            return None
+        return self.size_in_bytes / float(self.seconds)
+
+
+def _get_dataset_index(config_path):
+    """Return the dataset index in the dtool cache directory."""
+    return get_dataset_index(get_config_value(
+        "DTOOL_CACHE_DIRECTORY",
+        config_path=config_path,
+        default=DEFAULT_CACHE_PATH
+    ))
+
+
+def _get_dataset_index_max_age(config_path):
+    return float(get_config_value(
+        "DTOOL_IRODS_DATASET_INDEX_MAX_AGE",
+        config_path=config_path,
+        default=DEFAULT_DATASET_INDEX_MAX_AGE
+    ))
+
+
+def _refresh_dataset_index_if_stale(index, irods_path, config_path):
+    if index.is_stale(irods_path, _get_dataset_index_max_age(config_path)):
+        index.refresh(
+            irods_path,
+            get_transport(config_path),
+            max_workers=int(get_config_value(
+                "DTOOL_IRODS_MAX_WORKERS",
+                config_path=config_path,
+                default=DEFAULT_MAX_WORKERS
+            ))
+        )
 
 
-def _ls(irods_path):
-    cmd = CommandWrapper(["ils", irods_path])
-    cmd = _run_cmd(cmd)
+def _tmp_abspath(abspath):
+    """Return temporary path, unique to the thread, for writing abspath."""
+    return "{}.{}-{}.tmp".format(
+        abspath,
+        os.getpid(),
+        threading.current_thread().ident
+    )
 
-    def remove_header_line(lines):
-        return lines[1:]
 
-    def remove_redundant_whitespace(lines):
-        return [l.strip() for l in lines]
+def _parse_vault_mounts(value):
+    """Return list of (vault prefix, mount prefix) tuples, longest first.
 
-    def deal_with_collections(lines):
-        fixed_lines = []
-        for l in lines:
-            if l.startswith("C"):
-                _, path = l.split()
-                l = os.path.basename(path)  # NOQA
-            fixed_lines.append(l)
-        return fixed_lines
+    :param value: comma separated list of vault=mount path pairs
+    """
+    mounts = []
+    if value:
+        for pair in value.split(","):
+            vault, mount = [p.strip().rstrip("/") for p in pair.split("=", 1)]
+            mounts.append((vault, mount))
+    return sorted(mounts, key=lambda m: len(m[0]), reverse=True)
 
-    text = cmd.stdout.strip()
-    lines = text.split("\n")
-    return deal_with_collections(
-        remove_redundant_whitespace(
-            remove_header_line(lines)
-        )
-    )
 
+# Item metadata buffers holding entries not yet written to iRODS, flushed
+# when the process exits.
+_UNFLUSHED_ITEM_METADATA_BUFFERS = set()
 
-def _ls_abspaths(irods_path):
-    for f in _ls(irods_path):
-        yield os.path.join(irods_path, f)
 
+def _flush_item_metadata_buffers():
+    for buffer in list(_UNFLUSHED_ITEM_METADATA_BUFFERS):
+        buffer.flush_quietly()
 
-def _put_metadata(irods_path, key, value):
-    cmd = CommandWrapper(["imeta", "set", "-d", irods_path, key, value])
-    _run_cmd(cmd)
 
-def _verify_chksum(irods_path, verify=True):
-    """ Run ichksum either with or without verify. """
-    if verify:
-        arg = '-K'
-    else:
-        arg = ''
-    cmd = CommandWrapper(["ichksum", arg, irods_path])
-    cmd = _run_cmd(cmd)
-    out = cmd.stdout
+atexit.register(_flush_item_metadata_buffers)
 
-    pattern = re.compile('(?P<uuid>\w+)\s+(?P<alg>\w+):(?P<chksum>\S+)', re.MULTILINE)
-    matches = pattern.search(out)
 
-    chksum = ''
-    if matches and matches.group('chksum'):
-        chksum = matches.group('chksum')
+class _ItemMetadataBuffer(object):
+    """Item metadata waiting to be written to the fragments collection.
 
-    return chksum
+    The buffer does not refer to the storage broker, so that it can be
+    flushed when the process exits even if the broker has been garbage
+    collected.
 
-def _get_checksum(irods_path):
-    """ Try ichksum first with verify then without if that fails. """
-    # request hash with verification
-    checksum = _verify_chksum(irods_path)
+    :param transport: transport used to write the fragments
+    :param fragments_abspath: iRODS path of the fragments collection
+    """
 
-    if not checksum:
-        # iRODS didn't give us a hash -> requesy without verification
-        #logger.warning('irods_path {} was not verified.'.format(irods_path))
-        checksum = _verify_chksum(irods_path, verify=False)
-    
-    assert checksum, 'Missing checksum in output.'
-    
-    return checksum
+    def __init__(self, transport, fragments_abspath):
+        self._transport = transport
+        self._fragments_abspath = fragments_abspath
+        self._lock = threading.Lock()
+        self._entries = []
+
+    def append(self, entry):
+        """Buffer entry and return the number of buffered entries."""
+        with self._lock:
+            self._entries.append(entry)
+            # Do not lose the buffer of a process exiting without freezing
+            # the dataset.
+            _UNFLUSHED_ITEM_METADATA_BUFFERS.add(self)
+            return len(self._entries)
+
+    def flush(self):
+        """Write the buffered entries to a new JSON-lines fragment."""
+        with self._lock:
+            if not self._entries:
+                return
+            lines = [
+                json.dumps(entry, separators=(",", ":"))
+                for entry in self._entries
+            ]
+            # Fragments are read back in the order they were written.
+            fname = "{:017.6f}-{}.jsonl".format(time.time(), uuid.uuid4().hex)
+            self._transport.mkdir_if_missing(self._fragments_abspath)
+            self._transport.put_text(
+                os.path.join(self._fragments_abspath, fname),
+                "\n".join(lines) + "\n"
+            )
+            self._entries = []
+            _UNFLUSHED_ITEM_METADATA_BUFFERS.discard(self)
 
+    def flush_quietly(self):
+        """Flush, logging rather than raising failures."""
+        try:
+            self.flush()
+        except (Exception, SystemExit) as e:
+            logger.warning("Failed to write item metadata: {}".format(e))
 
-#############################################################################
-# iRODS storage broker.
-#############################################################################
 
+def _annotation_avu_value(annotation):
+    """Return value of the AVU mirroring an annotation.
 
-class IrodsNoMetaDataSetError(LookupError):
-    pass
+    Annotations too long to be stored in an AVU, or that cannot be quoted
+    in a catalog query, are mirrored as the sha256 hash of their JSON
+    representation. The keys of objects are sorted so that equal
+    annotations are mirrored alike.
+    """
+    value = json.dumps(annotation, sort_keys=True)
+    if len(value) > MAX_AVU_VALUE_LENGTH or "'" in value:
+        hexdigest = hashlib.sha256(value.encode("utf-8")).hexdigest()
+        value = "sha256:" + hexdigest
+    return value
 
 
 class IrodsStorageBroker(BaseStorageBroker):
@@ -293,138 +329,396 @@ class IrodsStorageBroker(BaseStorageBroker):
             default=DEFAULT_CACHE_PATH
         )
 
+        # Maximum size of the cache in bytes, and what to evict when the
+        # cache is full; no limit unless configured.
+        self._cache_manager = None
+        cache_quota = get_config_value(
+            "DTOOL_IRODS_CACHE_QUOTA",
+            config_path=config_path
+        )
+        if cache_quota is not None:
+            self._cache_manager = get_cache_manager(
+                self._irods_cache_abspath,
+                quota=int(cache_quota),
+                eviction=get_config_value(
+                    "DTOOL_IRODS_CACHE_EVICTION",
+                    config_path=config_path,
+                    default=EVICT_ITEMS
+                )
+            )
+
+        # Store the content of cached items once, by hash, and hard link it
+        # into the dataset cache directories.
+        self._content_addressed_cache = get_config_flag(
+            "DTOOL_IRODS_CONTENT_ADDRESSED_CACHE",
+            config_path=config_path
+        )
+
+        self._transport = get_transport(config_path)
+
+        # Look up the admin metadata of frozen datasets in the dataset index.
+        self._dataset_index = None
+        if get_config_flag("DTOOL_IRODS_DATASET_INDEX", config_path):
+            self._dataset_index = _get_dataset_index(config_path)
+            self._dataset_index_max_age = _get_dataset_index_max_age(
+                config_path
+            )
+
+        # Keep the metadata of the dataset on disk, keyed by UUID.
+        self._dataset_metadata_cache = None
+        if get_config_flag(
+            "DTOOL_IRODS_METADATA_CACHE",
+            config_path=config_path
+        ):
+            self._dataset_metadata_cache = MetadataCache(
+                cache_abspath=self._irods_cache_abspath,
+                dataset_abspath=self._abspath,
+                transport=self._transport,
+                admin_metadata_key=self.get_admin_metadata_key(),
+                immutable_keys=[
+                    self.get_manifest_key(),
+                    self.get_structure_key(),
+                    self.get_dtool_readme_key(),
+                ],
+                exclude=self._data_abspath
+            )
+
+        # Have iRODS register the checksum when items are uploaded so that
+        # get_hash can use it without the server re-reading the data.
+        self._checksum_on_upload = get_config_flag(
+            "DTOOL_IRODS_CHECKSUM_ON_UPLOAD",
+            config_path=config_path
+        )
+        # Always have the server verify checksums in get_hash.
+        self._audit_checksums = get_config_flag(
+            "DTOOL_IRODS_AUDIT_CHECKSUMS",
+            config_path=config_path
+        )
+
+        # Number of concurrent transfers used by the batch methods.
+        self._max_workers = int(get_config_value(
+            "DTOOL_IRODS_MAX_WORKERS",
+            config_path=config_path,
+            default=DEFAULT_MAX_WORKERS
+        ))
+
+        # Skip items already uploaded, e.g. by an interrupted run, with the
+        # same size and hash.
+        self._resume = get_config_flag(
+            "DTOOL_IRODS_RESUME",
+            config_path=config_path
+        )
+        self._resume_listing = None
+
+        # Files below this local path, on a file system that is also an
+        # iRODS vault, are registered in place rather than uploaded.
+        self._register_prefix = get_config_value(
+            "DTOOL_IRODS_REGISTER_PREFIX",
+            config_path=config_path
+        )
+        if self._register_prefix is not None:
+            self._register_prefix = os.path.realpath(self._register_prefix)
+        self._register_resource = get_config_value(
+            "DTOOL_IRODS_REGISTER_RESOURCE",
+            config_path=config_path
+        )
+
+        # Read items from the vault file system of the iRODS resource where
+        # it is mounted on this host, instead of downloading them.
+        self._vault_read = get_config_value(
+            "DTOOL_IRODS_VAULT_READ",
+            config_path=config_path
+        )
+        if self._vault_read not in (None, VAULT_READ_PATH, VAULT_READ_LINK):
+            raise(ValueError(
+                "Unknown DTOOL_IRODS_VAULT_READ mode: {}".format(
+                    self._vault_read
+                )
+            ))
+        self._vault_mounts = _parse_vault_mounts(get_config_value(
+            "DTOOL_IRODS_VAULT_MOUNTS",
+            config_path=config_path
+        ))
+        self._vault_abspaths = None
+
+        # Number of parallel streams used to transfer an item: a number,
+        # "auto" to pick it from the size of the item, or None to leave the
+        # choice to iRODS.
+        self._transfer_threads = get_config_value(
+            "DTOOL_IRODS_TRANSFER_THREADS",
+            config_path=config_path
+        )
+        self._transfer_records = {}
+
+        # Number of items to download ahead of sequential access, and the
+        # maximum number of bytes to download ahead.
+        self._read_ahead_depth = int(get_config_value(
+            "DTOOL_IRODS_READ_AHEAD",
+            config_path=config_path,
+            default=0
+        ))
+        self._read_ahead_budget = int(get_config_value(
+            "DTOOL_IRODS_READ_AHEAD_BUDGET",
+            config_path=config_path,
+            default=DEFAULT_READ_AHEAD_BUDGET
+        ))
+        self._read_ahead = None
+        self._manifest_cache = None
+        self._extension_cache = None
+
         # Cache for optimisation
+        self._cache_lock = threading.RLock()
         self._use_cache = False
         self._ls_abspath_cache = {}
         self._metadata_cache = {}
         self._size_and_timestamp_cache = {}
-        self._metadata_dir_exists_cache = None
+        self._checksum_cache = {}
+        self._item_metadata_index = None
+
+        # Item metadata added before freezing is buffered and written out in
+        # JSON-lines fragments holding up to this many entries.
+        self._item_metadata_batch_size = int(get_config_value(
+            "DTOOL_IRODS_ITEM_METADATA_BATCH_SIZE",
+            config_path=config_path,
+            default=DEFAULT_ITEM_METADATA_BATCH_SIZE
+        ))
+        self._item_metadata_buffer = _ItemMetadataBuffer(
+            self._transport,
+            self._metadata_fragments_abspath
+        )
+
+        # Hashes computed while uploading items, kept for the lifetime of
+        # the broker rather than the freeze.
+        self._local_hash_cache = {}
 
     # Generic helper functions.
 
     def _generate_abspath(self, key):
         return os.path.join(self._abspath, *self._structure_parameters[key])
 
+    # The caches are shared by the worker threads of the batch methods. The
+    # lock guards access to them, but not the calls to iRODS.
+
     def _ls_abspaths_with_cache(self, irods_path):
-        if self._use_cache:
-            if irods_path in self._ls_abspath_cache:
-                return self._ls_abspath_cache[irods_path]
+        with self._cache_lock:
+            if self._use_cache:
+                if irods_path in self._ls_abspath_cache:
+                    return self._ls_abspath_cache[irods_path]
 
         abspaths = []
-        for f in _ls(irods_path):
+        for f in self._transport.ls(irods_path):
             abspaths.append(os.path.join(irods_path, f))
 
-        if self._use_cache:
-            self._ls_abspath_cache[irods_path] = abspaths
+        with self._cache_lock:
+            if self._use_cache:
+                self._ls_abspath_cache[irods_path] = abspaths
 
         return abspaths
 
     def _get_metadata_with_cache(self, irods_path, key):
-        if self._use_cache:
-            if irods_path in self._metadata_cache:
-                if key in self._metadata_cache[irods_path]:
-                    return self._metadata_cache[irods_path][key]
-
-        cmd = CommandWrapper(["imeta", "ls", "-d", irods_path, key])
-        cmd()
-        text = cmd.stdout
-        value_line = text.split('\n')[2]
-
-        if ":" not in value_line:
-            raise(IrodsNoMetaDataSetError())
+        with self._cache_lock:
+            if self._use_cache:
+                if irods_path in self._metadata_cache:
+                    if key in self._metadata_cache[irods_path]:
+                        return self._metadata_cache[irods_path][key]
 
-        value = value_line.split(":")[1]
-        value = value.strip()
+        value = self._transport.get_metadata(irods_path, key)
 
-        if self._use_cache:
-            self._metadata_cache.setdefault(
-                irods_path, {}).update({key: value})
+        with self._cache_lock:
+            if self._use_cache:
+                self._metadata_cache.setdefault(
+                    irods_path, {}).update({key: value})
 
         return value
 
-    def _build_size_and_timestamp_cache(self):
-        cmd = CommandWrapper(["ils", "-l", self._data_abspath])
-        cmd()
-        text = cmd.stdout.strip()
-        for line in text.split("\n")[1:]:
-            line = line.strip()
-            info = line.split()
-            size_in_bytes_str = info[3]
-            size_in_bytes = int(size_in_bytes_str)
-            time_str = info[4]
-            dt = datetime.datetime.strptime(time_str, "%Y-%m-%d.%H:%M")
-            utc_timestamp = int(time.mktime(dt.timetuple()))
-            fname = info[6]
-            fpath = os.path.join(self._data_abspath, fname)
-            self._size_and_timestamp_cache[fpath] = (
-                size_in_bytes,
-                utc_timestamp
-            )
+    def _build_catalog_cache(self):
+        """Fill the caches used when freezing from a single catalog query."""
+        catalog = self._transport.query_catalog(self._data_abspath)
+        with self._cache_lock:
+            abspaths = []
+            for fname, entry in catalog.items():
+                fpath = os.path.join(self._data_abspath, fname)
+                abspaths.append(fpath)
+                self._metadata_cache.setdefault(
+                    fpath, {}).update({"handle": entry.handle})
+                self._size_and_timestamp_cache[fpath] = (
+                    entry.size_in_bytes,
+                    entry.utc_timestamp
+                )
+                if entry.checksum:
+                    self._checksum_cache[fpath] = entry.checksum
+            self._ls_abspath_cache[self._data_abspath] = abspaths
 
     def _get_size_and_timestamp_with_cache(self, irods_path):
-        if self._use_cache:
-            if irods_path in self._size_and_timestamp_cache:
-                return self._size_and_timestamp_cache[irods_path]
-
-        cmd = CommandWrapper(["ils", "-l", irods_path])
-        cmd()
-        text = cmd.stdout.strip()
-        first_line = text.split("\n")[0].strip()
-        info = first_line.split()
-        size_in_bytes_str = info[3]
-        size_in_bytes = int(size_in_bytes_str)
-        time_str = info[4]
-        dt = datetime.datetime.strptime(time_str, "%Y-%m-%d.%H:%M")
-        utc_timestamp = int(time.mktime(dt.timetuple()))
-
-        return size_in_bytes, utc_timestamp
+        with self._cache_lock:
+            if self._use_cache:
+                if irods_path in self._size_and_timestamp_cache:
+                    return self._size_and_timestamp_cache[irods_path]
+
+        return self._transport.get_size_and_timestamp(irods_path)
+
+    def _get_checksum_with_cache(self, irods_path):
+        if self._audit_checksums:
+            return self._transport.get_checksum(irods_path, verify=True)
+
+        with self._cache_lock:
+            if self._use_cache:
+                if irods_path in self._checksum_cache:
+                    return self._checksum_cache[irods_path]
+
+        return self._transport.get_checksum(
+            irods_path,
+            verify=not self._checksum_on_upload
+        )
 
     def _get_item_key_from_handle(self, handle):
         fname = generate_identifier(handle)
         return os.path.join(self._data_abspath, fname)
 
-    def _handle_to_fragment_absprefixpath(self, handle):
-        stem = generate_identifier(handle)
-        return os.path.join(self._metadata_fragments_abspath, stem)
+    def _read_item_metadata_fragments(self):
+        """Return dict mapping identifiers to the metadata in the fragments.
 
-    def _metadata_dir_exists(self):
-        if self._use_cache:
-            if self._metadata_dir_exists_cache is None:
-                self._metadata_dir_exists_cache = \
-                    _path_exists(self._metadata_fragments_abspath)
-            return self._metadata_dir_exists_cache
-        return _path_exists(self._metadata_fragments_abspath)
+        The fragments collection is downloaded in a single recursive
+        transfer into a temporary directory, removed once read. Fragments
+        holding a single value, named ``identifier.key.json``, were written
+        by earlier versions and are still read.
+        """
+        metadata = {}
+        if not self._transport.path_exists(self._metadata_fragments_abspath):
+            return metadata
+
+        tmp_dir = tempfile.mkdtemp(prefix="dtool-irods-fragments-")
+        try:
+            fragments_dir = os.path.join(tmp_dir, "fragments")
+            self._transport.get_collection(
+                self._metadata_fragments_abspath,
+                fragments_dir
+            )
+            for fname in sorted(os.listdir(fragments_dir)):
+                fpath = os.path.join(fragments_dir, fname)
+                if fname.endswith(".jsonl"):
+                    with open(fpath) as fh:
+                        for line in fh:
+                            if not line.strip():
+                                continue
+                            entry = json.loads(line)
+                            metadata.setdefault(entry["identifier"], {})[
+                                entry["key"]] = entry["value"]
+                elif fname.endswith(".json"):
+                    identifier = fname.split('.')[0]
+                    key = fname.split('.')[-2]  # identifier.key.json
+                    with open(fpath) as fh:
+                        metadata.setdefault(identifier, {})[key] = \
+                            json.load(fh)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        return metadata
 
     # Class methods to override.
 
     @classmethod
     def list_dataset_uris(cls, base_uri, config_path):
-        """Return list containing URIs in base_uri."""
+        """Yield URIs of the datasets in base_uri.
+
+        The datasets are found using a single catalog query and the URIs are
+        yielded as the results arrive.
+        """
         parsed_uri = generous_parse_uri(base_uri)
         irods_path = parsed_uri.path
 
-        uri_list = []
-
         logger.info("irods_path: '{}'".format(irods_path))
 
-        for dir_path in _ls_abspaths(irods_path):
+        if get_config_flag("DTOOL_IRODS_DATASET_INDEX", config_path):
+            index = _get_dataset_index(config_path)
+            _refresh_dataset_index_if_stale(index, irods_path, config_path)
+            for uri in index.list_uris(irods_path):
+                yield uri
+            return
+
+        transport = get_transport(config_path)
+        for dir_path in transport.iter_dataset_paths(irods_path):
 
             logger.info("dir path: '{}'".format(dir_path))
 
             base, uuid = os.path.split(dir_path)
             base_uri = "irods:{}".format(base)
-            uri = cls.generate_uri(
+            yield cls.generate_uri(
                 name=None,
                 uuid=uuid,
                 base_uri=base_uri
             )
 
-            storage_broker = cls(uri, config_path)
+    @classmethod
+    def search_datasets(cls, base_uris, config_path=None, name=None,
+                        creator=None, tag=None, frozen_after=None,
+                        frozen_before=None):
+        """Return descriptions of the datasets in base_uris matching all the
+        criteria given.
+
+        The datasets are looked up in the local dataset index, which is
+        refreshed first if it is older than the
+        ``DTOOL_IRODS_DATASET_INDEX_MAX_AGE`` configuration value.
+
+        :param base_uris: list of base URIs to search
+        :param config_path: path to dtool configuration file
+        :param name: shell style pattern the dataset name must match
+        :param creator: user name of the creator
+        :param tag: tag the dataset must have
+        :param frozen_after: earliest freeze time, as a UTC timestamp
+        :param frozen_before: latest freeze time, as a UTC timestamp
+        :returns: list of dictionaries with the keys uri, base_uri, uuid,
+                  name, creator, frozen_at, size_in_bytes and tags
+        """
+        index = _get_dataset_index(config_path)
+        irods_paths = [generous_parse_uri(u).path for u in base_uris]
+        for irods_path in irods_paths:
+            _refresh_dataset_index_if_stale(index, irods_path, config_path)
+        return index.search(
+            irods_paths=irods_paths,
+            name=name,
+            creator=creator,
+            tag=tag,
+            frozen_after=frozen_after,
+            frozen_before=frozen_before
+        )
+
+    @classmethod
+    def list_dataset_uris_with_tag(cls, base_uri, tag, config_path=None):
+        """Return sorted list of URIs of the datasets below base_uri with the
+        tag.
 
-            if storage_broker.has_admin_metadata():
-                uri_list.append(uri)
+        The datasets are found using a single catalog query on the AVUs
+        mirroring the tags.
+        """
+        irods_path = generous_parse_uri(base_uri).path
+        transport = get_transport(config_path)
+        collections = transport.query_collections_with_metadata(
+            irods_path,
+            TAG_AVU_PREFIX + tag
+        )
+        return ["irods:" + p for p in collections]
 
-        return uri_list
+    @classmethod
+    def list_dataset_uris_with_annotation(cls, base_uri, annotation_name,
+                                          annotation=None, config_path=None):
+        """Return sorted list of URIs of the datasets below base_uri with the
+        annotation, set to the given value if not None.
+
+        The datasets are found using a single catalog query on the AVUs
+        mirroring the annotations.
+        """
+        irods_path = generous_parse_uri(base_uri).path
+        value = None
+        if annotation is not None:
+            value = _annotation_avu_value(annotation)
+        transport = get_transport(config_path)
+        collections = transport.query_collections_with_metadata(
+            irods_path,
+            ANNOTATION_AVU_PREFIX + annotation_name,
+            value
+        )
+        return ["irods:" + p for p in collections]
 
     @classmethod
     def generate_uri(cls, name, uuid, base_uri):
@@ -436,15 +730,27 @@ class IrodsStorageBroker(BaseStorageBroker):
     # Methods to override.
 
     def get_text(self, key):
-        return _get_text(key)
+        if self._dataset_metadata_cache is not None:
+            return self._dataset_metadata_cache.get_text(
+                key,
+                self._transport.get_text
+            )
+        return self._transport.get_text(key)
 
     def put_text(self, key, text):
         parent_dir = os.path.dirname(key)
-        _mkdir_if_missing(parent_dir)
-        _put_text(key, text)
+        self._transport.mkdir_if_missing(parent_dir)
+        self._transport.put_text(key, text)
+        if self._dataset_index is not None \
+                and key == self.get_admin_metadata_key():
+            self._dataset_index.invalidate("irods:" + self._abspath)
+        if self._dataset_metadata_cache is not None:
+            self._dataset_metadata_cache.invalidate(key)
 
     def delete_key(self, key):
-        _rm_if_exists(key)
+        self._transport.rm_if_exists(key)
+        if self._dataset_metadata_cache is not None:
+            self._dataset_metadata_cache.invalidate(key)
 
     def get_admin_metadata_key(self):
         return self._generate_abspath("admin_metadata_relpath")
@@ -473,17 +779,124 @@ class IrodsStorageBroker(BaseStorageBroker):
     def get_dtool_readme_key(self):
         return self._generate_abspath("dtool_readme_relpath")
 
+    def put_tag(self, tag):
+        """Annotate the dataset with a tag.
+
+        The tag is also set as an AVU on the dataset collection.
+
+        :param tag: tag
+        """
+        super(IrodsStorageBroker, self).put_tag(tag)
+        self._put_collection_avu(TAG_AVU_PREFIX + tag, tag)
+
+    def delete_tag(self, tag):
+        """Delete a tag from a dataset.
+
+        :param tag: tag
+        """
+        super(IrodsStorageBroker, self).delete_tag(tag)
+        self._delete_collection_avu(TAG_AVU_PREFIX + tag)
+
+    def put_annotation(self, annotation_name, annotation):
+        """Set/update value of the annotation associated with the key.
+
+        The annotation is also set, as JSON, as an AVU on the dataset
+        collection; as the sha256 hash of the JSON if too long for an AVU.
+        """
+        super(IrodsStorageBroker, self).put_annotation(
+            annotation_name,
+            annotation
+        )
+        self._put_collection_avu(
+            ANNOTATION_AVU_PREFIX + annotation_name,
+            _annotation_avu_value(annotation)
+        )
+
+    def delete_annotation(self, annotation_name):
+        """Delete an annotation from a dataset."""
+        super(IrodsStorageBroker, self).delete_annotation(annotation_name)
+        self._delete_collection_avu(ANNOTATION_AVU_PREFIX + annotation_name)
+
+    def _put_collection_avu(self, key, value):
+        # The AVUs only mirror the tags and annotations; failing to set one
+        # must not fail writing them.
+        try:
+            self._transport.put_collection_metadata(self._abspath, key, value)
+        except (Exception, SystemExit) as e:
+            logger.warning("Failed to set AVU {}: {}".format(key, e))
+
+    def _delete_collection_avu(self, key):
+        try:
+            self._transport.delete_collection_metadata(self._abspath, key)
+        except (Exception, SystemExit) as e:
+            logger.warning("Failed to delete AVU {}: {}".format(key, e))
+
+    def mirror_tags_and_annotations(self):
+        """Set AVUs for the existing tags and annotations of the dataset.
+
+        For datasets tagged or annotated before tags and annotations were
+        mirrored as AVUs.
+        """
+        for tag in self.list_tags():
+            self._transport.put_collection_metadata(
+                self._abspath,
+                TAG_AVU_PREFIX + tag,
+                tag
+            )
+        for annotation_name in self.list_annotation_names():
+            self._transport.put_collection_metadata(
+                self._abspath,
+                ANNOTATION_AVU_PREFIX + annotation_name,
+                _annotation_avu_value(self.get_annotation(annotation_name))
+            )
+
+    def get_admin_metadata(self):
+        """Return the admin metadata as a dictionary.
+
+        The admin metadata of frozen datasets is looked up in the dataset
+        index, if enabled and recently refreshed.
+        """
+        if self._dataset_index is not None:
+            base_path = os.path.dirname(self._abspath)
+            if not self._dataset_index.is_stale(
+                base_path,
+                self._dataset_index_max_age
+            ):
+                admin_metadata = self._dataset_index.get_admin_metadata(
+                    "irods:" + self._abspath
+                )
+                if admin_metadata is not None \
+                        and admin_metadata.get("frozen_at") is not None:
+                    return admin_metadata
+        return super(IrodsStorageBroker, self).get_admin_metadata()
+
     def has_admin_metadata(self):
         """Return True if the administrative metadata exists.
 
         This is the definition of being a "dataset".
         """
-        return _path_exists(self.get_admin_metadata_key())
+        return self._transport.path_exists(self.get_admin_metadata_key())
+
+    def _ls_with_metadata_cache(self, irods_path):
+        """Return names of the data objects in irods_path.
+
+        Uses the modification times looked up by the metadata cache instead
+        of listing the collection.
+        """
+        tree = self._dataset_metadata_cache.tree()
+        return sorted(
+            os.path.basename(p) for p in tree
+            if os.path.dirname(p) == irods_path
+        )
 
     def list_overlay_names(self):
         """Return list of overlay names."""
+        if self._dataset_metadata_cache is not None:
+            fnames = self._ls_with_metadata_cache(self._overlays_abspath)
+        else:
+            fnames = self._transport.ls(self._overlays_abspath)
         overlay_names = []
-        for fname in _ls(self._overlays_abspath):
+        for fname in fnames:
             name, ext = os.path.splitext(fname)
             overlay_names.append(name)
         return overlay_names
@@ -491,69 +904,537 @@ class IrodsStorageBroker(BaseStorageBroker):
     def list_annotation_names(self):
         """Return list of annotation names."""
         annotation_names = []
-        if not _path_exists(self._annotations_abspath):
+        if self._dataset_metadata_cache is not None:
+            fnames = self._ls_with_metadata_cache(self._annotations_abspath)
+        elif not self._transport.path_exists(self._annotations_abspath):
             return annotation_names
-        for fname in _ls(self._annotations_abspath):
+        else:
+            fnames = self._transport.ls(self._annotations_abspath)
+        for fname in fnames:
             name, ext = os.path.splitext(fname)
             annotation_names.append(name)
         return annotation_names
 
     def list_tags(self):
         """Return list of tags."""
+        if self._dataset_metadata_cache is not None:
+            return self._ls_with_metadata_cache(self._tags_abspath)
         tags = []
-        if not _path_exists(self._tags_abspath):
+        if not self._transport.path_exists(self._tags_abspath):
             return tags
-        for tag in _ls(self._tags_abspath):
+        for tag in self._transport.ls(self._tags_abspath):
             tags.append(tag)
         return tags
 
     def get_item_abspath(self, identifier):
         """Return absolute path at which item content can be accessed.
 
+        If read-ahead is enabled, using the ``DTOOL_IRODS_READ_AHEAD``
+        configuration value, sequential access of the items, in the order of
+        the manifest, results in the following items being downloaded in the
+        background.
+
         :param identifier: item identifier
         :returns: absolute path from which the item content can be accessed
         """
+        if self._vault_read == VAULT_READ_PATH:
+            vault_abspath = self._get_vault_abspath(identifier)
+            if vault_abspath is not None:
+                return vault_abspath
+        if self._read_ahead_depth > 0:
+            return self._get_read_ahead().get(identifier)
+        return self._get_item_abspath(identifier)
+
+    def open_item(self, identifier):
+        """Return binary file-like object reading the item from iRODS.
+
+        Unlike :meth:`get_item_abspath` the item is not downloaded into the
+        cache first; its content is streamed from iRODS as it is read, with
+        bounded memory use. The object should be closed, or used as a
+        context manager; closing it early stops the transfer.
+
+        :param identifier: item identifier
+        :returns: binary file-like object
+        """
+        irods_item_path = os.path.join(self._data_abspath, identifier)
+        return self._transport.open(irods_item_path)
+
+    def iter_item_chunks(self, identifier, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Yield the content of the item, streamed from iRODS, in chunks.
+
+        The transfer stops when the generator is closed.
+
+        :param identifier: item identifier
+        :param chunk_size: maximum number of bytes in a chunk
+        """
+        return iter_chunks(self.open_item(identifier), chunk_size)
+
+    def read_item_range(self, identifier, offset, length):
+        """Return length bytes of the item starting at offset.
+
+        Only the bytes requested are transferred from iRODS; fewer are
+        returned at the end of the item.
+
+        :param identifier: item identifier
+        :param offset: position of the first byte to read
+        :param length: maximum number of bytes to read
+        :returns: bytes
+        """
+        irods_item_path = os.path.join(self._data_abspath, identifier)
+        return self._transport.read_range(irods_item_path, offset, length)
+
+    def open_item_seekable(self, identifier, block_size=DEFAULT_BLOCK_SIZE,
+                           cache_blocks=DEFAULT_CACHE_BLOCKS):
+        """Return seekable binary file-like object reading the item.
+
+        Byte ranges are read from iRODS, using :meth:`read_item_range`, as
+        they are accessed, in whole blocks of block_size bytes. The most
+        recently used blocks are kept in memory.
+
+        :param identifier: item identifier
+        :param block_size: number of bytes in a block
+        :param cache_blocks: maximum number of blocks kept in memory
+        :returns: :class:`dtool_irods.streaming.RangeReader`
+        """
+        items = self._get_manifest_with_cache()["items"]
+
+        def read_range(offset, length):
+            return self.read_item_range(identifier, offset, length)
+
+        return RangeReader(
+            read_range,
+            items[identifier]["size_in_bytes"],
+            block_size=block_size,
+            cache_blocks=cache_blocks
+        )
+
+    def _get_read_ahead(self):
+        with self._cache_lock:
+            if self._read_ahead is None:
+                items = self._get_manifest_with_cache()["items"]
+                self._read_ahead = ReadAhead(
+                    fetch=self._get_item_abspath,
+                    order=list(items.keys()),
+                    sizes=dict(
+                        (i, p["size_in_bytes"]) for i, p in items.items()
+                    ),
+                    depth=self._read_ahead_depth,
+                    budget=self._read_ahead_budget,
+                    max_workers=self._max_workers
+                )
+            return self._read_ahead
+
+    def _get_item_abspath(self, identifier):
         if not hasattr(self, "_admin_metadata_cache"):
             self._admin_metadata_cache = self.get_admin_metadata()
         admin_metadata = self._admin_metadata_cache
 
         uuid = admin_metadata["uuid"]
-        # Create directory for the specific dataset.
         dataset_cache_abspath = os.path.join(self._irods_cache_abspath, uuid)
-        mkdir_parents(dataset_cache_abspath)
 
-        # Get the file extension from the  relpath from the handle metadata.
-        irods_item_path = os.path.join(self._data_abspath, identifier)
-        relpath = self._get_metadata_with_cache(irods_item_path, "handle")
-        _, ext = os.path.splitext(relpath)
+        # The file extension comes from the relpath in the manifest.
+        ext = self._get_extensions_with_cache(uuid)[identifier]
 
         local_item_abspath = os.path.join(
             dataset_cache_abspath,
             identifier + ext)
 
         if not os.path.isfile(local_item_abspath):
-            tmp_local_item_abspath = local_item_abspath + ".tmp"
-            _get_file_forcefully(irods_item_path, tmp_local_item_abspath)
-            os.rename(tmp_local_item_abspath, local_item_abspath)
+            # Create directory for the specific dataset.
+            mkdir_parents(dataset_cache_abspath)
+            irods_item_path = os.path.join(self._data_abspath, identifier)
+            stored_abspath = None
+            placed = self._vault_read == VAULT_READ_LINK \
+                and self._link_from_vault(identifier, local_item_abspath)
+            if self._content_addressed_cache and not placed:
+                placed, stored_abspath = self._link_from_content_store(
+                    identifier,
+                    irods_item_path,
+                    local_item_abspath
+                )
+            if not placed:
+                self._download(
+                    identifier,
+                    irods_item_path,
+                    local_item_abspath
+                )
+            if self._cache_manager is not None:
+                self._cache_manager.add(
+                    uuid,
+                    local_item_abspath,
+                    stored_abspath
+                )
+        elif self._cache_manager is not None:
+            self._cache_manager.record_access(uuid, local_item_abspath)
 
         return local_item_abspath
 
+    def _download(self, identifier, irods_path, local_abspath):
+        # Unique temporary path as concurrent downloads of the same item
+        # are possible.
+        tmp_local_abspath = _tmp_abspath(local_abspath)
+        self._get_item_file(identifier, irods_path, tmp_local_abspath)
+        os.rename(tmp_local_abspath, local_abspath)
+
+    def _get_item_file(self, identifier, irods_path, local_abspath):
+        """Download item using the number of streams suited to its size."""
+        manifest = self._get_manifest_with_cache()
+        size_in_bytes = manifest["items"][identifier]["size_in_bytes"]
+        threads = transfer_threads(size_in_bytes, self._transfer_threads)
+        start = time.time()
+        self._transport.get_file(
+            irods_path,
+            local_abspath,
+            force=True,
+            threads=threads
+        )
+        self._record_transfer(
+            TransferRecord(
+                identifier,
+                "get",
+                size_in_bytes,
+                time.time() - start,
+                threads
+            )
+        )
+
+    def _record_transfer(self, record):
+        logger.info(
+            "{} {} bytes of {} in {:.3f}s with {} streams".format(
+                record.direction,
+                record.size_in_bytes,
+                record.identifier,
+                record.seconds,
+                record.threads
+            )
+        )
+        with self._cache_lock:
+            self._transfer_records[(record.identifier, record.direction)] = \
+                record
+
+    def get_transfer_records(self):
+        """Return list of the latest transfer of every item, in each direction.
+
+        The records allow the throughput of the transfers to be checked
+        against the number of parallel streams used, see the
+        ``DTOOL_IRODS_TRANSFER_THREADS`` configuration value.
+
+        :returns: list of :class:`TransferRecord` tuples
+        """
+        with self._cache_lock:
+            return list(self._transfer_records.values())
+
+    def _get_manifest_with_cache(self):
+        with self._cache_lock:
+            if self._manifest_cache is None:
+                self._manifest_cache = self.get_manifest()
+            return self._manifest_cache
+
+    def _get_extensions_with_cache(self, uuid):
+        """Return dictionary mapping identifiers to file extensions.
+
+        The dictionary is built from the manifest and stored beside the
+        dataset cache directory, so that it only needs to be built once for
+        every frozen dataset.
+        """
+        with self._cache_lock:
+            if self._extension_cache is not None:
+                return self._extension_cache
+
+            fpath = os.path.join(
+                self._irods_cache_abspath,
+                uuid + ".extensions.json"
+            )
+            try:
+                with open(fpath) as fh:
+                    self._extension_cache = json.load(fh)
+            except (IOError, OSError, ValueError):
+                items = self._get_manifest_with_cache()["items"]
+                self._extension_cache = dict(
+                    (i, os.path.splitext(p["relpath"])[1])
+                    for i, p in items.items()
+                )
+                mkdir_parents(self._irods_cache_abspath)
+                tmp_fpath = _tmp_abspath(fpath)
+                with open(tmp_fpath, "w") as fh:
+                    json.dump(self._extension_cache, fh)
+                os.rename(tmp_fpath, fpath)
+            return self._extension_cache
+
+    def _map_vault_path(self, physical_path):
+        """Return local path of a physical path in the vault, or None."""
+        if not self._vault_mounts:
+            return physical_path
+        for vault, mount in self._vault_mounts:
+            if physical_path == vault \
+                    or physical_path.startswith(vault + "/"):
+                return mount + physical_path[len(vault):]
+        return None
+
+    def _resolve_vault_abspaths(self):
+        """Return dict mapping identifiers to the local paths of replicas.
+
+        The physical paths of all the items are looked up in a single
+        catalog query. Only good replicas whose size, and checksum if there
+        is one, match the manifest are used; stale replicas are left out.
+        """
+        items = self._get_manifest_with_cache()["items"]
+        replicas = self._transport.query_replicas(self._data_abspath)
+        vault_abspaths = {}
+        for identifier, properties in items.items():
+            for replica in replicas.get(identifier, []):
+                if not replica.good or replica.physical_path is None:
+                    continue
+                if replica.size_in_bytes != properties["size_in_bytes"]:
+                    continue
+                if replica.checksum:
+                    irods_hash = base64_to_hex(replica.checksum)
+                    if len(irods_hash) == len(properties["hash"]) \
+                            and irods_hash != properties["hash"]:
+                        continue
+                local_abspath = self._map_vault_path(replica.physical_path)
+                if local_abspath is not None:
+                    vault_abspaths[identifier] = local_abspath
+                    break
+        return vault_abspaths
+
+    def _get_vault_abspath(self, identifier):
+        """Return path of the item on the vault mount, or None.
+
+        None is returned if the item has no usable replica or the file on
+        the mount does not have the size recorded in the manifest.
+        """
+        with self._cache_lock:
+            if self._vault_abspaths is None:
+                self._vault_abspaths = self._resolve_vault_abspaths()
+            vault_abspath = self._vault_abspaths.get(identifier)
+        if vault_abspath is None:
+            return None
+
+        items = self._get_manifest_with_cache()["items"]
+        try:
+            size_in_bytes = os.path.getsize(vault_abspath)
+        except OSError as e:
+            logger.debug("Cannot read {}: {}".format(vault_abspath, e))
+            return None
+        if size_in_bytes != items[identifier]["size_in_bytes"]:
+            logger.warning("Stale replica of {}: {}".format(
+                identifier,
+                vault_abspath
+            ))
+            return None
+        return vault_abspath
+
+    def _link_from_vault(self, identifier, local_abspath):
+        """Hard link the item from the vault mount into the cache.
+
+        Returns False if the item is not on the mount or cannot be linked,
+        e.g. because the cache is on another file system.
+        """
+        vault_abspath = self._get_vault_abspath(identifier)
+        if vault_abspath is None:
+            return False
+        tmp_local_abspath = _tmp_abspath(local_abspath)
+        try:
+            os.link(vault_abspath, tmp_local_abspath)
+        except OSError as e:
+            logger.debug("Failed to link {}: {}".format(vault_abspath, e))
+            return False
+        os.rename(tmp_local_abspath, local_abspath)
+        return True
+
+    def _link_from_content_store(self, identifier, irods_path, local_abspath):
+        """Hard link the item content from the content store.
+
+        The content is downloaded into the store first if need be. Returns
+        a (placed, stored_abspath) tuple: placed is True if the item is now
+        at local_abspath, and stored_abspath is the path of the content in
+        the store it is linked to, or None if it is a copy of its own.
+        """
+        manifest = self._get_manifest_with_cache()
+        # The store is keyed by sha256; datasets hashed differently, e.g.
+        # copied in from other storage brokers, cannot use it.
+        if manifest.get("hash_function") != self.hasher.name:
+            return False, None
+        hexdigest = manifest["items"][identifier]["hash"]
+        stored_abspath = content_abspath(self._irods_cache_abspath, hexdigest)
+
+        if not os.path.isfile(stored_abspath):
+            mkdir_parents(os.path.dirname(stored_abspath))
+            tmp_stored_abspath = _tmp_abspath(stored_abspath)
+            self._get_item_file(identifier, irods_path, tmp_stored_abspath)
+            # Content not matching its hash must not be shared.
+            if sha256sum_hexdigest(tmp_stored_abspath) != hexdigest:
+                logger.warning(
+                    "Content of {} does not match hash {}".format(
+                        irods_path,
+                        hexdigest
+                    )
+                )
+                os.rename(tmp_stored_abspath, local_abspath)
+                return True, None
+            os.rename(tmp_stored_abspath, stored_abspath)
+
+        tmp_local_abspath = _tmp_abspath(local_abspath)
+        try:
+            os.link(stored_abspath, tmp_local_abspath)
+        except OSError as e:
+            # Hard links not supported, or the content evicted meanwhile.
+            logger.debug("Failed to link {}: {}".format(stored_abspath, e))
+            if e.errno == errno.ENOENT:
+                return False, None
+            shutil.copyfile(stored_abspath, tmp_local_abspath)
+            os.rename(tmp_local_abspath, local_abspath)
+            return True, None
+        os.rename(tmp_local_abspath, local_abspath)
+        return True, stored_abspath
+
+    def iter_prefetch(self, identifiers, max_workers=None):
+        """Download items into the cache concurrently.
+
+        Yields (identifier, absolute path) tuples, in the order in which the
+        items become available, with the absolute paths being the same as
+        those returned by :meth:`get_item_abspath`. Items that are already
+        cached, or read from the vault file system, are not downloaded.
+
+        :param identifiers: iterable of item identifiers
+        :param max_workers: number of concurrent downloads, defaults to the
+                            ``DTOOL_IRODS_MAX_WORKERS`` configuration value
+        """
+        if max_workers is None:
+            max_workers = self._max_workers
+
+        # Look up the dataset UUID once rather than in every worker.
+        if not hasattr(self, "_admin_metadata_cache"):
+            self._admin_metadata_cache = self.get_admin_metadata()
+
+        unique_identifiers = []
+        seen = set()
+        for identifier in identifiers:
+            if identifier not in seen:
+                seen.add(identifier)
+                unique_identifiers.append(identifier)
+
+        if self._vault_read == VAULT_READ_PATH:
+            to_download = []
+            for identifier in unique_identifiers:
+                vault_abspath = self._get_vault_abspath(identifier)
+                if vault_abspath is None:
+                    to_download.append(identifier)
+                else:
+                    yield identifier, vault_abspath
+            unique_identifiers = to_download
+
+        def fetch(identifier):
+            try:
+                return identifier, self._get_item_abspath(identifier), None
+            # Hand any failure, including the SystemExit raised by failing
+            # iCommands, back to the calling thread.
+            except (Exception, SystemExit) as e:
+                return identifier, None, e
+
+        pool = ThreadPool(max_workers)
+        try:
+            for identifier, abspath, error in pool.imap_unordered(
+                    fetch, unique_identifiers):
+                if error is not None:
+                    raise(error)
+                yield identifier, abspath
+        finally:
+            # Stop scheduling downloads if the caller stops early.
+            pool.terminate()
+            pool.join()
+
+    def prefetch(self, identifiers, max_workers=None):
+        """Download items into the cache concurrently.
+
+        See :meth:`iter_prefetch`.
+
+        :returns: dictionary mapping identifiers to the absolute paths of the
+                  cached items
+        """
+        return dict(self.iter_prefetch(identifiers, max_workers=max_workers))
+
+    def export_items(self, dest_abspath):
+        """Download all the items into a directory, named by their relpaths.
+
+        Rather than downloading the items one by one the whole data
+        collection is downloaded in a single recursive transfer into a
+        staging directory in dest_abspath. The items are then moved to their
+        relpaths. The number of parallel streams is chosen from the total
+        size of the items, see the ``DTOOL_IRODS_TRANSFER_THREADS``
+        configuration value.
+
+        :param dest_abspath: absolute path of an existing local directory
+        :returns: dictionary mapping identifiers to the absolute paths of the
+                  items
+        :raises: StorageBrokerOSError if an item is missing from the data
+                 collection
+        """
+        items = self._get_manifest_with_cache()["items"]
+        size_in_bytes = sum(p["size_in_bytes"] for p in items.values())
+        threads = transfer_threads(size_in_bytes, self._transfer_threads)
+
+        # The staging directory is on the same file system as the
+        # destination so that the items can be renamed into place.
+        staging_abspath = tempfile.mkdtemp(
+            prefix=".dtool-irods-staging-",
+            dir=dest_abspath
+        )
+        try:
+            data_abspath = os.path.join(staging_abspath, "data")
+            start = time.time()
+            self._transport.get_collection(
+                self._data_abspath,
+                data_abspath,
+                threads=threads
+            )
+            logger.info(
+                "Downloaded {} items, {} bytes, in {:.3f}s".format(
+                    len(items),
+                    size_in_bytes,
+                    time.time() - start
+                )
+            )
+
+            item_abspaths = {}
+            for identifier, properties in items.items():
+                staged_abspath = os.path.join(data_abspath, identifier)
+                if not os.path.isfile(staged_abspath):
+                    raise(StorageBrokerOSError(
+                        "Item missing from {}: {}".format(
+                            self._data_abspath,
+                            identifier
+                        )
+                    ))
+                item_abspath = os.path.join(
+                    dest_abspath,
+                    *properties["relpath"].split("/")
+                )
+                mkdir_parents(os.path.dirname(item_abspath))
+                os.rename(staged_abspath, item_abspath)
+                item_abspaths[identifier] = item_abspath
+        finally:
+            shutil.rmtree(staging_abspath, ignore_errors=True)
+
+        return item_abspaths
+
     def _create_structure(self):
         """Create necessary structure to hold a dataset."""
 
         # Ensure that the specified path does not exist and create it.
-        if _path_exists(self._abspath):
+        if self._transport.path_exists(self._abspath):
             raise(StorageBrokerOSError(
                 "Path already exists: {}".format(self._abspath)
             ))
 
         # Make sure the parent collection exists.
         parent, _ = os.path.split(self._abspath)
-        if not _path_exists(parent):
+        if not self._transport.path_exists(parent):
             raise(StorageBrokerOSError(
                 "No such iRODS collection: {}".format(parent)))
 
-        _mkdir(self._abspath)
+        self._transport.mkdir(self._abspath)
 
         # Create more essential subdirectories.
         essential_subdirectories = [
@@ -563,27 +1444,244 @@ class IrodsStorageBroker(BaseStorageBroker):
             self._annotations_abspath
         ]
         for abspath in essential_subdirectories:
-            _mkdir_if_missing(abspath)
+            self._transport.mkdir_if_missing(abspath)
 
     def put_item(self, fpath, relpath):
         """Put item with content from fpath at relpath in dataset.
 
         Missing directories in relpath are created on the fly.
 
+        Files below the ``DTOOL_IRODS_REGISTER_PREFIX`` directory are
+        registered in place, with their handle, instead of being copied.
+        With ``DTOOL_IRODS_RESUME`` set, items already in iRODS with the same
+        size and hash are not uploaded again.
+
         :param fpath: path to the item on local disk
         :param relpath: relative path name given to the item in the dataset as
                         a handle
         """
-        # Put the file into iRODS.
         fname = generate_identifier(relpath)
         dest_path = os.path.join(self._data_abspath, fname)
-        _cp(fpath, dest_path)
+
+        if self._resume and self._is_already_present(fpath, fname, relpath):
+            return relpath
+
+        if self._is_registrable(fpath):
+            hexdigest = self._transport.register_file(
+                os.path.realpath(fpath),
+                dest_path,
+                {"handle": relpath},
+                checksum=self._checksum_on_upload,
+                resource=self._register_resource
+            )
+            # Without a hash the checksum registered by the server is used.
+            if hexdigest is not None:
+                with self._cache_lock:
+                    self._local_hash_cache[dest_path] = hexdigest
+            return relpath
+
+        # Put the file into iRODS.
+        size_in_bytes = os.path.getsize(fpath)
+        threads = transfer_threads(size_in_bytes, self._transfer_threads)
+        start = time.time()
+        hexdigest = self._transport.put_file(
+            fpath,
+            dest_path,
+            checksum=self._checksum_on_upload,
+            threads=threads
+        )
+        self._record_transfer(
+            TransferRecord(
+                fname,
+                "put",
+                size_in_bytes,
+                time.time() - start,
+                threads
+            )
+        )
+        with self._cache_lock:
+            self._local_hash_cache[dest_path] = hexdigest
 
         # Add the relpath handle as metadata.
-        _put_metadata(dest_path, "handle", relpath)
+        self._transport.put_metadata(dest_path, "handle", relpath)
 
         return relpath
 
+    def _get_resume_listing(self):
+        """Return dict mapping names of the data objects already in the
+        data collection to (size, checksum, handle) tuples.
+
+        The listing is retrieved once, from two catalog queries.
+        """
+        with self._cache_lock:
+            if self._resume_listing is None:
+                replicas = self._transport.query_replicas(self._data_abspath)
+                catalog = self._transport.query_catalog(self._data_abspath)
+                listing = {}
+                for name, name_replicas in replicas.items():
+                    good = [r for r in name_replicas if r.good] \
+                        or name_replicas
+                    checksums = [r.checksum for r in good if r.checksum]
+                    handle = None
+                    if name in catalog:
+                        handle = catalog[name].handle
+                    listing[name] = (
+                        good[0].size_in_bytes,
+                        checksums[0] if checksums else None,
+                        handle
+                    )
+                self._resume_listing = listing
+            return self._resume_listing
+
+    def _is_already_present(self, fpath, fname, relpath):
+        """Return True if the item is already in iRODS with the content of
+        fpath, repairing its handle metadata if need be.
+
+        The sizes are compared first; the local file is only hashed if they
+        match.
+        """
+        entry = self._get_resume_listing().get(fname)
+        if entry is None:
+            return False
+        size_in_bytes, checksum, handle = entry
+        if size_in_bytes != os.path.getsize(fpath):
+            return False
+
+        dest_path = os.path.join(self._data_abspath, fname)
+        hexdigest = sha256sum_hexdigest(fpath)
+        if not checksum:
+            # Have the server compute the checksum of the stored data.
+            checksum = self._transport.get_checksum(dest_path, verify=False)
+        irods_hash = base64_to_hex(checksum)
+        if len(irods_hash) != len(hexdigest) or irods_hash != hexdigest:
+            return False
+
+        if handle != relpath:
+            logger.info("Repairing handle of {}".format(relpath))
+            self._transport.put_metadata(dest_path, "handle", relpath)
+        with self._cache_lock:
+            self._local_hash_cache[dest_path] = hexdigest
+        logger.debug("Already present: {}".format(relpath))
+        return True
+
+    def _is_registrable(self, fpath):
+        if self._register_prefix is None:
+            return False
+        relpath = os.path.relpath(
+            os.path.realpath(fpath),
+            self._register_prefix
+        )
+        return relpath != os.pardir \
+            and not relpath.startswith(os.pardir + os.sep)
+
+    def put_items(self, items, max_workers=None):
+        """Put many items into the dataset concurrently.
+
+        The uploads, and the writing of the handle metadata, are run on a pool
+        of worker threads. A failure to put one item does not stop the others
+        from being put.
+
+        :param items: iterable of (fpath, relpath) tuples, see :meth:`put_item`
+        :param max_workers: number of concurrent uploads, defaults to the
+                            ``DTOOL_IRODS_MAX_WORKERS`` configuration value
+        :returns: dictionary mapping the relpaths of the items that could not
+                  be put to the exceptions raised
+        """
+        if max_workers is None:
+            max_workers = self._max_workers
+
+        def put(item):
+            fpath, relpath = item
+            try:
+                self.put_item(fpath, relpath)
+            # The iCommands helpers exit on failure; that must not take down
+            # the worker thread, nor the batch.
+            except (Exception, SystemExit) as e:
+                logger.warning("Failed to put item {}: {}".format(relpath, e))
+                return relpath, e
+            return relpath, None
+
+        failures = {}
+        pool = ThreadPool(max_workers)
+        try:
+            for relpath, error in pool.imap_unordered(put, items):
+                if error is not None:
+                    failures[relpath] = error
+        finally:
+            pool.close()
+            pool.join()
+        return failures
+
+    def copy_items_from(self, src_storage_broker, max_workers=None,
+                        progressbar=None):
+        """Copy the items of another dataset in iRODS server side.
+
+        The data objects are copied by the iRODS servers, on a pool of
+        worker threads, without the data passing through this host. The
+        handle metadata is set on the copies, and their checksums are
+        registered and compared with those of the originals.
+
+        :param src_storage_broker: :class:`IrodsStorageBroker` of the dataset
+                                   to copy the items from
+        :param max_workers: number of concurrent copies, defaults to the
+                            ``DTOOL_IRODS_MAX_WORKERS`` configuration value
+        :returns: dictionary mapping the identifiers of the items that could
+                  not be copied to the exceptions raised
+        """
+        if max_workers is None:
+            max_workers = self._max_workers
+
+        src_catalog = src_storage_broker._transport.query_catalog(
+            src_storage_broker._data_abspath
+        )
+
+        def copy(item):
+            identifier, entry = item
+            try:
+                self._transport.copy_file(
+                    os.path.join(src_storage_broker._data_abspath, identifier),
+                    os.path.join(self._data_abspath, identifier),
+                    {"handle": entry.handle},
+                    checksum=True
+                )
+            # The iCommands helpers exit on failure; that must not take down
+            # the worker thread, nor the batch.
+            except (Exception, SystemExit) as e:
+                logger.warning(
+                    "Failed to copy item {}: {}".format(identifier, e)
+                )
+                return identifier, e
+            return identifier, None
+
+        failures = {}
+        pool = ThreadPool(max_workers)
+        try:
+            for identifier, error in pool.imap_unordered(
+                    copy, src_catalog.items()):
+                if error is not None:
+                    failures[identifier] = error
+                if progressbar:
+                    progressbar.update(1)
+        finally:
+            pool.close()
+            pool.join()
+
+        dest_catalog = self._transport.query_catalog(self._data_abspath)
+        for identifier, entry in src_catalog.items():
+            if identifier in failures or not entry.checksum:
+                continue
+            dest_entry = dest_catalog.get(identifier)
+            if dest_entry is not None and dest_entry.checksum \
+                    and dest_entry.checksum != entry.checksum:
+                failures[identifier] = IrodsChecksumMismatchError(
+                    "Checksum mismatch for {}: source {}, copy {}".format(
+                        identifier,
+                        entry.checksum,
+                        dest_entry.checksum
+                    )
+                )
+        return failures
+
     def iter_item_handles(self):
         """Return iterator over item handles."""
         for abspath in self._ls_abspaths_with_cache(self._data_abspath):
@@ -605,8 +1703,31 @@ class IrodsStorageBroker(BaseStorageBroker):
 
     def get_hash(self, handle):
         key = self._get_item_key_from_handle(handle)
-        checksum = _get_checksum(key)
-        return base64_to_hex(checksum)
+
+        with self._cache_lock:
+            local_hash = self._local_hash_cache.get(key)
+        if local_hash is None:
+            checksum = self._get_checksum_with_cache(key)
+            return base64_to_hex(checksum)
+
+        # The item was uploaded by this broker. Compare the hash computed
+        # whilst uploading it with any checksum iRODS already has to hand.
+        checksum = None
+        if self._audit_checksums:
+            checksum = self._transport.get_checksum(key, verify=True)
+        else:
+            with self._cache_lock:
+                if self._use_cache:
+                    checksum = self._checksum_cache.get(key)
+        if checksum:
+            irods_hash = base64_to_hex(checksum)
+            if len(irods_hash) == len(local_hash) and irods_hash != local_hash:
+                raise(IrodsChecksumMismatchError(
+                    "Checksum mismatch for {}: uploaded {}, iRODS {}".format(
+                        key, local_hash, irods_hash
+                    )
+                ))
+        return local_hash
 
 # According to the tests the below is not needed.
 #   def get_relpath(self, handle):
@@ -616,17 +1737,36 @@ class IrodsStorageBroker(BaseStorageBroker):
     def add_item_metadata(self, handle, key, value):
         """Store the given key:value pair for the item associated with handle.
 
+        The metadata is buffered and written to iRODS in batches, see
+        :meth:`flush_item_metadata`.
+
         :param handle: handle for accessing an item before the dataset is
                        frozen
         :param key: metadata key
         :param value: metadata value
         """
-        _mkdir_if_missing(self._metadata_fragments_abspath)
-
-        prefix = self._handle_to_fragment_absprefixpath(handle)
-        fpath = prefix + '.{}.json'.format(key)
+        entry = {
+            "identifier": generate_identifier(handle),
+            "key": key,
+            "value": value,
+        }
+        num_entries = self._item_metadata_buffer.append(entry)
+        if num_entries >= self._item_metadata_batch_size:
+            self.flush_item_metadata()
+
+    def flush_item_metadata(self):
+        """Write the buffered item metadata to a fragment in iRODS.
+
+        Called automatically when the buffer is full, before freezing, when
+        the broker is garbage collected and when the process exits.
+        """
+        self._item_metadata_buffer.flush()
 
-        _put_obj(fpath, value)
+    def __del__(self):
+        # The buffer may not have been created if __init__ failed.
+        buffer = self.__dict__.get("_item_metadata_buffer")
+        if buffer is not None:
+            buffer.flush_quietly()
 
     def get_item_metadata(self, handle):
         """Return dictionary containing all metadata associated with handle.
@@ -638,22 +1778,13 @@ class IrodsStorageBroker(BaseStorageBroker):
                        frozen
         :returns: dictionary containing item metadata
         """
-        if not self._metadata_dir_exists():
-            return {}
-
-        prefix = self._handle_to_fragment_absprefixpath(handle)
+        identifier = generate_identifier(handle)
+        with self._cache_lock:
+            if self._item_metadata_index is not None:
+                return dict(self._item_metadata_index.get(identifier, {}))
 
-        files = [f for f in self._ls_abspaths_with_cache(
-                 self._metadata_fragments_abspath)
-                 if f.startswith(prefix)]
-
-        metadata = {}
-        for f in files:
-            key = f.split('.')[-2]  # filename: identifier.key.json
-            value = _get_obj(f)
-            metadata[key] = value
-
-        return metadata
+        self.flush_item_metadata()
+        return self._read_item_metadata_fragments().get(identifier, {})
 
     def pre_freeze_hook(self):
         """Pre :meth:`dtoolcore.ProtoDataSet.freeze` actions.
@@ -662,10 +1793,17 @@ class IrodsStorageBroker(BaseStorageBroker):
         :meth:`dtoolcore.ProtoDataSet.freeze` method.
 
         In iRODS it is used to create caches for repetitive and time consuming
-        calls to iRODS.
+        calls to iRODS. The handles, sizes, timestamps and checksums of all
+        the items are retrieved in a single catalog query, and the item
+        metadata fragments are downloaded in a single transfer and indexed
+        by identifier.
         """
         self._use_cache = True
-        self._build_size_and_timestamp_cache()
+        self._build_catalog_cache()
+        self.flush_item_metadata()
+        index = self._read_item_metadata_fragments()
+        with self._cache_lock:
+            self._item_metadata_index = index
 
     def post_freeze_hook(self):
         """Post :meth:`dtoolcore.ProtoDataSet.freeze` cleanup actions.
@@ -673,15 +1811,92 @@ class IrodsStorageBroker(BaseStorageBroker):
         This method is called at the end of the
         :meth:`dtoolcore.ProtoDataSet.freeze` method.
         """
-        self._use_cache = False
-        self._ls_abspath_cache = {}
-        self._metadata_cache = {}
-        self._size_and_timestamp_cache = {}
-        _rm_if_exists(self._metadata_fragments_abspath)
+        with self._cache_lock:
+            self._use_cache = False
+            self._ls_abspath_cache = {}
+            self._metadata_cache = {}
+            self._size_and_timestamp_cache = {}
+            self._checksum_cache = {}
+            self._item_metadata_index = None
+        self._transport.rm_if_exists(self._metadata_fragments_abspath)
 
     def _list_historical_readme_keys(self):
         historical_readme_keys = []
-        for key in _ls_abspaths(self._abspath):
+        for key in self._transport.ls_abspaths(self._abspath):
             if key.find("README.yml-") != -1:
                 historical_readme_keys.append(key)
         return historical_readme_keys
+
+
+def copy(src_uri, dest_base_uri, config_path=None, progressbar=None):
+    """Copy a dataset, server side if both locations are in iRODS.
+
+    When the dataset and the destination are both in iRODS the items are
+    copied with :meth:`IrodsStorageBroker.copy_items_from`, without the data
+    passing through this host. When the destination is on disk the items
+    are downloaded in a single recursive transfer with
+    :meth:`IrodsStorageBroker.export_items`. Otherwise :func:`dtoolcore.copy`
+    is used.
+
+    :param src_uri: URI of dataset to be copied
+    :param dest_base_uri: base of URI for copy target
+    :param config_path: path to dtool configuration file
+    :returns: URI of new dataset
+    :raises: StorageBrokerOSError if items could not be copied
+    """
+    import dtoolcore
+
+    src_scheme = generous_parse_uri(src_uri).scheme
+    dest_scheme = generous_parse_uri(dest_base_uri).scheme
+    if src_scheme != IrodsStorageBroker.key \
+            or dest_scheme not in (IrodsStorageBroker.key, "file"):
+        return dtoolcore.copy(
+            src_uri,
+            dest_base_uri,
+            config_path=config_path,
+            progressbar=progressbar
+        )
+
+    logger.debug("Copy {} -> {}".format(src_uri, dest_base_uri))
+    src_dataset = dtoolcore.DataSet.from_uri(src_uri, config_path=config_path)
+
+    admin_metadata = dict(src_dataset._admin_metadata)
+    admin_metadata["type"] = "protodataset"
+    proto_dataset = dtoolcore.generate_proto_dataset(
+        admin_metadata=admin_metadata,
+        base_uri=dest_base_uri,
+        config_path=config_path
+    )
+    proto_dataset.create()
+
+    if dest_scheme == IrodsStorageBroker.key:
+        failures = proto_dataset._storage_broker.copy_items_from(
+            src_dataset._storage_broker,
+            progressbar=progressbar
+        )
+        if failures:
+            raise(StorageBrokerOSError(
+                "Failed to copy {} items: {}".format(
+                    len(failures),
+                    ", ".join(sorted(failures.keys()))
+                )
+            ))
+    else:
+        # Download the items straight into the data directory of the
+        # dataset on disk.
+        src_dataset._storage_broker.export_items(
+            proto_dataset._storage_broker._data_abspath
+        )
+
+    proto_dataset.put_readme(src_dataset.get_readme_content())
+    for tag in src_dataset.list_tags():
+        proto_dataset.put_tag(tag)
+    for overlay_name in src_dataset.list_overlay_names():
+        overlay = src_dataset.get_overlay(overlay_name)
+        proto_dataset._put_overlay(overlay_name, overlay)
+    for annotation_name in src_dataset.list_annotation_names():
+        annotation = src_dataset.get_annotation(annotation_name)
+        proto_dataset.put_annotation(annotation_name, annotation)
+
+    proto_dataset.freeze(progressbar=progressbar)
+    return proto_dataset.uri
@@ -0,0 +1,169 @@
+"""Streaming reads of items straight from iRODS.
+
+Items read this way bypass the local cache: the content is read from iRODS
+in chunks as the caller consumes it, so that the memory used is bounded by
+the buffer size whatever the size of the item. Closing the stream before the
+end stops the transfer.
+
+:class:`RangeReader` provides random access to an item, transferring only
+the blocks of bytes that are read.
+"""
+
+import io
+from collections import OrderedDict
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+DEFAULT_CACHE_BLOCKS = 16
+
+
+class RawStream(io.RawIOBase):
+    """Raw binary stream reading from iRODS.
+
+    :param read: callable taking a maximum number of bytes and returning at
+                 most that many bytes, an empty bytes object at the end of
+                 the stream
+    :param close: callable releasing the resources used by the transfer,
+                  called once, possibly before the end of the stream
+    """
+
+    def __init__(self, read, close):
+        super(RawStream, self).__init__()
+        self._read = read
+        self._close = close
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self._read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._close()
+            finally:
+                super(RawStream, self).close()
+
+
+def open_stream(read, close, buffer_size=DEFAULT_CHUNK_SIZE):
+    """Return buffered binary file-like object reading from iRODS.
+
+    See :class:`RawStream` for the parameters.
+    """
+    return io.BufferedReader(RawStream(read, close), buffer_size)
+
+
+def iter_chunks(fh, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield chunks of at most chunk_size bytes read from fh.
+
+    fh is closed once exhausted, or when the generator is closed or garbage
+    collected before the end.
+    """
+    try:
+        while True:
+            chunk = fh.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fh.close()
+
+
+class RangeReader(io.RawIOBase):
+    """Seekable binary stream reading byte ranges from iRODS on demand.
+
+    Reads are rounded out to whole blocks of ``block_size`` bytes, and the
+    ``cache_blocks`` most recently used blocks are kept in memory, so that
+    nearby reads are served without further transfers. Consecutive blocks
+    missing from the cache are fetched in a single range read.
+
+    :param read_range: callable taking an offset and a length and returning
+                       at most length bytes from offset
+    :param size: size in bytes of the data read
+    :param block_size: number of bytes in a block
+    :param cache_blocks: maximum number of blocks kept in memory
+    """
+
+    def __init__(self, read_range, size, block_size=DEFAULT_BLOCK_SIZE,
+                 cache_blocks=DEFAULT_CACHE_BLOCKS):
+        super(RangeReader, self).__init__()
+        self._read_range = read_range
+        self._size = size
+        self._block_size = block_size
+        self._cache_blocks = cache_blocks
+        self._blocks = OrderedDict()
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise(ValueError("Invalid whence: {}".format(whence)))
+        if position < 0:
+            raise(ValueError("Negative seek position: {}".format(position)))
+        self._position = position
+        return position
+
+    def _fetch(self, first, last):
+        """Fetch blocks first to last, inclusive, in a single range read."""
+        offset = first * self._block_size
+        data = self._read_range(offset, (last - first + 1) * self._block_size)
+        for n in range(first, last + 1):
+            start = (n - first) * self._block_size
+            self._blocks[n] = data[start:start + self._block_size]
+
+    def _get_blocks(self, first, last):
+        """Return list of blocks first to last, inclusive."""
+        run_start = None
+        for n in range(first, last + 2):
+            missing = n <= last and n not in self._blocks
+            if missing and run_start is None:
+                run_start = n
+            elif not missing and run_start is not None:
+                self._fetch(run_start, n - 1)
+                run_start = None
+
+        blocks = []
+        for n in range(first, last + 1):
+            blocks.append(self._blocks[n])
+            # Mark as most recently used.
+            del self._blocks[n]
+            self._blocks[n] = blocks[-1]
+        while len(self._blocks) > self._cache_blocks:
+            self._blocks.popitem(last=False)
+        return blocks
+
+    def readinto(self, b):
+        end = min(self._position + len(b), self._size)
+        if end <= self._position:
+            return 0
+        first = self._position // self._block_size
+        last = (end - 1) // self._block_size
+        data = b"".join(self._get_blocks(first, last))
+        start = self._position - first * self._block_size
+        chunk = data[start:start + end - self._position]
+        n = len(chunk)
+        b[:n] = chunk
+        self._position += n
+        return n
+
+    def close(self):
+        self._blocks.clear()
+        super(RangeReader, self).close()
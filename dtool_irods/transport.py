@@ -0,0 +1,1605 @@
+"""Transports used by the iRODS storage broker to talk to iRODS.
+
+Two transports are available:
+
+- :class:`IcommandsTransport` runs the iCommands (``ils``, ``iget``, ...) in
+  a subprocess for every operation; this is the default
+- :class:`NativeTransport` talks the iRODS protocol directly using
+  python-irodsclient and keeps a pool of authenticated sessions
+
+The transport is selected using the ``DTOOL_IRODS_TRANSPORT`` configuration
+value, see :func:`get_transport`.
+"""
+
+import os
+import sys
+import errno
+import json
+import logging
+import tempfile
+import time
+import datetime
+import calendar
+import hashlib
+import re
+import threading
+from collections import namedtuple
+from subprocess import Popen, PIPE
+from contextlib import contextmanager
+
+try:
+    import queue
+except ImportError:
+    # Python 2.
+    import Queue as queue
+
+from dtoolcore.utils import get_config_value
+from dtoolcore.filehasher import sha256sum_hexdigest
+
+from dtool_irods import CommandWrapper, IinitRuntimeError
+from dtool_irods.streaming import open_stream
+
+try:
+    from irods.session import iRODSSession
+    from irods.models import (
+        Collection,
+        CollectionMeta,
+        DataObject,
+        DataObjectMeta,
+    )
+    from irods.column import Like, NotLike
+    from irods.meta import iRODSMeta
+    import irods.keywords as kw
+except ImportError:
+    iRODSSession = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRANSPORT = "icommands"
+BUFFER_SIZE = 4 * 1024 * 1024
+DEFAULT_POOL_SIZE = 4
+
+# Policy used to pick the number of parallel streams of a transfer when
+# DTOOL_IRODS_TRANSFER_THREADS is "auto".
+AUTO_TRANSFER_THREADS = "auto"
+MIN_PARALLEL_TRANSFER_SIZE = 32 * 1024 * 1024
+BYTES_PER_TRANSFER_THREAD = 256 * 1024 * 1024
+MAX_TRANSFER_THREADS = 16
+DEFAULT_IRODS_ENVIRONMENT_FILE = os.path.expanduser(
+    "~/.irods/irods_environment.json"
+)
+
+
+class IrodsNoMetaDataSetError(LookupError):
+    pass
+
+
+#: Catalog information about a data object holding a dataset item.
+CatalogEntry = namedtuple(
+    "CatalogEntry",
+    ["handle", "size_in_bytes", "utc_timestamp", "checksum"]
+)
+
+# A replica is good when it is up to date with the latest write to the data
+# object.
+Replica = namedtuple(
+    "Replica",
+    ["physical_path", "size_in_bytes", "checksum", "good"]
+)
+
+
+#############################################################################
+# iRODS helper functions.
+#############################################################################
+
+# The exit_on_failure argument should default to True!
+# Otherwise bad things can happen, like a _cp command failing silently.
+def _run_cmd(cmd, exit_on_failure=True):
+    try:
+        stdout = cmd(exit_on_failure=exit_on_failure)  # NOQA
+        return cmd
+    except IinitRuntimeError:
+        print("There was an issue communicating with iRODS")
+        print("Try running the iRODS command: iinit")
+        sys.exit(800)
+
+
+def _threads_args(threads):
+    if threads is None:
+        return []
+    return ["-N", str(threads)]
+
+
+def _get_file(irods_path, local_abspath, threads=None):
+    cmd = CommandWrapper(
+        ["iget"] + _threads_args(threads) + [irods_path, local_abspath]
+    )
+    _run_cmd(cmd)
+
+
+def _get_file_forcefully(irods_path, local_abspath, threads=None):
+    cmd = CommandWrapper(
+        ["iget", "-f"] + _threads_args(threads) + [irods_path, local_abspath]
+    )
+    _run_cmd(cmd)
+
+
+def _get_collection(irods_path, local_abspath, threads=None):
+    cmd = CommandWrapper(
+        ["iget", "-r"] + _threads_args(threads) + [irods_path, local_abspath]
+    )
+    _run_cmd(cmd)
+
+
+# istream, streaming data objects from and to its standard input and output,
+# was added in iRODS 4.2.9; with older iCommands text is put using a
+# temporary file and byte ranges are read using iget.
+_istream_available = True
+
+
+def _write_newline(p):
+    """Write a newline to the standard input of an iCommand and close it.
+
+    The iCommands hang waiting for user input if the password has not been
+    set or has timed out. Commands that have already exited, e.g. failed,
+    are left for the caller to report.
+    """
+    try:
+        p.stdin.write("\n".encode())
+        p.stdin.close()
+    except IOError as e:
+        if e.errno != errno.EPIPE:
+            raise
+
+
+def _open_pipe_stream(args, irods_path):
+    """Return file-like object reading the output of an iCommand reading
+    irods_path."""
+    logger.info("Calling Popen with: {}".format(args))
+    try:
+        p = Popen(args, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    except OSError:
+        raise(RuntimeError("No such command found in PATH"))
+    _write_newline(p)
+
+    def read(size):
+        data = p.stdout.read(size)
+        if not data:
+            p.wait()
+            if p.returncode != 0:
+                stderr = p.stderr.read().decode("utf-8")
+                raise(IOError("Failed to read {}: {}".format(
+                    irods_path,
+                    stderr
+                )))
+        return data
+
+    def close():
+        # Stop the transfer if the stream is closed early.
+        if p.poll() is None:
+            p.kill()
+        p.stdout.close()
+        p.stderr.close()
+        p.wait()
+
+    return open_stream(read, close, BUFFER_SIZE)
+
+
+def _open_iget_stream(irods_path):
+    """Return file-like object reading irods_path from an iget pipe."""
+    return _open_pipe_stream(["iget", irods_path, "-"], irods_path)
+
+
+def _read_range(irods_path, offset, length):
+    """Return at most length bytes of irods_path starting at offset."""
+    global _istream_available
+
+    if _istream_available:
+        args = [
+            "istream",
+            "read",
+            "--offset", str(offset),
+            "--count", str(length),
+            irods_path
+        ]
+        try:
+            fh = _open_pipe_stream(args, irods_path)
+        except RuntimeError:
+            logger.info("istream not found, falling back to iget")
+            _istream_available = False
+        else:
+            with fh:
+                return fh.read(length)
+
+    # Without istream the bytes before offset are read and discarded.
+    with _open_iget_stream(irods_path) as fh:
+        remaining = offset
+        while remaining > 0:
+            skipped = len(fh.read(min(remaining, BUFFER_SIZE)))
+            if skipped == 0:
+                return b""
+            remaining -= skipped
+        return fh.read(length)
+
+
+def _get_text(irods_path):
+    """Get raw text from iRODS."""
+    # Command to get contents of file to stdout.
+    cmd = CommandWrapper([
+        "iget",
+        irods_path,
+        "-"
+    ])
+    return _run_cmd(cmd).stdout
+
+
+def _put_bytes_with_iput(irods_path, data):
+    """Put bytes into iRODS by way of a temporary file."""
+    with tempfile.NamedTemporaryFile() as fh:
+        fpath = fh.name
+        fh.write(data)
+        fh.flush()
+        cmd = CommandWrapper([
+            "iput",
+            "-f",
+            fpath,
+            irods_path
+        ])
+        _run_cmd(cmd)
+    assert not os.path.isfile(fpath)
+
+
+def _put_text(irods_path, text):
+    """Put raw text into iRODS."""
+    global _istream_available
+
+    try:
+        # Make Python2 compatible.
+        text = unicode(text, "utf-8")
+    except (NameError, TypeError):
+        # NameError: We are running Python3 => text already unicode.
+        # TypeError: text is already of type unicode.
+        pass
+    data = text.encode("utf-8")
+
+    if _istream_available:
+        cmd = CommandWrapper(["istream", "write", irods_path], stdin=data)
+        try:
+            _run_cmd(cmd)
+            return
+        except RuntimeError:
+            logger.info("istream not found, falling back to iput")
+            _istream_available = False
+
+    _put_bytes_with_iput(irods_path, data)
+
+
+def _put_file_with_istream(fpath, irods_path):
+    """Stream file into iRODS with istream, hashing it as it is read.
+
+    :returns: sha256 hexdigest of the file, or None if istream is not
+              available
+    """
+    global _istream_available
+
+    if not _istream_available:
+        return None
+
+    hasher = hashlib.sha256()
+
+    def chunks():
+        with open(fpath, "rb") as fh:
+            while True:
+                chunk = fh.read(BUFFER_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                yield chunk
+
+    cmd = CommandWrapper(["istream", "write", irods_path], stdin=chunks())
+    try:
+        _run_cmd(cmd)
+    except RuntimeError:
+        logger.info("istream not found, falling back to iput")
+        _istream_available = False
+        return None
+    return hasher.hexdigest()
+
+
+def _get_obj(irods_path):
+    """Return object from JSON text stored in iRODS."""
+    return json.loads(_get_text(irods_path))
+
+
+def _put_obj(irods_path, obj):
+    """Put python object into iRODS as compact JSON text."""
+    text = json.dumps(obj, separators=(",", ":"))
+    _put_text(irods_path, text)
+
+
+def _path_exists(irods_path):
+    cmd = CommandWrapper(["ils", irods_path])
+    cmd = _run_cmd(cmd, exit_on_failure=False)
+    return cmd.success()
+
+
+def _mkdir(irods_path):
+    cmd = CommandWrapper(["imkdir", irods_path])
+    _run_cmd(cmd)
+
+
+def _mkdir_if_missing(irods_path):
+    if not _path_exists(irods_path):
+        _mkdir(irods_path)
+
+
+def _cp(fpath, irods_path, checksum=False, threads=None):
+    args = ["iput", "-f"] + _threads_args(threads)
+    if checksum:
+        # Have the server compute and register the checksum while writing.
+        args.append("-k")
+    cmd = CommandWrapper(args + [fpath, irods_path])
+    _run_cmd(cmd)
+
+
+def _icp(src_irods_path, dest_irods_path, checksum=False):
+    args = ["icp", "-f"]
+    if checksum:
+        args.append("-k")
+    cmd = CommandWrapper(args + [src_irods_path, dest_irods_path])
+    _run_cmd(cmd)
+
+
+def _register(fpath, irods_path, checksum=False, resource=None):
+    args = ["ireg", "-f"]
+    if checksum:
+        args.append("-k")
+    if resource is not None:
+        args.extend(["-R", resource])
+    cmd = CommandWrapper(args + [fpath, irods_path])
+    _run_cmd(cmd)
+
+
+def _rm(irods_path):
+    cmd = CommandWrapper(["irm", "-rf", irods_path])
+    _run_cmd(cmd)
+
+
+def _rm_if_exists(irods_path):
+    if _path_exists(irods_path):
+        _rm(irods_path)
+
+
+def _ls(irods_path):
+    cmd = CommandWrapper(["ils", irods_path])
+    cmd = _run_cmd(cmd)
+
+    def remove_header_line(lines):
+        return lines[1:]
+
+    def remove_redundant_whitespace(lines):
+        return [l.strip() for l in lines]
+
+    def deal_with_collections(lines):
+        fixed_lines = []
+        for l in lines:
+            if l.startswith("C"):
+                _, path = l.split()
+                l = os.path.basename(path)  # NOQA
+            fixed_lines.append(l)
+        return fixed_lines
+
+    text = cmd.stdout.strip()
+    lines = text.split("\n")
+    return deal_with_collections(
+        remove_redundant_whitespace(
+            remove_header_line(lines)
+        )
+    )
+
+
+def _ls_abspaths(irods_path):
+    for f in _ls(irods_path):
+        yield os.path.join(irods_path, f)
+
+
+def _put_metadata(irods_path, key, value):
+    cmd = CommandWrapper(["imeta", "set", "-d", irods_path, key, value])
+    _run_cmd(cmd)
+
+
+def _put_collection_metadata(irods_path, key, value):
+    cmd = CommandWrapper(["imeta", "set", "-C", irods_path, key, value])
+    _run_cmd(cmd)
+
+
+def _delete_collection_metadata(irods_path, key):
+    # Fails if the AVU is not set, which is fine.
+    cmd = CommandWrapper(["imeta", "rmw", "-C", irods_path, key, "%"])
+    _run_cmd(cmd, exit_on_failure=False)
+
+
+def _get_metadata(irods_path, key):
+    cmd = CommandWrapper(["imeta", "ls", "-d", irods_path, key])
+    cmd()
+    text = cmd.stdout
+    value_line = text.split('\n')[2]
+
+    if ":" not in value_line:
+        raise(IrodsNoMetaDataSetError())
+
+    value = value_line.split(":")[1]
+    return value.strip()
+
+
+def _strip_checksum_algorithm(checksum):
+    """Return checksum without the "sha2:" style algorithm prefix."""
+    if checksum and ":" in checksum:
+        return checksum.split(":", 1)[1]
+    return checksum
+
+
+def _get_size_and_timestamp(irods_path):
+    cmd = CommandWrapper(["ils", "-l", irods_path])
+    cmd()
+    text = cmd.stdout.strip()
+    first_line = text.split("\n")[0].strip()
+    info = first_line.split()
+    size_in_bytes_str = info[3]
+    size_in_bytes = int(size_in_bytes_str)
+    time_str = info[4]
+    dt = datetime.datetime.strptime(time_str, "%Y-%m-%d.%H:%M")
+    utc_timestamp = int(time.mktime(dt.timetuple()))
+    return size_in_bytes, utc_timestamp
+
+
+_CATALOG_QUERY = (
+    "SELECT DATA_NAME, META_DATA_ATTR_VALUE, DATA_SIZE, DATA_MODIFY_TIME, "
+    "DATA_CHECKSUM WHERE COLL_NAME = '{}' AND META_DATA_ATTR_NAME = 'handle'"
+)
+
+
+def _iquest(query, columns):
+    """Return rows, as lists of strings, from iquest query."""
+    row_format = "\t".join(["%s"] * columns)
+    cmd = CommandWrapper(["iquest", "--no-page", row_format, query])
+    cmd = _run_cmd(cmd, exit_on_failure=False)
+
+    # An empty result is reported as an error by iquest.
+    if cmd.stdout.find("CAT_NO_ROWS_FOUND") != -1 \
+            or cmd.stderr.find("CAT_NO_ROWS_FOUND") != -1:
+        return []
+    if not cmd.success():
+        logger.warning("Command failed: {}".format(cmd.args))
+        logger.warning(cmd.stderr)
+        sys.stderr.write(cmd.stderr)
+        sys.exit(cmd.returncode)
+
+    rows = []
+    for line in cmd.stdout.split("\n"):
+        if line.strip() == "":
+            continue
+        rows.append(line.split("\t"))
+    return rows
+
+
+def _iter_iquest(query, columns):
+    """Yield rows, as lists of strings, from iquest query as it runs.
+
+    Unlike :func:`_iquest` the output is not collected in memory first.
+    """
+    row_format = "\t".join(["%s"] * columns)
+    args = ["iquest", "--no-page", row_format, query]
+    logger.info("Calling Popen with: {}".format(args))
+    try:
+        p = Popen(args, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    except OSError:
+        raise(RuntimeError("No such command found in PATH"))
+    _write_newline(p)
+
+    no_rows_found = False
+    try:
+        for line in p.stdout:
+            line = line.decode("utf-8").rstrip("\n")
+            if line.find("CAT_NO_ROWS_FOUND") != -1:
+                no_rows_found = True
+                continue
+            if line.strip() == "":
+                continue
+            yield line.split("\t")
+        stderr = p.stderr.read().decode("utf-8")
+        p.wait()
+    finally:
+        # Stop the query if the caller stops iterating early.
+        if p.poll() is None:
+            p.kill()
+        p.stdout.close()
+        p.stderr.close()
+        p.wait()
+    if p.returncode == 0 or no_rows_found \
+            or stderr.find("CAT_NO_ROWS_FOUND") != -1:
+        return
+    if stderr.find("CAT_INVALID_AUTHENTICATION") != -1 \
+            or stderr.find("USER_RODS_HOST_EMPTY") != -1:
+        print("There was an issue communicating with iRODS")
+        print("Try running the iRODS command: iinit")
+        sys.exit(800)
+    logger.warning("Command failed: {}".format(args))
+    logger.warning(stderr)
+    sys.stderr.write(stderr)
+    sys.exit(p.returncode)
+
+
+def _parse_catalog_rows(rows):
+    """Return dict mapping data object names to CatalogEntry tuples.
+
+    Data objects with several replicas appear once per replica; the first
+    non-empty checksum is used.
+    """
+    catalog = {}
+    for name, handle, size, modify_time, checksum in rows:
+        checksum = _strip_checksum_algorithm(checksum)
+        if name in catalog and (catalog[name].checksum or not checksum):
+            continue
+        catalog[name] = CatalogEntry(
+            handle=handle,
+            size_in_bytes=int(size),
+            utc_timestamp=int(modify_time),
+            checksum=checksum
+        )
+    return catalog
+
+
+def _query_catalog(irods_path):
+    query = _CATALOG_QUERY.format(irods_path)
+    return _parse_catalog_rows(_iquest(query, 5))
+
+
+_REPLICAS_QUERY = (
+    "SELECT DATA_NAME, DATA_PATH, DATA_SIZE, DATA_CHECKSUM, DATA_REPL_STATUS "
+    "WHERE COLL_NAME = '{}'"
+)
+
+
+def _parse_replica_rows(rows):
+    """Return dict mapping data object names to lists of Replica tuples."""
+    replicas = {}
+    for name, physical_path, size, checksum, status in rows:
+        replicas.setdefault(name, []).append(Replica(
+            physical_path=physical_path or None,
+            size_in_bytes=int(size),
+            checksum=_strip_checksum_algorithm(checksum),
+            good=str(status) == "1"
+        ))
+    return replicas
+
+
+def _query_replicas(irods_path):
+    query = _REPLICAS_QUERY.format(irods_path)
+    return _parse_replica_rows(_iquest(query, 5))
+
+
+_TREE_QUERY = (
+    "SELECT COLL_NAME, DATA_NAME, DATA_SIZE, DATA_MODIFY_TIME "
+    "WHERE COLL_NAME like '{}%'"
+)
+
+
+def _parse_tree_rows(rows, irods_path, exclude=None):
+    """Return dict mapping data object paths to (size, timestamp) tuples.
+
+    Only data objects in irods_path, or below it, and not in exclude, or
+    below it, are included. The latest replica is used.
+    """
+    def below(collection, path):
+        return collection == path or collection.startswith(path + "/")
+
+    tree = {}
+    for collection, name, size, modify_time in rows:
+        if not below(collection, irods_path):
+            continue
+        if exclude is not None and below(collection, exclude):
+            continue
+        path = collection + "/" + name
+        entry = (int(size), int(modify_time))
+        if path not in tree or tree[path][1] < entry[1]:
+            tree[path] = entry
+    return tree
+
+
+def _query_tree(irods_path, exclude=None):
+    query = _TREE_QUERY.format(irods_path)
+    if exclude is not None:
+        query += " AND COLL_NAME not like '{}%'".format(exclude)
+    return _parse_tree_rows(_iquest(query, 4), irods_path, exclude)
+
+
+_DATASETS_QUERY = (
+    "SELECT COLL_NAME WHERE COLL_NAME like '{}/%/.dtool' "
+    "AND DATA_NAME = 'dtool'"
+)
+
+
+def _dataset_path_from_dtool_collection(irods_path, collection):
+    """Return path of the dataset directly in irods_path, or None.
+
+    :param collection: path of a ``.dtool`` collection holding admin metadata
+    """
+    prefix = irods_path + "/"
+    if not collection.startswith(prefix):
+        return None
+    dataset_path = os.path.dirname(collection)
+    if os.path.dirname(dataset_path) != irods_path:
+        return None
+    return dataset_path
+
+
+def _iter_dataset_paths(irods_path):
+    irods_path = irods_path.rstrip("/")
+    query = _DATASETS_QUERY.format(irods_path)
+    for (collection,) in _iter_iquest(query, 1):
+        dataset_path = _dataset_path_from_dtool_collection(
+            irods_path,
+            collection
+        )
+        if dataset_path is not None:
+            yield dataset_path
+
+
+_DATASET_TIMESTAMPS_QUERY = (
+    "SELECT COLL_NAME, DATA_MODIFY_TIME WHERE COLL_NAME like '{}/%/.dtool' "
+    "AND DATA_NAME = 'dtool'"
+)
+
+_DATASET_TAGS_QUERY = (
+    "SELECT COLL_NAME, DATA_NAME WHERE COLL_NAME like '{}/%/.dtool/tags'"
+)
+
+
+def _parse_dataset_timestamp_rows(rows, irods_path):
+    """Return dict mapping dataset paths to admin metadata timestamps."""
+    timestamps = {}
+    for collection, modify_time in rows:
+        dataset_path = _dataset_path_from_dtool_collection(
+            irods_path,
+            collection
+        )
+        if dataset_path is None:
+            continue
+        timestamps[dataset_path] = max(
+            timestamps.get(dataset_path, 0),
+            int(modify_time)
+        )
+    return timestamps
+
+
+def _parse_dataset_tag_rows(rows, irods_path):
+    """Return dict mapping dataset paths to sorted lists of tags."""
+    tags = {}
+    for collection, tag in rows:
+        dataset_path = _dataset_path_from_dtool_collection(
+            irods_path,
+            os.path.dirname(collection)
+        )
+        if dataset_path is None:
+            continue
+        tags.setdefault(dataset_path, set()).add(tag)
+    return dict((p, sorted(t)) for p, t in tags.items())
+
+
+def _query_dataset_timestamps(irods_path):
+    irods_path = irods_path.rstrip("/")
+    query = _DATASET_TIMESTAMPS_QUERY.format(irods_path)
+    return _parse_dataset_timestamp_rows(_iquest(query, 2), irods_path)
+
+
+def _query_dataset_tags(irods_path):
+    irods_path = irods_path.rstrip("/")
+    query = _DATASET_TAGS_QUERY.format(irods_path)
+    return _parse_dataset_tag_rows(_iquest(query, 2), irods_path)
+
+
+_COLLECTIONS_WITH_METADATA_QUERY = (
+    "SELECT COLL_NAME WHERE COLL_NAME like '{}/%' "
+    "AND META_COLL_ATTR_NAME = '{}'"
+)
+
+
+def _query_collections_with_metadata(irods_path, key, value=None):
+    irods_path = irods_path.rstrip("/")
+    query = _COLLECTIONS_WITH_METADATA_QUERY.format(irods_path, key)
+    if value is not None:
+        query += " AND META_COLL_ATTR_VALUE = '{}'".format(value)
+    prefix = irods_path + "/"
+    return sorted(
+        c for (c,) in _iquest(query, 1) if c.startswith(prefix)
+    )
+
+
+def _verify_chksum(irods_path, verify=True):
+    """ Run ichksum either with or without verify. """
+    if verify:
+        arg = '-K'
+    else:
+        arg = ''
+    cmd = CommandWrapper(["ichksum", arg, irods_path])
+    cmd = _run_cmd(cmd)
+    out = cmd.stdout
+
+    pattern = re.compile(r'(?P<uuid>\w+)\s+(?P<alg>\w+):(?P<chksum>\S+)', re.MULTILINE)  # NOQA
+    matches = pattern.search(out)
+
+    chksum = ''
+    if matches and matches.group('chksum'):
+        chksum = matches.group('chksum')
+
+    return chksum
+
+
+def _get_checksum(irods_path, verify=True):
+    """ Try ichksum first with verify then without if that fails.
+
+    If verify is False the checksum registered in the catalog is returned
+    without having the server re-read the data.
+    """
+    checksum = ''
+    if verify:
+        # request hash with verification
+        checksum = _verify_chksum(irods_path)
+
+    if not checksum:
+        # iRODS didn't give us a hash -> requesy without verification
+        #logger.warning('irods_path {} was not verified.'.format(irods_path))
+        checksum = _verify_chksum(irods_path, verify=False)
+
+    assert checksum, 'Missing checksum in output.'
+
+    return checksum
+
+
+#############################################################################
+# Transports.
+#############################################################################
+
+
+class BaseTransport(object):
+    """Operations the storage broker needs from iRODS.
+
+    Subclasses implement the primitive operations; the composite ones are
+    implemented here in terms of them.
+    """
+
+    #: Name used to select the transport in the dtool configuration.
+    key = None
+
+    def get_text(self, irods_path):
+        raise(NotImplementedError())
+
+    def put_text(self, irods_path, text):
+        raise(NotImplementedError())
+
+    def get_file(self, irods_path, local_abspath, force=False, threads=None):
+        """Download data object to local file.
+
+        :param threads: number of parallel streams, see
+                        :func:`transfer_threads`; None leaves the choice to
+                        iRODS
+        """
+        raise(NotImplementedError())
+
+    def open(self, irods_path):
+        """Return binary file-like object reading the data object.
+
+        The content is streamed from iRODS as it is read, with bounded
+        memory use; closing the object early stops the transfer.
+        """
+        raise(NotImplementedError())
+
+    def read_range(self, irods_path, offset, length):
+        """Return at most length bytes of the data object from offset.
+
+        Fewer bytes are returned at the end of the data object.
+        """
+        raise(NotImplementedError())
+
+    def get_collection(self, irods_path, local_abspath, threads=None):
+        """Download the collection at irods_path, recursively.
+
+        :param local_abspath: absolute path of the local directory to create,
+                              which must not exist yet
+        :param threads: number of parallel streams, see :meth:`get_file`
+        """
+        raise(NotImplementedError())
+
+    def put_file(self, fpath, irods_path, checksum=False, threads=None):
+        """Put local file into iRODS.
+
+        If checksum is True the checksum is registered in the catalog as the
+        data is written. threads is the number of parallel streams, see
+        :meth:`get_file`.
+
+        :returns: sha256 hexdigest of the content read from fpath
+        """
+        raise(NotImplementedError())
+
+    def path_exists(self, irods_path):
+        raise(NotImplementedError())
+
+    def mkdir(self, irods_path):
+        raise(NotImplementedError())
+
+    def rm(self, irods_path):
+        raise(NotImplementedError())
+
+    def ls(self, irods_path):
+        """Return names of the data objects and collections in irods_path."""
+        raise(NotImplementedError())
+
+    def copy_file(self, src_irods_path, dest_irods_path, metadata,
+                  checksum=False):
+        """Copy data object server side, without the data leaving iRODS.
+
+        :param metadata: dictionary of AVUs to set on the copy
+        :param checksum: register the checksum of the copy
+        """
+        raise(NotImplementedError())
+
+    def register_file(self, fpath, irods_path, metadata, checksum=False,
+                      resource=None):
+        """Register local file, on a vault file system, in place.
+
+        No data is copied: the file becomes the replica of the data object at
+        irods_path. The metadata is attached to the data object straight
+        after registering it.
+
+        :param fpath: absolute path of the file, as seen by the iRODS server
+        :param metadata: dictionary of AVUs to set on the data object
+        :param checksum: register the checksum computed by the server
+        :param resource: name of the resource the vault belongs to
+        :returns: sha256 hexdigest of the content of fpath, or None if the
+                  checksum is registered by the server instead
+        """
+        raise(NotImplementedError())
+
+    def put_metadata(self, irods_path, key, value):
+        raise(NotImplementedError())
+
+    def get_metadata(self, irods_path, key):
+        """Return value of AVU key on the data object at irods_path.
+
+        :raises: IrodsNoMetaDataSetError if the AVU is not set
+        """
+        raise(NotImplementedError())
+
+    def put_collection_metadata(self, irods_path, key, value):
+        """Set AVU key, replacing any value, on the collection at irods_path.
+        """
+        raise(NotImplementedError())
+
+    def delete_collection_metadata(self, irods_path, key):
+        """Remove AVU key, if set, from the collection at irods_path."""
+        raise(NotImplementedError())
+
+    def query_collections_with_metadata(self, irods_path, key, value=None):
+        """Return sorted list of the paths of the collections below
+        irods_path with the AVU key, set to value if given.
+
+        The collections are found using a single catalog query.
+        """
+        raise(NotImplementedError())
+
+    def get_checksum(self, irods_path, verify=True):
+        """Return base64 encoded checksum of the data object at irods_path.
+
+        If verify is True the server re-reads the data to verify the
+        checksum registered in the catalog.
+        """
+        raise(NotImplementedError())
+
+    def get_size_and_timestamp(self, irods_path):
+        raise(NotImplementedError())
+
+    def query_catalog(self, irods_path):
+        """Return dict mapping names of the data objects in irods_path that
+        have a handle to :class:`CatalogEntry` tuples.
+
+        The information is retrieved in a single catalog query.
+        """
+        raise(NotImplementedError())
+
+    def query_replicas(self, irods_path):
+        """Return dict mapping names of the data objects in irods_path to
+        lists of :class:`Replica` tuples.
+
+        The physical paths of all the replicas are retrieved in a single
+        catalog query.
+        """
+        raise(NotImplementedError())
+
+    def query_tree(self, irods_path, exclude=None):
+        """Return dict mapping paths of the data objects in irods_path, and
+        its subcollections, to (size in bytes, UTC timestamp) tuples.
+
+        Data objects in the exclude collection, and its subcollections, are
+        left out. The information is retrieved in a single catalog query.
+        """
+        raise(NotImplementedError())
+
+    def iter_dataset_paths(self, irods_path):
+        """Yield paths of the datasets directly in irods_path.
+
+        Datasets are the collections holding admin metadata, i.e. a
+        ``.dtool/dtool`` data object. They are found using a single catalog
+        query, the results of which are yielded as they arrive.
+        """
+        raise(NotImplementedError())
+
+    def query_dataset_timestamps(self, irods_path):
+        """Return dict mapping paths of the datasets directly in irods_path
+        to the modification timestamps of their admin metadata.
+
+        The information is retrieved in a single catalog query.
+        """
+        raise(NotImplementedError())
+
+    def query_dataset_tags(self, irods_path):
+        """Return dict mapping paths of the datasets directly in irods_path
+        to sorted lists of their tags.
+
+        Datasets without tags are left out. The information is retrieved in
+        a single catalog query.
+        """
+        raise(NotImplementedError())
+
+    def get_obj(self, irods_path):
+        """Return object from JSON text stored in iRODS."""
+        return json.loads(self.get_text(irods_path))
+
+    def put_obj(self, irods_path, obj):
+        """Put python object into iRODS as compact JSON text."""
+        text = json.dumps(obj, separators=(",", ":"))
+        self.put_text(irods_path, text)
+
+    def mkdir_if_missing(self, irods_path):
+        if not self.path_exists(irods_path):
+            self.mkdir(irods_path)
+
+    def rm_if_exists(self, irods_path):
+        if self.path_exists(irods_path):
+            self.rm(irods_path)
+
+    def ls_abspaths(self, irods_path):
+        for f in self.ls(irods_path):
+            yield os.path.join(irods_path, f)
+
+
+class IcommandsTransport(BaseTransport):
+    """Transport running one iCommand per operation."""
+
+    key = "icommands"
+
+    def get_text(self, irods_path):
+        return _get_text(irods_path)
+
+    def put_text(self, irods_path, text):
+        _put_text(irods_path, text)
+
+    def get_file(self, irods_path, local_abspath, force=False, threads=None):
+        if force:
+            _get_file_forcefully(irods_path, local_abspath, threads)
+        else:
+            _get_file(irods_path, local_abspath, threads)
+
+    def open(self, irods_path):
+        return _open_iget_stream(irods_path)
+
+    def read_range(self, irods_path, offset, length):
+        return _read_range(irods_path, offset, length)
+
+    def get_collection(self, irods_path, local_abspath, threads=None):
+        _get_collection(irods_path, local_abspath, threads)
+
+    def put_file(self, fpath, irods_path, checksum=False, threads=None):
+        # Single stream uploads are streamed through istream, hashing the
+        # file in the same read pass. istream cannot register checksums,
+        # and parallel transfers read the file in several streams, so iput
+        # is used for those and the file is hashed in a read of its own.
+        single_stream = threads == 1 or (
+            threads is None
+            and os.path.getsize(fpath) < MIN_PARALLEL_TRANSFER_SIZE
+        )
+        if single_stream and not checksum:
+            hexdigest = _put_file_with_istream(fpath, irods_path)
+            if hexdigest is not None:
+                return hexdigest
+        hexdigest = sha256sum_hexdigest(fpath)
+        _cp(fpath, irods_path, checksum=checksum, threads=threads)
+        return hexdigest
+
+    def path_exists(self, irods_path):
+        return _path_exists(irods_path)
+
+    def mkdir(self, irods_path):
+        _mkdir(irods_path)
+
+    def rm(self, irods_path):
+        _rm(irods_path)
+
+    def ls(self, irods_path):
+        return _ls(irods_path)
+
+    def copy_file(self, src_irods_path, dest_irods_path, metadata,
+                  checksum=False):
+        _icp(src_irods_path, dest_irods_path, checksum=checksum)
+        for key, value in metadata.items():
+            _put_metadata(dest_irods_path, key, value)
+
+    def register_file(self, fpath, irods_path, metadata, checksum=False,
+                      resource=None):
+        # The server reads the file when it registers its checksum; it is
+        # only hashed here otherwise.
+        hexdigest = None
+        if not checksum:
+            hexdigest = sha256sum_hexdigest(fpath)
+        _register(fpath, irods_path, checksum=checksum, resource=resource)
+        for key, value in metadata.items():
+            _put_metadata(irods_path, key, value)
+        return hexdigest
+
+    def put_metadata(self, irods_path, key, value):
+        _put_metadata(irods_path, key, value)
+
+    def get_metadata(self, irods_path, key):
+        return _get_metadata(irods_path, key)
+
+    def put_collection_metadata(self, irods_path, key, value):
+        _put_collection_metadata(irods_path, key, value)
+
+    def delete_collection_metadata(self, irods_path, key):
+        _delete_collection_metadata(irods_path, key)
+
+    def query_collections_with_metadata(self, irods_path, key, value=None):
+        return _query_collections_with_metadata(irods_path, key, value)
+
+    def get_checksum(self, irods_path, verify=True):
+        return _get_checksum(irods_path, verify=verify)
+
+    def get_size_and_timestamp(self, irods_path):
+        return _get_size_and_timestamp(irods_path)
+
+    def query_catalog(self, irods_path):
+        return _query_catalog(irods_path)
+
+    def query_replicas(self, irods_path):
+        return _query_replicas(irods_path)
+
+    def query_tree(self, irods_path, exclude=None):
+        return _query_tree(irods_path, exclude)
+
+    def iter_dataset_paths(self, irods_path):
+        return _iter_dataset_paths(irods_path)
+
+    def query_dataset_timestamps(self, irods_path):
+        return _query_dataset_timestamps(irods_path)
+
+    def query_dataset_tags(self, irods_path):
+        return _query_dataset_tags(irods_path)
+
+
+class SessionPool(object):
+    """Thread safe pool of authenticated iRODS sessions.
+
+    Sessions are created lazily, up to ``size`` of them, and handed out to one
+    thread at a time. When all sessions are in use callers block until one is
+    released.
+
+    :param session_factory: callable returning a new authenticated session
+    :param size: maximum number of sessions in the pool
+    """
+
+    def __init__(self, session_factory, size=DEFAULT_POOL_SIZE):
+        self._session_factory = session_factory
+        self._size = size
+        self._idle = queue.LifoQueue()
+        self._num_created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._num_created < self._size
+            if create:
+                self._num_created += 1
+
+        if not create:
+            return self._idle.get()
+
+        try:
+            return self._session_factory()
+        except Exception:
+            with self._lock:
+                self._num_created -= 1
+            raise
+
+    def _release(self, session):
+        self._idle.put(session)
+
+    @contextmanager
+    def session(self):
+        """Context manager lending out a session from the pool."""
+        session = self._acquire()
+        try:
+            yield session
+        finally:
+            self._release(session)
+
+    def close(self):
+        """Clean up all idle sessions."""
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._num_created -= 1
+            session.cleanup()
+
+
+def transfer_threads(size_in_bytes, setting):
+    """Return number of parallel streams used to transfer an item.
+
+    :param size_in_bytes: size of the item
+    :param setting: the ``DTOOL_IRODS_TRANSFER_THREADS`` configuration
+                    value: None to leave the choice to iRODS, "auto" to pick
+                    the number based on the size of the item, or a number
+    :returns: number of streams, or None
+    """
+    if setting is None:
+        return None
+    if str(setting).lower() != AUTO_TRANSFER_THREADS:
+        return int(setting)
+    if size_in_bytes < MIN_PARALLEL_TRANSFER_SIZE:
+        return 1
+    threads = int(size_in_bytes // BYTES_PER_TRANSFER_THREAD)
+    return max(2, min(threads, MAX_TRANSFER_THREADS))
+
+
+def _datetime_to_utc_timestamp(dt):
+    """Return UTC timestamp from naive UTC datetime used by iRODS clients."""
+    return int(calendar.timegm(dt.utctimetuple()))
+
+
+class NativeTransport(BaseTransport):
+    """Transport speaking the iRODS protocol using python-irodsclient.
+
+    :param pool: :class:`SessionPool` providing authenticated sessions
+    """
+
+    key = "native"
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def get_text(self, irods_path):
+        with self._pool.session() as session:
+            with session.data_objects.open(irods_path, "r") as fh:
+                return fh.read().decode("utf-8")
+
+    def put_text(self, irods_path, text):
+        if not isinstance(text, bytes):
+            text = text.encode("utf-8")
+        with self._pool.session() as session:
+            with session.data_objects.open(irods_path, "w") as fh:
+                fh.write(text)
+
+    def get_file(self, irods_path, local_abspath, force=False, threads=None):
+        options = {}
+        if force:
+            options[kw.FORCE_FLAG_KW] = ""
+        if threads is not None:
+            options["num_threads"] = threads
+        with self._pool.session() as session:
+            session.data_objects.get(irods_path, local_abspath, **options)
+
+    def open(self, irods_path):
+        # The session is lent out until the stream is closed.
+        session = self._pool._acquire()
+        try:
+            fh = session.data_objects.open(irods_path, "r")
+        except BaseException:
+            self._pool._release(session)
+            raise
+
+        def close():
+            try:
+                fh.close()
+            finally:
+                self._pool._release(session)
+
+        return open_stream(fh.read, close, BUFFER_SIZE)
+
+    def read_range(self, irods_path, offset, length):
+        with self._pool.session() as session:
+            with session.data_objects.open(irods_path, "r") as fh:
+                fh.seek(offset)
+                return fh.read(length)
+
+    def get_collection(self, irods_path, local_abspath, threads=None):
+        options = {}
+        if threads is not None:
+            options["num_threads"] = threads
+        with self._pool.session() as session:
+            collections = [
+                (session.collections.get(irods_path), local_abspath)
+            ]
+            while collections:
+                collection, dirpath = collections.pop()
+                os.mkdir(dirpath)
+                for obj in collection.data_objects:
+                    session.data_objects.get(
+                        obj.path,
+                        os.path.join(dirpath, obj.name),
+                        **options
+                    )
+                for subcollection in collection.subcollections:
+                    subdirpath = os.path.join(dirpath, subcollection.name)
+                    collections.append((subcollection, subdirpath))
+
+    def put_file(self, fpath, irods_path, checksum=False, threads=None):
+        if threads is not None and threads > 1:
+            # Parallel transfers read the file in several streams of their
+            # own, so it is hashed in a separate read, as the iCommands
+            # transport does.
+            hexdigest = sha256sum_hexdigest(fpath)
+            options = {kw.FORCE_FLAG_KW: ""}
+            if checksum:
+                options[kw.REG_CHKSUM_KW] = ""
+            with self._pool.session() as session:
+                session.data_objects.put(
+                    fpath,
+                    irods_path,
+                    num_threads=threads,
+                    **options
+                )
+            return hexdigest
+
+        # Stream the file, hashing it in the same read pass. The server
+        # registers the checksum when the data object is closed, as it does
+        # for puts, rather than reading the content back afterwards.
+        options = {}
+        if checksum:
+            options[kw.REG_CHKSUM_KW] = ""
+        hasher = hashlib.sha256()
+        with self._pool.session() as session:
+            with open(fpath, "rb") as fh_in:
+                with session.data_objects.open(
+                    irods_path,
+                    "w",
+                    **options
+                ) as fh_out:
+                    while True:
+                        chunk = fh_in.read(BUFFER_SIZE)
+                        if not chunk:
+                            break
+                        hasher.update(chunk)
+                        fh_out.write(chunk)
+        return hasher.hexdigest()
+
+    def path_exists(self, irods_path):
+        with self._pool.session() as session:
+            if session.collections.exists(irods_path):
+                return True
+            return session.data_objects.exists(irods_path)
+
+    def mkdir(self, irods_path):
+        with self._pool.session() as session:
+            session.collections.create(irods_path)
+
+    def rm(self, irods_path):
+        with self._pool.session() as session:
+            if session.collections.exists(irods_path):
+                session.collections.remove(
+                    irods_path,
+                    recurse=True,
+                    force=True
+                )
+            else:
+                session.data_objects.unlink(irods_path, force=True)
+
+    def ls(self, irods_path):
+        with self._pool.session() as session:
+            collection = session.collections.get(irods_path)
+            names = [obj.name for obj in collection.data_objects]
+            names.extend([c.name for c in collection.subcollections])
+        return names
+
+    def copy_file(self, src_irods_path, dest_irods_path, metadata,
+                  checksum=False):
+        options = {kw.FORCE_FLAG_KW: ""}
+        if checksum:
+            options[kw.REG_CHKSUM_KW] = ""
+        with self._pool.session() as session:
+            session.data_objects.copy(
+                src_irods_path,
+                dest_irods_path,
+                **options
+            )
+            for key, value in metadata.items():
+                session.metadata.set(
+                    DataObject,
+                    dest_irods_path,
+                    iRODSMeta(key, value)
+                )
+
+    def register_file(self, fpath, irods_path, metadata, checksum=False,
+                      resource=None):
+        # The server reads the file when it registers its checksum; it is
+        # only hashed here otherwise.
+        hexdigest = None
+        if not checksum:
+            hexdigest = sha256sum_hexdigest(fpath)
+        options = {kw.FORCE_FLAG_KW: ""}
+        if checksum:
+            options[kw.REG_CHKSUM_KW] = ""
+        if resource is not None:
+            options[kw.DEST_RESC_NAME_KW] = resource
+        with self._pool.session() as session:
+            session.data_objects.register(fpath, irods_path, **options)
+            for key, value in metadata.items():
+                session.metadata.set(
+                    DataObject,
+                    irods_path,
+                    iRODSMeta(key, value)
+                )
+        return hexdigest
+
+    def put_metadata(self, irods_path, key, value):
+        with self._pool.session() as session:
+            session.metadata.set(DataObject, irods_path, iRODSMeta(key, value))
+
+    def get_metadata(self, irods_path, key):
+        with self._pool.session() as session:
+            avus = session.metadata.get(DataObject, irods_path)
+        for avu in avus:
+            if avu.name == key:
+                return avu.value
+        raise(IrodsNoMetaDataSetError())
+
+    def put_collection_metadata(self, irods_path, key, value):
+        with self._pool.session() as session:
+            session.metadata.set(Collection, irods_path, iRODSMeta(key, value))
+
+    def delete_collection_metadata(self, irods_path, key):
+        with self._pool.session() as session:
+            for avu in session.metadata.get(Collection, irods_path):
+                if avu.name == key:
+                    session.metadata.remove(Collection, irods_path, avu)
+
+    def query_collections_with_metadata(self, irods_path, key, value=None):
+        irods_path = irods_path.rstrip("/")
+        with self._pool.session() as session:
+            query = session.query(
+                Collection.name
+            ).filter(
+                Like(Collection.name, irods_path + "/%")
+            ).filter(
+                CollectionMeta.name == key
+            )
+            if value is not None:
+                query = query.filter(CollectionMeta.value == value)
+            prefix = irods_path + "/"
+            return sorted(
+                row[Collection.name] for row in query
+                if row[Collection.name].startswith(prefix)
+            )
+
+    def get_checksum(self, irods_path, verify=True):
+        # Same strategy as the iCommands: verify first and fall back on the
+        # registered checksum if iRODS misreports the verification.
+        with self._pool.session() as session:
+            checksum = ""
+            if verify:
+                checksum = session.data_objects.chksum(
+                    irods_path,
+                    **{kw.VERIFY_CHKSUM_KW: ""}
+                )
+            if not checksum:
+                checksum = session.data_objects.chksum(irods_path)
+        checksum = _strip_checksum_algorithm(checksum)
+        assert checksum, 'Missing checksum in output.'
+        return checksum
+
+    def get_size_and_timestamp(self, irods_path):
+        with self._pool.session() as session:
+            obj = session.data_objects.get(irods_path)
+            return obj.size, _datetime_to_utc_timestamp(obj.modify_time)
+
+    def query_catalog(self, irods_path):
+        with self._pool.session() as session:
+            query = session.query(
+                DataObject.name,
+                DataObjectMeta.value,
+                DataObject.size,
+                DataObject.modify_time,
+                DataObject.checksum
+            ).filter(
+                Collection.name == irods_path
+            ).filter(
+                DataObjectMeta.name == "handle"
+            )
+            rows = [(
+                row[DataObject.name],
+                row[DataObjectMeta.value],
+                row[DataObject.size],
+                _datetime_to_utc_timestamp(row[DataObject.modify_time]),
+                row[DataObject.checksum] or ""
+            ) for row in query]
+        return _parse_catalog_rows(rows)
+
+    def query_replicas(self, irods_path):
+        with self._pool.session() as session:
+            query = session.query(
+                DataObject.name,
+                DataObject.path,
+                DataObject.size,
+                DataObject.checksum,
+                DataObject.replica_status
+            ).filter(
+                Collection.name == irods_path
+            )
+            rows = [(
+                row[DataObject.name],
+                row[DataObject.path],
+                row[DataObject.size],
+                row[DataObject.checksum] or "",
+                row[DataObject.replica_status]
+            ) for row in query]
+        return _parse_replica_rows(rows)
+
+    def query_tree(self, irods_path, exclude=None):
+        with self._pool.session() as session:
+            query = session.query(
+                Collection.name,
+                DataObject.name,
+                DataObject.size,
+                DataObject.modify_time
+            ).filter(
+                Like(Collection.name, irods_path + "%")
+            )
+            if exclude is not None:
+                query = query.filter(NotLike(Collection.name, exclude + "%"))
+            rows = [(
+                row[Collection.name],
+                row[DataObject.name],
+                row[DataObject.size],
+                _datetime_to_utc_timestamp(row[DataObject.modify_time])
+            ) for row in query]
+        return _parse_tree_rows(rows, irods_path, exclude)
+
+    def iter_dataset_paths(self, irods_path):
+        irods_path = irods_path.rstrip("/")
+        with self._pool.session() as session:
+            query = session.query(
+                Collection.name
+            ).filter(
+                Like(Collection.name, irods_path + "/%/.dtool")
+            ).filter(
+                DataObject.name == "dtool"
+            )
+            # The catalog returns the results in pages as they are iterated.
+            for row in query:
+                dataset_path = _dataset_path_from_dtool_collection(
+                    irods_path,
+                    row[Collection.name]
+                )
+                if dataset_path is not None:
+                    yield dataset_path
+
+    def query_dataset_timestamps(self, irods_path):
+        irods_path = irods_path.rstrip("/")
+        with self._pool.session() as session:
+            query = session.query(
+                Collection.name,
+                DataObject.modify_time
+            ).filter(
+                Like(Collection.name, irods_path + "/%/.dtool")
+            ).filter(
+                DataObject.name == "dtool"
+            )
+            rows = [(
+                row[Collection.name],
+                _datetime_to_utc_timestamp(row[DataObject.modify_time])
+            ) for row in query]
+        return _parse_dataset_timestamp_rows(rows, irods_path)
+
+    def query_dataset_tags(self, irods_path):
+        irods_path = irods_path.rstrip("/")
+        with self._pool.session() as session:
+            query = session.query(
+                Collection.name,
+                DataObject.name
+            ).filter(
+                Like(Collection.name, irods_path + "/%/.dtool/tags")
+            )
+            rows = [
+                (row[Collection.name], row[DataObject.name]) for row in query
+            ]
+        return _parse_dataset_tag_rows(rows, irods_path)
+
+
+#############################################################################
+# Transport selection.
+#############################################################################
+
+_TRANSPORTS = {}
+_TRANSPORTS_LOCK = threading.Lock()
+
+
+def _native_session_factory(irods_env_file):
+    """Return factory creating sessions from an iRODS environment file.
+
+    The sessions authenticate using the credentials cached by ``iinit``.
+    """
+    if iRODSSession is None:
+        raise(RuntimeError(
+            "The native iRODS transport requires python-irodsclient"
+        ))
+
+    def session_factory():
+        return iRODSSession(irods_env_file=irods_env_file)
+    return session_factory
+
+
+def get_transport(config_path=None):
+    """Return the transport selected in the dtool configuration.
+
+    The ``DTOOL_IRODS_TRANSPORT`` configuration value is either
+    ``icommands`` (default) or ``native``. The native transport reads the
+    connection details from ``IRODS_ENVIRONMENT_FILE`` and keeps up to
+    ``DTOOL_IRODS_NATIVE_POOL_SIZE`` sessions open.
+
+    Transports are shared between storage brokers using the same settings.
+
+    :param config_path: path to dtool configuration file
+    :returns: :class:`BaseTransport` instance
+    """
+    key = get_config_value(
+        "DTOOL_IRODS_TRANSPORT",
+        config_path=config_path,
+        default=DEFAULT_TRANSPORT
+    )
+
+    if key == IcommandsTransport.key:
+        settings = (key,)
+    elif key == NativeTransport.key:
+        irods_env_file = get_config_value(
+            "IRODS_ENVIRONMENT_FILE",
+            config_path=config_path,
+            default=DEFAULT_IRODS_ENVIRONMENT_FILE
+        )
+        pool_size = int(get_config_value(
+            "DTOOL_IRODS_NATIVE_POOL_SIZE",
+            config_path=config_path,
+            default=DEFAULT_POOL_SIZE
+        ))
+        settings = (key, irods_env_file, pool_size)
+    else:
+        raise(ValueError("Unknown iRODS transport: {}".format(key)))
+
+    with _TRANSPORTS_LOCK:
+        if settings not in _TRANSPORTS:
+            logger.info("Creating iRODS transport: {}".format(settings))
+            if key == IcommandsTransport.key:
+                transport = IcommandsTransport()
+            else:
+                pool = SessionPool(
+                    _native_session_factory(irods_env_file),
+                    size=pool_size
+                )
+                transport = NativeTransport(pool)
+            _TRANSPORTS[settings] = transport
+        return _TRANSPORTS[settings]
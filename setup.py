@@ -19,6 +19,9 @@ setup(
         "click",
         "dtoolcore>=3.17",
     ],
+    extras_require={
+        "native": ["python-irodsclient"],
+    },
     entry_points={
         "dtool.storage_brokers": [
             "IrodsStorageBroker=dtool_irods.storagebroker:IrodsStorageBroker",
@@ -21,6 +21,7 @@ _HERE = os.path.dirname(__file__)
 TEST_SAMPLE_DATA = os.path.join(_HERE, "data")
 
 TEST_ZONE = "/jic_overflow/dtool-testing"
+STAND_IN_COLLECTION = "/stand_in/dtool-testing"
 
 
 @contextmanager
@@ -103,3 +104,64 @@ def tmp_irods_base_uri_fixture(request):
         _rm_if_exists(collection)
 
     return "irods:" + collection
+
+
+def create_dataset(base_uri, name="test_dataset", items=("a.png",),
+                   readme=None, item_metadata=None, freeze=True):
+    """Create a dataset whose items are copies of the sample data.
+
+    :param base_uri: base URI of the dataset
+    :param name: name of the dataset
+    :param items: relpaths of the items, with the content of tiny.png, or
+                  dict of relpaths to the names of the sample data files
+                  with their content
+    :param readme: content of the README
+    :param item_metadata: dict of metadata added to every item
+    :param freeze: whether to freeze the dataset
+    :returns: :class:`dtoolcore.DataSet`, or :class:`dtoolcore.ProtoDataSet`
+              if not frozen
+    """
+    from dtoolcore import DataSet, generate_proto_dataset
+
+    if not isinstance(items, dict):
+        items = dict((relpath, "tiny.png") for relpath in items)
+
+    admin_metadata = generate_admin_metadata(name)
+    proto_dataset = generate_proto_dataset(admin_metadata, base_uri)
+    proto_dataset.create()
+    if readme is not None:
+        proto_dataset.put_readme(readme)
+    for relpath in sorted(items):
+        fpath = os.path.join(TEST_SAMPLE_DATA, items[relpath])
+        proto_dataset.put_item(fpath, relpath)
+        for key, value in (item_metadata or {}).items():
+            proto_dataset.add_item_metadata(relpath, key, value)
+    if not freeze:
+        return proto_dataset
+    proto_dataset.freeze()
+    return DataSet.from_uri(proto_dataset.uri)
+
+
+@pytest.fixture
+def stand_in_zone(request, monkeypatch, tmp_dir_fixture):
+    """Use the native transport against an in memory stand-in iRODS server.
+
+    Returns the :class:`tests.irods_stand_in.StandInZone` and the base URI of
+    an empty collection in it.
+    """
+    from dtool_irods import transport
+    from .irods_stand_in import StandInZone
+
+    zone = StandInZone()
+    zone.collections.update(["/stand_in", STAND_IN_COLLECTION])
+
+    monkeypatch.setattr(
+        transport,
+        "_native_session_factory",
+        lambda irods_env_file: zone.session_factory
+    )
+    monkeypatch.setattr(transport, "_TRANSPORTS", {})
+    monkeypatch.setenv("DTOOL_IRODS_TRANSPORT", "native")
+    monkeypatch.setenv("DTOOL_CACHE_DIRECTORY", tmp_dir_fixture)
+
+    return zone, "irods:" + STAND_IN_COLLECTION
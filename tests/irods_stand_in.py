@@ -0,0 +1,391 @@
+"""In memory stand-in for an iRODS server.
+
+Provides sessions mimicking the parts of the python-irodsclient
+``iRODSSession`` API used by :class:`dtool_irods.transport.NativeTransport`.
+"""
+
+import io
+import os
+import re
+import base64
+import hashlib
+import datetime
+import threading
+
+import irods.keywords as kw
+from irods.meta import iRODSMeta
+from irods.models import (
+    Collection,
+    CollectionMeta,
+    DataObject,
+    DataObjectMeta,
+)
+
+
+class StandInError(Exception):
+    pass
+
+
+class StandInZone(object):
+    """Catalog and storage of the stand-in server."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.collections = set(["/"])
+        self.data_objects = {}
+        self.collection_avus = {}
+        self.num_sessions = 0
+        self.calls = []
+
+    def session_factory(self):
+        with self.lock:
+            self.num_sessions += 1
+        return StandInSession(self)
+
+
+class StandInDataObject(object):
+
+    def __init__(self, path, content=b""):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.content = content
+        self.modify_time = datetime.datetime.utcnow()
+        self.checksum = None
+        self.physical_path = None
+        self.avus = []
+
+    @property
+    def size(self):
+        return len(self.content)
+
+
+class _Writer(io.BytesIO):
+
+    def __init__(self, obj, register_checksum=False):
+        super(_Writer, self).__init__()
+        self._obj = obj
+        self._register_checksum = register_checksum
+
+    def close(self):
+        if not self.closed:
+            self._obj.content = self.getvalue()
+            self._obj.modify_time = datetime.datetime.utcnow()
+            self._obj.checksum = None
+            if self._register_checksum:
+                self._obj.checksum = _sha2(self._obj.content)
+        super(_Writer, self).close()
+
+
+def _sha2(content):
+    digest = hashlib.sha256(content).digest()
+    return "sha2:" + base64.b64encode(digest).decode("ascii")
+
+
+class _DataObjectManager(object):
+
+    def __init__(self, zone):
+        self.zone = zone
+
+    def _get(self, path):
+        try:
+            return self.zone.data_objects[path]
+        except KeyError:
+            raise(StandInError("No such data object: {}".format(path)))
+
+    def _create(self, path):
+        if os.path.dirname(path) not in self.zone.collections:
+            raise(StandInError("No such collection: {}".format(path)))
+        obj = self.zone.data_objects.get(path)
+        if obj is None:
+            obj = StandInDataObject(path)
+            self.zone.data_objects[path] = obj
+        return obj
+
+    def exists(self, path):
+        return path in self.zone.data_objects
+
+    def create(self, path, **options):
+        with self.zone.lock:
+            return self._create(path)
+
+    def open(self, path, mode, **options):
+        self.zone.calls.append(("open", path, mode))
+        with self.zone.lock:
+            if mode == "r":
+                return io.BytesIO(self._get(path).content)
+            return _Writer(
+                self._create(path),
+                register_checksum=kw.REG_CHKSUM_KW in options
+            )
+
+    def get(self, path, local_path=None, **options):
+        self.zone.calls.append(("get", path))
+        obj = self._get(path)
+        if local_path is not None:
+            if os.path.exists(local_path) \
+                    and kw.FORCE_FLAG_KW not in options:
+                raise(StandInError("OVERWRITE_WITHOUT_FORCE_FLAG"))
+            with open(local_path, "wb") as fh:
+                fh.write(obj.content)
+        return obj
+
+    def put(self, local_path, irods_path, **options):
+        self.zone.calls.append(("put", irods_path))
+        with open(local_path, "rb") as fh:
+            content = fh.read()
+        with self.zone.lock:
+            if self.exists(irods_path) \
+                    and kw.FORCE_FLAG_KW not in options:
+                raise(StandInError("OVERWRITE_WITHOUT_FORCE_FLAG"))
+            obj = self._create(irods_path)
+            obj.content = content
+            obj.modify_time = datetime.datetime.utcnow()
+            obj.checksum = None
+            if kw.REG_CHKSUM_KW in options \
+                    or kw.VERIFY_CHKSUM_KW in options:
+                obj.checksum = _sha2(content)
+
+    def copy(self, src_path, dest_path, **options):
+        self.zone.calls.append(("copy", src_path, dest_path))
+        with self.zone.lock:
+            src = self._get(src_path)
+            if self.exists(dest_path) and kw.FORCE_FLAG_KW not in options:
+                raise(StandInError("OVERWRITE_WITHOUT_FORCE_FLAG"))
+            obj = self._create(dest_path)
+            obj.content = src.content
+            obj.modify_time = datetime.datetime.utcnow()
+            obj.checksum = None
+            if kw.REG_CHKSUM_KW in options:
+                obj.checksum = _sha2(obj.content)
+
+    def register(self, physical_path, path, **options):
+        self.zone.calls.append(("register", path))
+        # The stand-in has no vault; the content is read once to be served.
+        with open(physical_path, "rb") as fh:
+            content = fh.read()
+        with self.zone.lock:
+            if self.exists(path) and kw.FORCE_FLAG_KW not in options:
+                raise(StandInError("OVERWRITE_WITHOUT_FORCE_FLAG"))
+            obj = self._create(path)
+            obj.content = content
+            obj.physical_path = physical_path
+            obj.modify_time = datetime.datetime.utcnow()
+            obj.checksum = None
+            if kw.REG_CHKSUM_KW in options:
+                obj.checksum = _sha2(content)
+
+    def chksum(self, path, **options):
+        verify = kw.VERIFY_CHKSUM_KW in options
+        self.zone.calls.append(("chksum", path, verify))
+        obj = self._get(path)
+        if obj.checksum is None or verify:
+            obj.checksum = _sha2(obj.content)
+        return obj.checksum
+
+    def unlink(self, path, force=False, **options):
+        with self.zone.lock:
+            self._get(path)
+            del self.zone.data_objects[path]
+
+
+class StandInCollection(object):
+
+    def __init__(self, zone, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.data_objects = [
+            obj for p, obj in sorted(zone.data_objects.items())
+            if os.path.dirname(p) == path
+        ]
+        self.subcollections = [
+            StandInCollection(zone, p) for p in sorted(zone.collections)
+            if p != path and os.path.dirname(p) == path
+        ]
+
+
+class _CollectionManager(object):
+
+    def __init__(self, zone):
+        self.zone = zone
+
+    def exists(self, path):
+        return path in self.zone.collections
+
+    def create(self, path, **options):
+        with self.zone.lock:
+            while path not in self.zone.collections:
+                self.zone.collections.add(path)
+                path = os.path.dirname(path)
+
+    def get(self, path):
+        self.zone.calls.append(("collection", path))
+        with self.zone.lock:
+            if not self.exists(path):
+                raise(StandInError("No such collection: {}".format(path)))
+            return StandInCollection(self.zone, path)
+
+    def remove(self, path, recurse=True, force=False, **options):
+        prefix = path + "/"
+        with self.zone.lock:
+            self.zone.collections = set(
+                p for p in self.zone.collections
+                if p != path and not p.startswith(prefix)
+            )
+            for p in list(self.zone.data_objects.keys()):
+                if p.startswith(prefix):
+                    del self.zone.data_objects[p]
+            for p in list(self.zone.collection_avus.keys()):
+                if p == path or p.startswith(prefix):
+                    del self.zone.collection_avus[p]
+
+
+class _MetadataManager(object):
+
+    def __init__(self, zone):
+        self.zone = zone
+
+    def _avus(self, path, model_cls=DataObject):
+        if model_cls is Collection:
+            if path not in self.zone.collections:
+                raise(StandInError("No such collection: {}".format(path)))
+            return self.zone.collection_avus.setdefault(path, [])
+        try:
+            return self.zone.data_objects[path].avus
+        except KeyError:
+            raise(StandInError("No such data object: {}".format(path)))
+
+    def get(self, model_cls, path):
+        self.zone.calls.append(("imeta_ls", path))
+        with self.zone.lock:
+            return [iRODSMeta(n, v) for n, v in self._avus(path, model_cls)]
+
+    def add(self, model_cls, path, meta, **opts):
+        with self.zone.lock:
+            self._avus(path, model_cls).append((meta.name, meta.value))
+
+    def remove(self, model_cls, path, meta, **opts):
+        with self.zone.lock:
+            avus = self._avus(path, model_cls)
+            avus.remove((meta.name, meta.value))
+
+    def set(self, model_cls, path, meta, **opts):
+        self.zone.calls.append(("imeta_set", path))
+        with self.zone.lock:
+            avus = self._avus(path, model_cls)
+            avus[:] = [(n, v) for n, v in avus if n != meta.name]
+            avus.append((meta.name, meta.value))
+
+
+def _like(pattern, value):
+    regex = "".join(
+        ".*" if c == "%" else "." if c == "_" else re.escape(c)
+        for c in pattern
+    )
+    return re.match(regex + "$", value, re.DOTALL) is not None
+
+
+_OPERATORS = {
+    "=": lambda a, b: a == b,
+    "<>": lambda a, b: a != b,
+    ">": lambda a, b: a > b,
+    "<": lambda a, b: a < b,
+    "like": lambda a, b: _like(b, a),
+    "not like": lambda a, b: not _like(b, a),
+}
+
+
+class StandInQuery(object):
+    """GenQuery over the stand-in catalog.
+
+    Rows are the data objects, joined with their AVUs if any
+    DataObjectMeta column is involved, or the collections, joined with their
+    AVUs if any CollectionMeta column is involved.
+    """
+
+    def __init__(self, zone, columns):
+        self.zone = zone
+        self.columns = columns
+        self.criteria = []
+
+    def filter(self, *criteria):
+        self.criteria.extend(criteria)
+        return self
+
+    def _uses(self, model):
+        keys = list(self.columns) + [c.query_key for c in self.criteria]
+        model_columns = [
+            getattr(model, a) for a in dir(model)
+            if not a.startswith("_")
+        ]
+        return any(k in model_columns for k in keys)
+
+    def _data_object_rows(self):
+        for path, obj in sorted(self.zone.data_objects.items()):
+            row = {
+                Collection.name: os.path.dirname(path),
+                DataObject.name: obj.name,
+                DataObject.size: obj.size,
+                DataObject.modify_time: obj.modify_time,
+                DataObject.checksum: obj.checksum,
+                DataObject.path: obj.physical_path,
+                DataObject.replica_status: "1",
+            }
+            if self._uses(DataObjectMeta):
+                for name, value in obj.avus:
+                    avu_row = dict(row)
+                    avu_row[DataObjectMeta.name] = name
+                    avu_row[DataObjectMeta.value] = value
+                    yield avu_row
+            else:
+                yield row
+
+    def _collection_rows(self):
+        for path in sorted(self.zone.collections):
+            row = {Collection.name: path}
+            if self._uses(CollectionMeta):
+                for name, value in self.zone.collection_avus.get(path, []):
+                    avu_row = dict(row)
+                    avu_row[CollectionMeta.name] = name
+                    avu_row[CollectionMeta.value] = value
+                    yield avu_row
+            else:
+                yield row
+
+    def __iter__(self):
+        self.zone.calls.append(("query",))
+        with self.zone.lock:
+            if self._uses(DataObject) or self._uses(DataObjectMeta):
+                rows = list(self._data_object_rows())
+            else:
+                rows = list(self._collection_rows())
+        seen = set()
+        for row in rows:
+            if not all(
+                _OPERATORS[c.op](row[c.query_key], c.value)
+                for c in self.criteria
+            ):
+                continue
+            result = dict((c, row[c]) for c in self.columns)
+            key = tuple(result[c] for c in self.columns)
+            if key not in seen:
+                seen.add(key)
+                yield result
+
+    def all(self):
+        return list(self)
+
+
+class StandInSession(object):
+
+    def __init__(self, zone):
+        self.zone = zone
+        self.data_objects = _DataObjectManager(zone)
+        self.collections = _CollectionManager(zone)
+        self.metadata = _MetadataManager(zone)
+        self.closed = False
+
+    def query(self, *columns):
+        return StandInQuery(self.zone, columns)
+
+    def cleanup(self):
+        self.closed = True
@@ -8,10 +8,10 @@ def test_list_dataset_uris(tmp_irods_base_uri_fixture):  # NOQA
     import dtoolcore
     from dtool_irods.storagebroker import IrodsStorageBroker
 
-    assert [] == IrodsStorageBroker.list_dataset_uris(
+    assert [] == list(IrodsStorageBroker.list_dataset_uris(
         base_uri=tmp_irods_base_uri_fixture,
         config_path=None
-    )
+    ))
 
     # Create two datasets to be copied.
     expected_uris = []
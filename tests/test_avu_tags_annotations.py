@@ -0,0 +1,177 @@
+"""Test mirroring tags and annotations as AVUs on the dataset collection."""
+
+import hashlib
+
+from . import create_dataset
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+def test_tags_and_annotations_mirrored_as_avus(stand_in_zone):  # NOQA
+    from dtoolcore import DataSet
+
+    zone, base_uri = stand_in_zone
+    uri = create_dataset(base_uri, "mirrored", items=[]).uri
+    collection = uri.split(":", 1)[1]
+
+    dataset = DataSet.from_uri(uri)
+    dataset.put_tag("production")
+    dataset.put_tag("production")
+    dataset.put_annotation("project", "x")
+    dataset.put_annotation("project", "y")
+    assert sorted(zone.collection_avus[collection]) == [
+        ("dtool.annotation.project", '"y"'),
+        ("dtool.tag.production", "production"),
+    ]
+
+    dataset.delete_tag("production")
+    dataset.delete_annotation("project")
+    assert zone.collection_avus[collection] == []
+
+
+def test_list_dataset_uris_with_tag_and_annotation(stand_in_zone):  # NOQA
+    from dtoolcore import DataSet
+    from dtool_irods.storagebroker import IrodsStorageBroker
+
+    zone, base_uri = stand_in_zone
+    uris = [
+        create_dataset(base_uri, n, items=[]).uri
+        for n in ["ds1", "ds2", "ds3"]
+    ]
+    for uri, stage, size in zip(uris, ["prod", "prod", "dev"], [1, 2, 1]):
+        dataset = DataSet.from_uri(uri)
+        dataset.put_tag(stage)
+        dataset.put_annotation("size", size)
+
+    del zone.calls[:]
+    assert IrodsStorageBroker.list_dataset_uris_with_tag(base_uri, "prod") \
+        == sorted(uris[:2])
+    assert zone.calls == [("query",)]
+
+    assert IrodsStorageBroker.list_dataset_uris_with_annotation(
+        base_uri, "size", 1) == sorted([uris[0], uris[2]])
+    assert IrodsStorageBroker.list_dataset_uris_with_annotation(
+        base_uri, "size") == sorted(uris)
+    assert IrodsStorageBroker.list_dataset_uris_with_tag(base_uri, "x") == []
+
+
+def test_mirror_tags_and_annotations(stand_in_zone):  # NOQA
+    from dtoolcore import DataSet
+    from dtool_irods.storagebroker import IrodsStorageBroker
+
+    zone, base_uri = stand_in_zone
+    uri = create_dataset(base_uri, "old", items=[]).uri
+    dataset = DataSet.from_uri(uri)
+    dataset.put_tag("legacy")
+    dataset.put_annotation("owner", "me")
+
+    # As if tagged and annotated before the AVUs were written.
+    zone.collection_avus[uri.split(":", 1)[1]] = []
+    assert IrodsStorageBroker.list_dataset_uris_with_tag(
+        base_uri, "legacy") == []
+
+    dataset._storage_broker.mirror_tags_and_annotations()
+    assert IrodsStorageBroker.list_dataset_uris_with_tag(
+        base_uri, "legacy") == [uri]
+    assert IrodsStorageBroker.list_dataset_uris_with_annotation(
+        base_uri, "owner", "me") == [uri]
+
+
+def test_long_annotation_mirrored_as_hash(stand_in_zone):  # NOQA
+    from dtoolcore import DataSet
+    from dtool_irods.storagebroker import (
+        IrodsStorageBroker,
+        MAX_AVU_VALUE_LENGTH,
+    )
+
+    zone, base_uri = stand_in_zone
+    uri = create_dataset(base_uri, "long", items=[]).uri
+    collection = uri.split(":", 1)[1]
+    annotation = ["x" * 100] * 100
+
+    dataset = DataSet.from_uri(uri)
+    dataset.put_annotation("samples", annotation)
+    assert dataset.get_annotation("samples") == annotation
+    [(key, value)] = zone.collection_avus[collection]
+    assert key == "dtool.annotation.samples"
+    assert value.startswith("sha256:")
+    assert len(value) < MAX_AVU_VALUE_LENGTH
+
+    assert IrodsStorageBroker.list_dataset_uris_with_annotation(
+        base_uri, "samples", annotation) == [uri]
+    assert IrodsStorageBroker.list_dataset_uris_with_annotation(
+        base_uri, "samples", ["x"]) == []
+
+
+def test_failing_avu_does_not_fail_write(stand_in_zone, monkeypatch):  # NOQA
+    import sys
+    from dtoolcore import DataSet
+
+    zone, base_uri = stand_in_zone
+    uri = create_dataset(base_uri, "failing", items=[]).uri
+    dataset = DataSet.from_uri(uri)
+
+    # As the iCommands transport does when imeta fails.
+    def fail(*args):
+        sys.exit(4)
+
+    transport = dataset._storage_broker._transport
+    monkeypatch.setattr(transport, "put_collection_metadata", fail)
+    monkeypatch.setattr(transport, "delete_collection_metadata", fail)
+
+    dataset.put_tag("production")
+    dataset.put_annotation("project", "x")
+    assert dataset.list_tags() == ["production"]
+    assert dataset.get_annotation("project") == "x"
+
+    dataset.delete_tag("production")
+    dataset.delete_annotation("project")
+    assert dataset.list_tags() == []
+    assert dataset.list_annotation_names() == []
+
+
+def test_annotations_queried_by_value(stand_in_zone):  # NOQA
+    from dtoolcore import DataSet
+    from dtool_irods.storagebroker import IrodsStorageBroker
+
+    zone, base_uri = stand_in_zone
+    uri = create_dataset(base_uri, "values", items=[]).uri
+    collection = uri.split(":", 1)[1]
+
+    dataset = DataSet.from_uri(uri)
+    dataset.put_annotation("status", "it's done")
+    dataset.put_annotation("shape", {"b": 1, "a": 2})
+    assert sorted(zone.collection_avus[collection]) == [
+        ("dtool.annotation.shape", '{"a": 2, "b": 1}'),
+        (
+            "dtool.annotation.status",
+            "sha256:" + hashlib.sha256(b'"it\'s done"').hexdigest()
+        ),
+    ]
+
+    assert IrodsStorageBroker.list_dataset_uris_with_annotation(
+        base_uri, "status", "it's done") == [uri]
+    assert IrodsStorageBroker.list_dataset_uris_with_annotation(
+        base_uri, "shape", {"a": 2, "b": 1}) == [uri]
+
+
+
+def test_annotation_value_quoted_in_iquest(monkeypatch):
+    from dtool_irods import transport
+    from dtool_irods.storagebroker import IrodsStorageBroker
+
+    queries = []
+
+    def iquest(query, columns):
+        queries.append(query)
+        return []
+
+    monkeypatch.setattr(transport, "_iquest", iquest)
+    monkeypatch.setattr(transport, "_TRANSPORTS", {})
+    monkeypatch.setenv("DTOOL_IRODS_TRANSPORT", "icommands")
+
+    IrodsStorageBroker.list_dataset_uris_with_annotation(
+        "irods:/zone", "status", "it's done")
+    [query] = queries
+    value_condition = query.split(" AND META_COLL_ATTR_VALUE = ")[1]
+    assert value_condition.count("'") == 2
@@ -0,0 +1,234 @@
+"""Test the size bounded cache of item content."""
+
+import os
+import time
+
+import pytest
+
+from . import tmp_env_var
+from . import TEST_SAMPLE_DATA
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+def _cache_file(cache_abspath, dataset_uuid, name, size):
+    dataset_abspath = os.path.join(cache_abspath, dataset_uuid)
+    if not os.path.isdir(dataset_abspath):
+        os.makedirs(dataset_abspath)
+    abspath = os.path.join(dataset_abspath, name)
+    with open(abspath, "wb") as fh:
+        fh.write(b"x" * size)
+    return abspath
+
+
+def test_least_recently_used_items_evicted(tmp_dir_fixture):  # NOQA
+    from dtool_irods.cache import CacheManager
+
+    cache_manager = CacheManager(tmp_dir_fixture, quota=25)
+
+    a = _cache_file(tmp_dir_fixture, "ds1", "a", 10)
+    cache_manager.add("ds1", a)
+    b = _cache_file(tmp_dir_fixture, "ds1", "b", 10)
+    cache_manager.add("ds1", b)
+
+    # Accessing "a" makes "b" the least recently used item.
+    time.sleep(0.01)
+    cache_manager.record_access("ds1", a)
+
+    c = _cache_file(tmp_dir_fixture, "ds2", "c", 10)
+    cache_manager.add("ds2", c)
+
+    assert os.path.isfile(a)
+    assert not os.path.isfile(b)
+    assert os.path.isfile(c)
+    assert cache_manager.size_in_bytes() == 20
+
+
+def test_newly_added_item_not_evicted(tmp_dir_fixture):  # NOQA
+    from dtool_irods.cache import CacheManager
+
+    cache_manager = CacheManager(tmp_dir_fixture, quota=5)
+    a = _cache_file(tmp_dir_fixture, "ds1", "a", 10)
+    cache_manager.add("ds1", a)
+    assert os.path.isfile(a)
+
+
+def test_pinned_dataset_not_evicted(tmp_dir_fixture):  # NOQA
+    from dtool_irods.cache import CacheManager
+
+    cache_manager = CacheManager(tmp_dir_fixture, quota=15)
+    cache_manager.pin("ds1")
+    assert cache_manager.pinned_datasets() == ["ds1"]
+
+    a = _cache_file(tmp_dir_fixture, "ds1", "a", 10)
+    cache_manager.add("ds1", a)
+    b = _cache_file(tmp_dir_fixture, "ds2", "b", 10)
+    cache_manager.add("ds2", b)
+    c = _cache_file(tmp_dir_fixture, "ds2", "c", 6)
+    cache_manager.add("ds2", c)
+
+    assert os.path.isfile(a)
+    assert not os.path.isfile(b)
+
+    cache_manager.unpin("ds1")
+    assert cache_manager.pinned_datasets() == []
+    cache_manager.enforce_quota()
+    assert not os.path.isfile(a)
+    assert os.path.isfile(c)
+
+
+@pytest.mark.skipif(
+    not os.path.isdir("/proc/self/fd"),
+    reason="Open files can only be detected using /proc"
+)
+def test_open_file_not_evicted(tmp_dir_fixture):  # NOQA
+    from dtool_irods.cache import CacheManager
+
+    cache_manager = CacheManager(tmp_dir_fixture, quota=15)
+    a = _cache_file(tmp_dir_fixture, "ds1", "a", 10)
+    cache_manager.add("ds1", a)
+
+    with open(a, "rb"):
+        b = _cache_file(tmp_dir_fixture, "ds1", "b", 10)
+        cache_manager.add("ds1", b)
+        assert os.path.isfile(a)
+
+    cache_manager.enforce_quota()
+    assert not os.path.isfile(a)
+
+
+def test_least_recently_used_datasets_evicted(tmp_dir_fixture):  # NOQA
+    from dtool_irods.cache import CacheManager, EVICT_DATASETS
+
+    cache_manager = CacheManager(
+        tmp_dir_fixture,
+        quota=25,
+        eviction=EVICT_DATASETS
+    )
+    a = _cache_file(tmp_dir_fixture, "ds1", "a", 10)
+    cache_manager.add("ds1", a)
+    b = _cache_file(tmp_dir_fixture, "ds1", "b", 10)
+    cache_manager.add("ds1", b)
+    c = _cache_file(tmp_dir_fixture, "ds2", "c", 10)
+    cache_manager.add("ds2", c)
+
+    assert not os.path.exists(os.path.join(tmp_dir_fixture, "ds1"))
+    assert os.path.isfile(c)
+    assert sorted(os.listdir(tmp_dir_fixture)) \
+        == ["ds2", "dtool-irods-cache-index.sqlite"]
+
+
+def test_unknown_eviction_policy_raises(tmp_dir_fixture):  # NOQA
+    from dtool_irods.cache import CacheManager
+    with pytest.raises(ValueError):
+        CacheManager(tmp_dir_fixture, eviction="random")
+
+
+def test_index_shared_between_managers(tmp_dir_fixture):  # NOQA
+    from dtool_irods.cache import CacheManager
+
+    a = _cache_file(tmp_dir_fixture, "ds1", "a", 10)
+    CacheManager(tmp_dir_fixture).add("ds1", a)
+
+    # Files cached before they were indexed are picked up when accessed.
+    b = _cache_file(tmp_dir_fixture, "ds1", "b", 5)
+    cache_manager = CacheManager(tmp_dir_fixture)
+    cache_manager.record_access("ds1", b)
+    cache_manager.flush()
+
+    assert CacheManager(tmp_dir_fixture).size_in_bytes() == 15
+
+
+def test_get_item_abspath_keeps_cache_within_quota(stand_in_zone, tmp_dir_fixture):  # NOQA
+    from dtoolcore import (
+        DataSet,
+        generate_admin_metadata,
+        generate_proto_dataset,
+    )
+
+    zone, base_uri = stand_in_zone
+
+    admin_metadata = generate_admin_metadata("quota")
+    proto_dataset = generate_proto_dataset(admin_metadata, base_uri)
+    proto_dataset.create()
+    sizes = []
+    for f in os.listdir(TEST_SAMPLE_DATA):
+        fpath = os.path.join(TEST_SAMPLE_DATA, f)
+        sizes.append(os.path.getsize(fpath))
+        proto_dataset.put_item(fpath, f)
+    proto_dataset.freeze()
+
+    quota = max(sizes)
+    with tmp_env_var("DTOOL_IRODS_CACHE_QUOTA", str(quota)):
+        dataset = DataSet.from_uri(proto_dataset.uri)
+    cache_manager = dataset._storage_broker._cache_manager
+
+    for identifier in dataset.identifiers:
+        abspath = dataset.item_content_abspath(identifier)
+        assert os.path.isfile(abspath)
+        assert cache_manager.size_in_bytes() <= quota
+
+    dataset_cache_abspath = os.path.dirname(abspath)
+    assert sum(
+        os.path.getsize(os.path.join(dataset_cache_abspath, f))
+        for f in os.listdir(dataset_cache_abspath)
+    ) <= quota
+
+
+def test_stored_content_evicted_with_links(tmp_dir_fixture):  # NOQA
+    from dtool_irods.cache import CacheManager, content_abspath
+
+    cache_manager = CacheManager(tmp_dir_fixture, quota=15)
+
+    stored = content_abspath(tmp_dir_fixture, "abcdef")
+    os.makedirs(os.path.dirname(stored))
+    with open(stored, "wb") as fh:
+        fh.write(b"x" * 10)
+    links = []
+    for dataset_uuid in ["ds1", "ds2"]:
+        os.makedirs(os.path.join(tmp_dir_fixture, dataset_uuid))
+        link = os.path.join(tmp_dir_fixture, dataset_uuid, "a")
+        os.link(stored, link)
+        cache_manager.add(dataset_uuid, link, stored)
+        links.append(link)
+
+    # Shared content is only counted once.
+    assert cache_manager.size_in_bytes() == 10
+
+    b = _cache_file(tmp_dir_fixture, "ds3", "b", 10)
+    cache_manager.add("ds3", b)
+
+    assert not os.path.exists(stored)
+    assert not any(os.path.exists(link) for link in links)
+    assert os.path.isfile(b)
+
+
+def test_unlinked_content_evicted_with_dataset(tmp_dir_fixture):  # NOQA
+    from dtool_irods.cache import (
+        CacheManager,
+        content_abspath,
+        EVICT_DATASETS,
+    )
+
+    cache_manager = CacheManager(
+        tmp_dir_fixture,
+        quota=15,
+        eviction=EVICT_DATASETS
+    )
+
+    stored = content_abspath(tmp_dir_fixture, "abcdef")
+    os.makedirs(os.path.dirname(stored))
+    with open(stored, "wb") as fh:
+        fh.write(b"x" * 10)
+    os.makedirs(os.path.join(tmp_dir_fixture, "ds1"))
+    link = os.path.join(tmp_dir_fixture, "ds1", "a")
+    os.link(stored, link)
+    cache_manager.add("ds1", link, stored)
+
+    b = _cache_file(tmp_dir_fixture, "ds2", "b", 10)
+    cache_manager.add("ds2", b)
+
+    assert not os.path.exists(os.path.join(tmp_dir_fixture, "ds1"))
+    assert not os.path.exists(stored)
+    assert os.path.isfile(b)
+    assert cache_manager.size_in_bytes() == 10
@@ -0,0 +1,148 @@
+"""Test the catalog query used when freezing a dataset."""
+
+import os
+
+from . import TEST_SAMPLE_DATA
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+def test_parse_catalog_rows():
+    from dtool_irods.transport import _parse_catalog_rows, CatalogEntry
+
+    rows = [
+        ["abc", "a.txt", "6", "01634567890", ""],
+        ["abc", "a.txt", "6", "01634567890", "sha2:Zm9v"],
+        ["def", "dir/b.txt", "0", "1634567891", "sha2:YmFy"],
+    ]
+    catalog = _parse_catalog_rows(rows)
+    assert catalog == {
+        "abc": CatalogEntry("a.txt", 6, 1634567890, "Zm9v"),
+        "def": CatalogEntry("dir/b.txt", 0, 1634567891, "YmFy"),
+    }
+
+
+def test_freeze_uses_single_catalog_query(stand_in_zone):  # NOQA
+
+    zone, base_uri = stand_in_zone
+
+    from dtoolcore import DataSet, generate_admin_metadata
+    from dtoolcore import generate_proto_dataset
+    from dtoolcore.filehasher import sha256sum_hexdigest
+    from dtoolcore.utils import generate_identifier
+
+    admin_metadata = generate_admin_metadata("catalog")
+    proto_dataset = generate_proto_dataset(admin_metadata, base_uri)
+    proto_dataset.create()
+
+    filenames = ['tiny.png', 'actually_a_png.txt', 'another_file.txt']
+    for filename in filenames:
+        proto_dataset.put_item(
+            os.path.join(TEST_SAMPLE_DATA, filename),
+            filename
+        )
+
+    # Make sure that iRODS has registered checksums to report.
+    for filename in filenames:
+        proto_dataset._storage_broker._transport.get_checksum(
+            proto_dataset._storage_broker._get_item_key_from_handle(filename)
+        )
+
+    del zone.calls[:]
+    proto_dataset.freeze()
+
+    per_item_calls = [c for c in zone.calls if c[0] in ("imeta_ls", "chksum")]
+    assert per_item_calls == []
+
+    dataset = DataSet.from_uri(proto_dataset.uri)
+    for filename in filenames:
+        properties = dataset.item_properties(generate_identifier(filename))
+        assert properties["relpath"] == filename
+        assert properties["hash"] == sha256sum_hexdigest(
+            os.path.join(TEST_SAMPLE_DATA, filename)
+        )
+        assert properties["size_in_bytes"] == os.path.getsize(
+            os.path.join(TEST_SAMPLE_DATA, filename)
+        )
+
+
+def test_iter_iquest_early_close(monkeypatch):
+    import subprocess
+    from dtool_irods import transport
+
+    processes = []
+
+    def popen(args, **kwargs):
+        # Stand-in for an iquest with endless rows.
+        p = subprocess.Popen(["yes", "a\tb"], **kwargs)
+        processes.append(p)
+        return p
+
+    monkeypatch.setattr(transport, "Popen", popen)
+
+    rows = transport._iter_iquest("SELECT COLL_NAME", 2)
+    assert next(rows) == ["a", "b"]
+    rows.close()
+    assert processes[0].returncode is not None
+
+
+def test_parse_tree_rows():
+    from dtool_irods.transport import _parse_tree_rows
+
+    rows = [
+        ["/zone/ds", "README.yml", "10", "100"],
+        ["/zone/ds", "README.yml", "10", "105"],
+        ["/zone/ds/.dtool", "dtool", "5", "90"],
+        ["/zone/ds/data", "abc", "6", "90"],
+        ["/zone/ds2", "README.yml", "3", "90"],
+    ]
+    tree = _parse_tree_rows(rows, "/zone/ds", exclude="/zone/ds/data")
+    assert tree == {
+        "/zone/ds/README.yml": (10, 105),
+        "/zone/ds/.dtool/dtool": (5, 90),
+    }
+
+
+def test_dataset_path_from_dtool_collection():
+    from dtool_irods.transport import _dataset_path_from_dtool_collection
+
+    base = "/zone/project_a"
+    assert _dataset_path_from_dtool_collection(
+        base, "/zone/project_a/abc/.dtool") == "/zone/project_a/abc"
+    assert _dataset_path_from_dtool_collection(
+        base, "/zone/project_a/abc/nested/.dtool") is None
+    assert _dataset_path_from_dtool_collection(
+        base, "/zone/projectXa/abc/.dtool") is None
+
+
+def test_list_dataset_uris_single_query(stand_in_zone):  # NOQA
+    import types
+
+    from dtoolcore import generate_admin_metadata, generate_proto_dataset
+    from dtool_irods.storagebroker import IrodsStorageBroker
+    from .irods_stand_in import StandInDataObject
+
+    zone, base_uri = stand_in_zone
+
+    expected_uris = []
+    for name in ["ds_1", "ds_2", "ds_3"]:
+        admin_metadata = generate_admin_metadata(name)
+        proto_dataset = generate_proto_dataset(admin_metadata, base_uri)
+        proto_dataset.create()
+        expected_uris.append(proto_dataset.uri)
+
+    # Neither a collection without admin metadata nor a nested dataset is
+    # listed.
+    collection = base_uri.split(":", 1)[1]
+    zone.collections.add(collection + "/not_a_dataset")
+    nested = expected_uris[0].split(":", 1)[1] + "/nested/.dtool"
+    zone.collections.add(nested)
+    zone.data_objects[nested + "/dtool"] = StandInDataObject(
+        nested + "/dtool"
+    )
+
+    del zone.calls[:]
+    uris = IrodsStorageBroker.list_dataset_uris(base_uri, None)
+    assert isinstance(uris, types.GeneratorType)
+    assert sorted(uris) == sorted(expected_uris)
+    assert zone.calls == [("query",)]
@@ -0,0 +1,73 @@
+"""Test registering checksums when items are uploaded."""
+
+import os
+
+from . import TEST_SAMPLE_DATA
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+def _create_and_freeze(zone, base_uri):
+    from dtoolcore import generate_admin_metadata, generate_proto_dataset
+
+    admin_metadata = generate_admin_metadata("checksums")
+    proto_dataset = generate_proto_dataset(admin_metadata, base_uri)
+    proto_dataset.create()
+    del zone.calls[:]
+    for filename in ['tiny.png', 'another_file.txt']:
+        proto_dataset.put_item(
+            os.path.join(TEST_SAMPLE_DATA, filename),
+            filename
+        )
+    proto_dataset.freeze()
+    return proto_dataset
+
+
+def test_checksum_on_upload(stand_in_zone, monkeypatch):  # NOQA
+    from dtoolcore import DataSet
+    from dtoolcore.filehasher import sha256sum_hexdigest
+    from dtoolcore.utils import generate_identifier
+
+    zone, base_uri = stand_in_zone
+    monkeypatch.setenv("DTOOL_IRODS_CHECKSUM_ON_UPLOAD", "true")
+
+    proto_dataset = _create_and_freeze(zone, base_uri)
+
+    # The checksums were registered by the uploads, without reading the
+    # content back.
+    assert [c for c in zone.calls if c[0] == "chksum"] == []
+    item_objs = [
+        obj for path, obj in zone.data_objects.items()
+        if "/data/" in path
+    ]
+    assert len(item_objs) == 2
+    assert all(obj.checksum is not None for obj in item_objs)
+
+    dataset = DataSet.from_uri(proto_dataset.uri)
+    identifier = generate_identifier("tiny.png")
+    assert dataset.item_properties(identifier)["hash"] \
+        == sha256sum_hexdigest(os.path.join(TEST_SAMPLE_DATA, "tiny.png"))
+
+
+def test_audit_checksums(stand_in_zone, monkeypatch):  # NOQA
+    zone, base_uri = stand_in_zone
+    monkeypatch.setenv("DTOOL_IRODS_CHECKSUM_ON_UPLOAD", "true")
+    monkeypatch.setenv("DTOOL_IRODS_AUDIT_CHECKSUMS", "true")
+
+    _create_and_freeze(zone, base_uri)
+
+    verified = [c for c in zone.calls if c[0] == "chksum" and c[2]]
+    assert len(verified) == 2
+
+
+def test_get_config_flag(monkeypatch):
+    from dtool_irods import get_config_flag
+
+    assert get_config_flag("DTOOL_IRODS_TEST_FLAG") is False
+    assert get_config_flag("DTOOL_IRODS_TEST_FLAG", default=True) is True
+    for value in ["true", "True", "yes", "1", "on"]:
+        monkeypatch.setenv("DTOOL_IRODS_TEST_FLAG", value)
+        assert get_config_flag("DTOOL_IRODS_TEST_FLAG") is True
+    for value in ["false", "no", "0", ""]:
+        monkeypatch.setenv("DTOOL_IRODS_TEST_FLAG", value)
+        assert get_config_flag("DTOOL_IRODS_TEST_FLAG") is False
@@ -0,0 +1,112 @@
+"""Test the content addressed layout of the cache."""
+
+import os
+
+from . import tmp_env_var
+from . import create_dataset
+from . import TEST_SAMPLE_DATA
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+def _create_dataset(base_uri, name):
+    from dtoolcore import DataSet
+
+    uri = create_dataset(base_uri, name).uri
+    with tmp_env_var("DTOOL_IRODS_CONTENT_ADDRESSED_CACHE", "true"):
+        return DataSet.from_uri(uri)
+
+
+def test_content_shared_between_datasets(stand_in_zone):  # NOQA
+    from dtoolcore.filehasher import sha256sum_hexdigest
+    from dtoolcore.utils import generate_identifier
+
+    zone, base_uri = stand_in_zone
+    identifier = generate_identifier("a.png")
+    expected_hash = sha256sum_hexdigest(
+        os.path.join(TEST_SAMPLE_DATA, "tiny.png")
+    )
+
+    dataset1 = _create_dataset(base_uri, "first")
+    dataset2 = _create_dataset(base_uri, "second")
+
+    del zone.calls[:]
+    abspath1 = dataset1.item_content_abspath(identifier)
+    assert len([c for c in zone.calls if c[0] == "get"]) == 1
+
+    del zone.calls[:]
+    abspath2 = dataset2.item_content_abspath(identifier)
+    assert [c for c in zone.calls if c[0] == "get"] == []
+
+    assert abspath1 != abspath2
+    assert os.path.samefile(abspath1, abspath2)
+    assert sha256sum_hexdigest(abspath2) == expected_hash
+
+    cache_abspath = os.path.dirname(os.path.dirname(abspath1))
+    assert os.path.isfile(
+        os.path.join(cache_abspath, "sha256", expected_hash[:2], expected_hash)
+    )
+
+
+def _num_gets(zone):
+    return len([c for c in zone.calls if c[0] == "get"])
+
+
+def test_hard_links_unsupported(stand_in_zone, monkeypatch):  # NOQA
+    import errno
+    from dtoolcore.utils import generate_identifier
+    from dtool_irods import storagebroker
+
+    def link(src, dst):
+        raise(OSError(errno.EXDEV, "Invalid cross-device link"))
+
+    monkeypatch.setattr(storagebroker.os, "link", link)
+
+    zone, base_uri = stand_in_zone
+    identifier = generate_identifier("a.png")
+    dataset1 = _create_dataset(base_uri, "first")
+    dataset2 = _create_dataset(base_uri, "second")
+
+    # The content is copied out of the store rather than downloaded again.
+    del zone.calls[:]
+    abspath1 = dataset1.item_content_abspath(identifier)
+    assert _num_gets(zone) == 1
+    abspath2 = dataset2.item_content_abspath(identifier)
+    assert _num_gets(zone) == 1
+    assert os.path.getsize(abspath1) == os.path.getsize(abspath2) == 276
+
+
+def test_content_not_matching_hash(stand_in_zone):  # NOQA
+    from dtoolcore.utils import generate_identifier
+
+    zone, base_uri = stand_in_zone
+    identifier = generate_identifier("a.png")
+    dataset = _create_dataset(base_uri, "mismatch")
+    manifest = dataset._storage_broker._get_manifest_with_cache()
+    manifest["items"][identifier]["hash"] = "0" * 64
+
+    del zone.calls[:]
+    abspath = dataset.item_content_abspath(identifier)
+    assert _num_gets(zone) == 1
+    assert os.path.getsize(abspath) == 276
+    cache_abspath = os.path.dirname(os.path.dirname(abspath))
+    stored_abspath = os.path.join(cache_abspath, "sha256", "00", "0" * 62)
+    assert not os.path.exists(stored_abspath)
+
+
+def test_other_hash_function_bypasses_store(stand_in_zone):  # NOQA
+    from dtoolcore.utils import generate_identifier
+
+    zone, base_uri = stand_in_zone
+    identifier = generate_identifier("a.png")
+    dataset = _create_dataset(base_uri, "md5")
+    manifest = dataset._storage_broker._get_manifest_with_cache()
+    manifest["hash_function"] = "md5sum_hexdigest"
+    manifest["items"][identifier]["hash"] = "0" * 32
+
+    del zone.calls[:]
+    abspath = dataset.item_content_abspath(identifier)
+    assert _num_gets(zone) == 1
+    assert os.path.getsize(abspath) == 276
+    cache_abspath = os.path.dirname(os.path.dirname(abspath))
+    assert not os.path.exists(os.path.join(cache_abspath, "sha256"))
@@ -93,7 +93,9 @@ def test_proto_dataset_freeze_functional(tmp_uuid_and_uri):  # NOQA
     with pytest.raises(DtoolCoreTypeError):
         DataSet.from_uri(dest_uri)
 
-    # At this point the temporary fragments directory should exist.
+    # Once the buffered item metadata has been written out the temporary
+    # fragments directory should exist.
+    proto_dataset._storage_broker.flush_item_metadata()
     assert _path_exists(
         proto_dataset._storage_broker._metadata_fragments_abspath)
 
@@ -0,0 +1,111 @@
+"""Test the local index of datasets in iRODS."""
+
+import datetime
+
+from . import tmp_env_var
+from . import create_dataset
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+def _create_datasets(base_uri):
+    uris = {}
+    for name in ["rna-seq-1", "rna-seq-2", "imaging"]:
+        frozen = name != "imaging"
+        dataset = create_dataset(
+            base_uri,
+            name,
+            items=["tiny.png"],
+            freeze=frozen
+        )
+        if frozen:
+            dataset.put_tag("rna")
+        uris[name] = dataset.uri
+    return uris
+
+
+def _age_catalog(zone):
+    # Modification times have a resolution of a second.
+    for obj in zone.data_objects.values():
+        obj.modify_time -= datetime.timedelta(seconds=10)
+
+
+def _opened(zone):
+    return [c[1] for c in zone.calls if c[0] == "open"]
+
+
+def test_search_datasets(stand_in_zone):  # NOQA
+    from dtool_irods.storagebroker import IrodsStorageBroker
+
+    zone, base_uri = stand_in_zone
+    uris = _create_datasets(base_uri)
+    _age_catalog(zone)
+
+    results = IrodsStorageBroker.search_datasets([base_uri])
+    assert [r["uri"] for r in results] == sorted(uris.values())
+    by_name = dict((r["name"], r) for r in results)
+    assert by_name["rna-seq-1"]["tags"] == ["rna"]
+    assert by_name["rna-seq-1"]["size_in_bytes"] == 276
+    assert by_name["rna-seq-1"]["frozen_at"] is not None
+    assert by_name["imaging"]["tags"] == []
+    assert by_name["imaging"]["size_in_bytes"] is None
+    assert by_name["imaging"]["frozen_at"] is None
+
+    # Answered from the index without talking to iRODS.
+    del zone.calls[:]
+    results = IrodsStorageBroker.search_datasets(
+        [base_uri],
+        name="rna-*",
+        tag="rna",
+        creator=by_name["imaging"]["creator"],
+        frozen_after=0
+    )
+    assert sorted(r["name"] for r in results) == ["rna-seq-1", "rna-seq-2"]
+    assert IrodsStorageBroker.search_datasets([base_uri], name="x*") == []
+    assert zone.calls == []
+
+
+def test_refresh_is_incremental(stand_in_zone):  # NOQA
+    from dtoolcore import DataSet
+    from dtool_irods.storagebroker import IrodsStorageBroker
+
+    zone, base_uri = stand_in_zone
+    uris = _create_datasets(base_uri)
+    _age_catalog(zone)
+    IrodsStorageBroker.search_datasets([base_uri])
+
+    DataSet.from_uri(uris["rna-seq-1"]).update_name("renamed")
+    DataSet.from_uri(uris["rna-seq-2"]).put_tag("extra")
+
+    del zone.calls[:]
+    with tmp_env_var("DTOOL_IRODS_DATASET_INDEX_MAX_AGE", "0"):
+        results = IrodsStorageBroker.search_datasets([base_uri])
+
+    # Only the renamed dataset's admin metadata is downloaded again.
+    assert _opened(zone) == [
+        uris["rna-seq-1"].split(":", 1)[1] + "/.dtool/dtool"
+    ]
+    by_uri = dict((r["uri"], r) for r in results)
+    assert by_uri[uris["rna-seq-1"]]["name"] == "renamed"
+    assert by_uri[uris["rna-seq-1"]]["size_in_bytes"] == 276
+    assert by_uri[uris["rna-seq-2"]]["tags"] == ["extra", "rna"]
+
+
+def test_broker_uses_dataset_index(stand_in_zone):  # NOQA
+    from dtoolcore import DataSet
+    from dtool_irods.storagebroker import IrodsStorageBroker
+
+    zone, base_uri = stand_in_zone
+    uris = _create_datasets(base_uri)
+    _age_catalog(zone)
+
+    with tmp_env_var("DTOOL_IRODS_DATASET_INDEX", "true"):
+        assert list(IrodsStorageBroker.list_dataset_uris(base_uri, None)) \
+            == sorted(uris.values())
+
+        del zone.calls[:]
+        assert list(IrodsStorageBroker.list_dataset_uris(base_uri, None)) \
+            == sorted(uris.values())
+        dataset = DataSet.from_uri(uris["rna-seq-2"])
+        assert dataset.name == "rna-seq-2"
+        assert zone.calls == []
@@ -0,0 +1,57 @@
+"""Test the export of all the items of a dataset in a single transfer."""
+
+import os
+
+import pytest
+
+from . import create_dataset
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+from . import tmp_directory
+
+
+def _create_dataset(base_uri):
+    return create_dataset(
+        base_uri,
+        "export",
+        items=["a.png", "sub/b.png", "sub/deeper/c.png"]
+    )
+
+
+def test_export_items(stand_in_zone):  # NOQA
+    zone, base_uri = stand_in_zone
+    dataset = _create_dataset(base_uri)
+
+    with tmp_directory() as dest:
+        del zone.calls[:]
+        item_abspaths = dataset._storage_broker.export_items(dest)
+
+        # A single listing of the data collection, no metadata lookups.
+        assert len([c for c in zone.calls if c[0] == "collection"]) == 1
+        assert not [c for c in zone.calls if c[0] == "imeta_ls"]
+
+        assert sorted(os.listdir(dest)) == ["a.png", "sub"]
+        for identifier in dataset.identifiers:
+            relpath = dataset.item_properties(identifier)["relpath"]
+            assert item_abspaths[identifier] \
+                == os.path.join(dest, *relpath.split("/"))
+            assert os.path.getsize(item_abspaths[identifier]) == 276
+
+
+def test_export_items_missing_item(stand_in_zone):  # NOQA
+    from dtoolcore.storagebroker import StorageBrokerOSError
+
+    zone, base_uri = stand_in_zone
+    dataset = _create_dataset(base_uri)
+    identifier = list(dataset.identifiers)[0]
+    storage_broker = dataset._storage_broker
+    del zone.data_objects[
+        os.path.join(storage_broker._data_abspath, identifier)
+    ]
+
+    with tmp_directory() as dest:
+        with pytest.raises(StorageBrokerOSError):
+            storage_broker.export_items(dest)
+        # The staging directory is cleaned up.
+        assert not [d for d in os.listdir(dest)
+                    if d.startswith(".dtool-irods-staging-")]
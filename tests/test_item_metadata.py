@@ -0,0 +1,107 @@
+"""Test the batching of item metadata added before freezing."""
+
+from . import tmp_env_var
+from . import create_dataset
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+def _create_proto_dataset(base_uri, num_items):
+    relpaths = ["{}.png".format(i) for i in range(num_items)]
+    proto_dataset = create_dataset(
+        base_uri,
+        "item_metadata",
+        items=relpaths,
+        freeze=False
+    )
+    for i, relpath in enumerate(relpaths):
+        proto_dataset.add_item_metadata(relpath, "number", i)
+        proto_dataset.add_item_metadata(relpath, "even", i % 2 == 0)
+    return proto_dataset
+
+
+def _fragment_calls(zone, proto_dataset, name):
+    fragments_abspath = \
+        proto_dataset._storage_broker._metadata_fragments_abspath
+    return [c for c in zone.calls
+            if c[0] == name and c[1].startswith(fragments_abspath)]
+
+
+def test_item_metadata_batched(stand_in_zone):  # NOQA
+    from dtoolcore import DataSet
+
+    zone, base_uri = stand_in_zone
+    with tmp_env_var("DTOOL_IRODS_ITEM_METADATA_BATCH_SIZE", "4"):
+        proto_dataset = _create_proto_dataset(base_uri, 5)
+
+        # Two full batches of four entries have been written out.
+        assert len(_fragment_calls(zone, proto_dataset, "open")) == 2
+
+        del zone.calls[:]
+        proto_dataset.freeze()
+
+    # The remaining entries are written in one more fragment, and the
+    # fragments collection is downloaded once.
+    assert len(_fragment_calls(zone, proto_dataset, "open")) == 1
+    assert len(_fragment_calls(zone, proto_dataset, "collection")) == 1
+    assert len(_fragment_calls(zone, proto_dataset, "get")) == 3
+
+    dataset = DataSet.from_uri(proto_dataset.uri)
+    overlays = dict(
+        (n, dataset.get_overlay(n)) for n in dataset.list_overlay_names()
+    )
+    for identifier, properties in dataset._manifest["items"].items():
+        number = int(properties["relpath"].split(".")[0])
+        assert overlays["number"][identifier] == number
+        assert overlays["even"][identifier] == (number % 2 == 0)
+
+
+def test_get_item_metadata_before_freeze(stand_in_zone):  # NOQA
+    zone, base_uri = stand_in_zone
+    proto_dataset = _create_proto_dataset(base_uri, 2)
+    proto_dataset.add_item_metadata("1.png", "number", 10)
+
+    storage_broker = proto_dataset._storage_broker
+    assert storage_broker.get_item_metadata("0.png") \
+        == {"number": 0, "even": True}
+    assert storage_broker.get_item_metadata("1.png") \
+        == {"number": 10, "even": False}
+    assert storage_broker.get_item_metadata("2.png") == {}
+
+
+def test_item_metadata_flushed_when_broker_collected(stand_in_zone):  # NOQA
+    import gc
+    from dtoolcore import DataSet, ProtoDataSet
+
+    zone, base_uri = stand_in_zone
+    uri = _create_proto_dataset(base_uri, 1).uri
+
+    def add_item_metadata():
+        ProtoDataSet.from_uri(uri).add_item_metadata("0.png", "colour", "red")
+
+    add_item_metadata()
+    gc.collect()
+
+    ProtoDataSet.from_uri(uri).freeze()
+    dataset = DataSet.from_uri(uri)
+    assert list(dataset.get_overlay("colour").values()) == ["red"]
+
+
+def test_flushed_buffer_released(stand_in_zone):  # NOQA
+    import gc
+    import weakref
+    from dtool_irods.storagebroker import _UNFLUSHED_ITEM_METADATA_BUFFERS
+
+    zone, base_uri = stand_in_zone
+    proto_dataset = _create_proto_dataset(base_uri, 1)
+    storage_broker = proto_dataset._storage_broker
+    buffer_ref = weakref.ref(storage_broker._item_metadata_buffer)
+    assert buffer_ref() in _UNFLUSHED_ITEM_METADATA_BUFFERS
+
+    # Once written the buffer, and its transport, are no longer kept alive
+    # until the process exits.
+    storage_broker.flush_item_metadata()
+    assert buffer_ref() not in _UNFLUSHED_ITEM_METADATA_BUFFERS
+    del proto_dataset, storage_broker
+    gc.collect()
+    assert buffer_ref() is None
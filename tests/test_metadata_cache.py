@@ -0,0 +1,77 @@
+"""Test the persistent cache of dataset metadata."""
+
+from . import tmp_env_var
+from . import create_dataset
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+def _create_dataset(base_uri):
+    dataset = create_dataset(
+        base_uri,
+        "metadata_cache",
+        readme="---\ndescription: cached\n"
+    )
+    dataset.put_overlay("animal", {i: "dog" for i in dataset.identifiers})
+    dataset.put_annotation("project", "cache")
+    dataset.put_tag("cached")
+    return dataset.uri
+
+
+def _read_everything(dataset):
+    return (
+        dataset.name,
+        dataset._manifest,
+        dataset.get_readme_content(),
+        dataset.list_overlay_names(),
+        [dataset.get_overlay(n) for n in dataset.list_overlay_names()],
+        [dataset.get_annotation(n) for n in dataset.list_annotation_names()],
+        dataset.list_tags(),
+    )
+
+
+def test_metadata_served_from_disk(stand_in_zone):  # NOQA
+    from dtoolcore import DataSet
+
+    zone, base_uri = stand_in_zone
+    uri = _create_dataset(base_uri)
+
+    with tmp_env_var("DTOOL_IRODS_METADATA_CACHE", "true"):
+        expected = _read_everything(DataSet.from_uri(uri))
+
+        del zone.calls[:]
+        dataset = DataSet.from_uri(uri)
+        assert _read_everything(dataset) == expected
+
+    # Nothing is downloaded; a catalog query per storage broker validates
+    # everything but the immutable parts.
+    assert set(zone.calls) == set([("query",)])
+
+
+def test_metadata_revalidated(stand_in_zone):  # NOQA
+    from dtoolcore import DataSet
+
+    zone, base_uri = stand_in_zone
+    uri = _create_dataset(base_uri)
+
+    with tmp_env_var("DTOOL_IRODS_METADATA_CACHE", "true"):
+        _read_everything(DataSet.from_uri(uri))
+
+    # Edited without the cache.
+    dataset = DataSet.from_uri(uri)
+    dataset.put_readme("---\ndescription: edited elsewhere\n")
+    dataset.put_tag("elsewhere")
+    dataset.update_name("renamed")
+
+    with tmp_env_var("DTOOL_IRODS_METADATA_CACHE", "true"):
+        dataset = DataSet.from_uri(uri)
+        assert dataset.name == "renamed"
+        assert dataset.get_readme_content() \
+            == "---\ndescription: edited elsewhere\n"
+        assert dataset.list_tags() == ["cached", "elsewhere"]
+
+        # Edited with the cache.
+        dataset.delete_tag("cached")
+        dataset.put_annotation("project", "edited")
+        assert dataset.list_tags() == ["elsewhere"]
+        assert dataset.get_annotation("project") == "edited"
@@ -0,0 +1,50 @@
+"""Test prefetching items into the cache concurrently."""
+
+import os
+
+from . import create_dataset
+from . import TEST_SAMPLE_DATA
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+def _create_dataset(base_uri):
+    return create_dataset(
+        base_uri,
+        "prefetch",
+        items=dict((f, f) for f in os.listdir(TEST_SAMPLE_DATA))
+    )
+
+
+def test_prefetch(stand_in_zone):  # NOQA
+    from dtoolcore.filehasher import sha256sum_hexdigest
+
+    zone, base_uri = stand_in_zone
+    dataset = _create_dataset(base_uri)
+    storage_broker = dataset._storage_broker
+
+    identifiers = list(dataset.identifiers)
+    abspaths = storage_broker.prefetch(identifiers + identifiers, 3)
+    assert set(abspaths.keys()) == set(identifiers)
+
+    for identifier, abspath in abspaths.items():
+        relpath = dataset.item_properties(identifier)["relpath"]
+        assert sha256sum_hexdigest(abspath) == sha256sum_hexdigest(
+            os.path.join(TEST_SAMPLE_DATA, relpath)
+        )
+        assert dataset.item_content_abspath(identifier) == abspath
+
+    # Everything is cached so nothing is downloaded again.
+    del zone.calls[:]
+    storage_broker.prefetch(identifiers)
+    assert [c for c in zone.calls if c[0] == "get"] == []
+
+
+def test_iter_prefetch_early_close(stand_in_zone):  # NOQA
+    zone, base_uri = stand_in_zone
+    dataset = _create_dataset(base_uri)
+
+    iterator = dataset._storage_broker.iter_prefetch(dataset.identifiers, 1)
+    identifier, abspath = next(iterator)
+    assert os.path.isfile(abspath)
+    iterator.close()
@@ -0,0 +1,42 @@
+"""Test putting many items concurrently."""
+
+import os
+
+from . import TEST_SAMPLE_DATA
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+def test_put_items(stand_in_zone):  # NOQA
+    from dtoolcore import (
+        DataSet,
+        generate_admin_metadata,
+        generate_proto_dataset,
+    )
+    from dtoolcore.filehasher import sha256sum_hexdigest
+    from dtoolcore.utils import generate_identifier
+
+    zone, base_uri = stand_in_zone
+
+    admin_metadata = generate_admin_metadata("put_items")
+    proto_dataset = generate_proto_dataset(admin_metadata, base_uri)
+    proto_dataset.create()
+
+    filenames = sorted(os.listdir(TEST_SAMPLE_DATA))
+    items = [(os.path.join(TEST_SAMPLE_DATA, f), "sub/" + f)
+             for f in filenames]
+    items.append((os.path.join(TEST_SAMPLE_DATA, "missing"), "missing"))
+
+    failures = proto_dataset._storage_broker.put_items(items, max_workers=3)
+    assert list(failures.keys()) == ["missing"]
+
+    proto_dataset.freeze()
+
+    dataset = DataSet.from_uri(proto_dataset.uri)
+    assert len(dataset.identifiers) == len(filenames)
+    for f in filenames:
+        properties = dataset.item_properties(generate_identifier("sub/" + f))
+        assert properties["relpath"] == "sub/" + f
+        assert properties["hash"] == sha256sum_hexdigest(
+            os.path.join(TEST_SAMPLE_DATA, f)
+        )
@@ -0,0 +1,124 @@
+"""Test read-ahead of sequentially accessed items."""
+
+import os
+import threading
+
+from . import tmp_env_var
+from . import TEST_SAMPLE_DATA
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+class _Fetcher(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fetched = []
+
+    def __call__(self, identifier):
+        with self.lock:
+            self.fetched.append(identifier)
+        return "/cache/" + identifier
+
+
+def _read_ahead(fetch, depth=2, budget=100, sizes=None):
+    from dtool_irods.readahead import ReadAhead
+    order = ["a", "b", "c", "d", "e"]
+    if sizes is None:
+        sizes = dict((i, 10) for i in order)
+    return ReadAhead(fetch, order, sizes, depth, budget, max_workers=2)
+
+
+def test_sequential_access_reads_ahead():
+    fetch = _Fetcher()
+    read_ahead = _read_ahead(fetch)
+
+    assert read_ahead.get("a") == "/cache/a"
+    assert read_ahead.get("b") == "/cache/b"
+    assert read_ahead.get("c") == "/cache/c"
+    assert sorted(read_ahead._in_flight.keys()) == ["d", "e"]
+    assert read_ahead.get("d") == "/cache/d"
+    assert read_ahead.get("e") == "/cache/e"
+    read_ahead.close()
+
+    # Items read ahead are not fetched again when requested.
+    assert sorted(fetch.fetched) == ["a", "b", "c", "d", "e"]
+
+
+def test_random_access_does_not_read_ahead():
+    fetch = _Fetcher()
+    read_ahead = _read_ahead(fetch)
+
+    for identifier in ["c", "a", "e", "b", "unknown"]:
+        assert read_ahead.get(identifier) == "/cache/" + identifier
+    read_ahead.close()
+
+    assert fetch.fetched == ["c", "a", "e", "b", "unknown"]
+
+
+def test_read_ahead_respects_budget():
+    fetch = _Fetcher()
+    sizes = {"a": 10, "b": 10, "c": 60, "d": 50, "e": 10}
+    read_ahead = _read_ahead(fetch, depth=3, budget=100, sizes=sizes)
+
+    read_ahead.get("a")
+    read_ahead.get("b")
+
+    # Reading ahead both "c" and "d" would exceed the budget.
+    assert list(read_ahead._in_flight.keys()) == ["c"]
+    read_ahead.close()
+
+
+def test_failed_read_ahead_falls_back_to_fetch():
+    calls = []
+
+    def fetch(identifier):
+        calls.append(identifier)
+        if calls.count(identifier) == 1 and identifier == "c":
+            raise RuntimeError("Transient failure")
+        return "/cache/" + identifier
+
+    read_ahead = _read_ahead(fetch, depth=1)
+    read_ahead.get("a")
+    read_ahead.get("b")
+    assert read_ahead.get("c") == "/cache/c"
+    read_ahead.close()
+
+
+def test_get_item_abspath_with_read_ahead(stand_in_zone):  # NOQA
+    from dtoolcore import (
+        DataSet,
+        generate_admin_metadata,
+        generate_proto_dataset,
+    )
+    from dtoolcore.filehasher import sha256sum_hexdigest
+
+    zone, base_uri = stand_in_zone
+
+    admin_metadata = generate_admin_metadata("read_ahead")
+    proto_dataset = generate_proto_dataset(admin_metadata, base_uri)
+    proto_dataset.create()
+    for f in os.listdir(TEST_SAMPLE_DATA):
+        proto_dataset.put_item(os.path.join(TEST_SAMPLE_DATA, f), f)
+    proto_dataset.freeze()
+
+    with tmp_env_var("DTOOL_IRODS_READ_AHEAD", "2"):
+        dataset = DataSet.from_uri(proto_dataset.uri)
+
+    del zone.calls[:]
+    identifiers = list(dataset._manifest["items"].keys())
+    for identifier in identifiers:
+        relpath = dataset.item_properties(identifier)["relpath"]
+        abspath = dataset.item_content_abspath(identifier)
+        assert sha256sum_hexdigest(abspath) == sha256sum_hexdigest(
+            os.path.join(TEST_SAMPLE_DATA, relpath)
+        )
+    dataset._storage_broker._read_ahead.close()
+
+    # Every item was downloaded exactly once.
+    gets = [c for c in zone.calls if c[0] == "get"]
+    assert len(gets) == len(identifiers)
+    assert os.listdir(os.path.dirname(abspath)) != []
+    assert not any(
+        f.endswith(".tmp") for f in os.listdir(os.path.dirname(abspath))
+    )
@@ -0,0 +1,105 @@
+"""Test the registration in place of items on an iRODS vault file system."""
+
+import os
+import shutil
+
+from . import tmp_env_var
+from . import create_dataset
+from . import TEST_SAMPLE_DATA
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+from . import tmp_directory
+
+
+def test_put_item_registers_in_place(stand_in_zone):  # NOQA
+    from dtoolcore import (
+        DataSet,
+        generate_admin_metadata,
+        generate_proto_dataset,
+    )
+    from dtoolcore.filehasher import sha256sum_hexdigest
+
+    zone, base_uri = stand_in_zone
+    sample_fpath = os.path.join(TEST_SAMPLE_DATA, "tiny.png")
+
+    with tmp_directory() as vault:
+        vault_fpath = os.path.join(vault, "instrument", "tiny.png")
+        os.mkdir(os.path.dirname(vault_fpath))
+        shutil.copyfile(sample_fpath, vault_fpath)
+
+        with tmp_env_var("DTOOL_IRODS_REGISTER_PREFIX", vault):
+            admin_metadata = generate_admin_metadata("register")
+            proto_dataset = generate_proto_dataset(admin_metadata, base_uri)
+            proto_dataset.create()
+            proto_dataset.put_item(vault_fpath, "registered.png")
+            proto_dataset.put_item(sample_fpath, "uploaded.png")
+            proto_dataset.freeze()
+
+        data_abspath = proto_dataset._storage_broker._data_abspath
+        registered = [c[1] for c in zone.calls if c[0] == "register"]
+        assert len(registered) == 1
+        assert zone.data_objects[registered[0]].physical_path \
+            == os.path.realpath(vault_fpath)
+        assert os.path.dirname(registered[0]) == data_abspath
+
+    dataset = DataSet.from_uri(proto_dataset.uri)
+    relpaths = sorted(
+        dataset.item_properties(i)["relpath"] for i in dataset.identifiers
+    )
+    assert relpaths == ["registered.png", "uploaded.png"]
+    for identifier in dataset.identifiers:
+        assert dataset.item_properties(identifier)["hash"] \
+            == sha256sum_hexdigest(sample_fpath)
+
+
+def test_registered_checksum_used_as_hash(stand_in_zone, monkeypatch):  # NOQA
+    from dtoolcore import DataSet
+    from dtoolcore.filehasher import sha256sum_hexdigest
+    from dtool_irods import transport
+
+    zone, base_uri = stand_in_zone
+    sample_fpath = os.path.join(TEST_SAMPLE_DATA, "tiny.png")
+    expected_hash = sha256sum_hexdigest(sample_fpath)
+    monkeypatch.setenv("DTOOL_IRODS_CHECKSUM_ON_UPLOAD", "true")
+
+    # The server reads the file to register its checksum; it is not read
+    # again on the client.
+    def sha256sum(fpath):
+        raise(AssertionError("Registered file hashed locally"))
+
+    monkeypatch.setattr(transport, "sha256sum_hexdigest", sha256sum)
+
+    with tmp_directory() as vault:
+        vault_fpath = os.path.join(vault, "tiny.png")
+        shutil.copyfile(sample_fpath, vault_fpath)
+        with tmp_env_var("DTOOL_IRODS_REGISTER_PREFIX", vault):
+            proto_dataset = create_dataset(
+                base_uri,
+                "register",
+                items=[],
+                freeze=False
+            )
+            proto_dataset.put_item(vault_fpath, "registered.png")
+            del zone.calls[:]
+            proto_dataset.freeze()
+
+    # The hash is the checksum found by the catalog query of the freeze.
+    assert not [c for c in zone.calls if c[0] == "chksum"]
+    dataset = DataSet.from_uri(proto_dataset.uri)
+    [identifier] = dataset.identifiers
+    assert dataset.item_properties(identifier)["hash"] == expected_hash
+
+
+def test_is_registrable(stand_in_zone):  # NOQA
+    from dtoolcore import generate_admin_metadata, generate_proto_dataset
+
+    zone, base_uri = stand_in_zone
+    with tmp_env_var("DTOOL_IRODS_REGISTER_PREFIX", "/vault/instrument"):
+        admin_metadata = generate_admin_metadata("register")
+        proto_dataset = generate_proto_dataset(admin_metadata, base_uri)
+    storage_broker = proto_dataset._storage_broker
+
+    assert storage_broker._is_registrable("/vault/instrument/a.png")
+    assert storage_broker._is_registrable("/vault/instrument/sub/b.png")
+    assert not storage_broker._is_registrable("/vault/instrument2/a.png")
+    assert not storage_broker._is_registrable("/vault/a.png")
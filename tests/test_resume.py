@@ -0,0 +1,71 @@
+"""Test resuming interrupted uploads of items."""
+
+import os
+import shutil
+
+from . import tmp_env_var
+from . import TEST_SAMPLE_DATA
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+def test_resume_put_items(stand_in_zone, tmp_dir_fixture):  # NOQA
+    from dtoolcore import (
+        DataSet,
+        ProtoDataSet,
+        generate_admin_metadata,
+        generate_proto_dataset,
+    )
+    from dtoolcore.utils import generate_identifier
+
+    zone, base_uri = stand_in_zone
+    fpaths = {}
+    for name in ["a.png", "b.png", "c.png", "d.png"]:
+        fpaths[name] = os.path.join(tmp_dir_fixture, name)
+        shutil.copyfile(os.path.join(TEST_SAMPLE_DATA, "tiny.png"),
+                        fpaths[name])
+
+    admin_metadata = generate_admin_metadata("resume")
+    proto_dataset = generate_proto_dataset(admin_metadata, base_uri)
+    proto_dataset.create()
+    for name in ["a.png", "b.png", "c.png"]:
+        proto_dataset.put_item(fpaths[name], name)
+
+    # The upload of b.png was interrupted before its handle was set, and
+    # c.png changed since it was uploaded.
+    data_abspath = proto_dataset._storage_broker._data_abspath
+    zone.data_objects[
+        os.path.join(data_abspath, generate_identifier("b.png"))
+    ].avus[:] = []
+    with open(fpaths["c.png"], "ab") as fh:
+        fh.write(b"changed")
+
+    with tmp_env_var("DTOOL_IRODS_RESUME", "true"):
+        proto_dataset = ProtoDataSet.from_uri(proto_dataset.uri)
+        del zone.calls[:]
+        for name in ["a.png", "b.png", "c.png", "d.png"]:
+            proto_dataset.put_item(fpaths[name], name)
+
+        uploaded = sorted(
+            c[1] for c in zone.calls if c[0] == "open" and c[2] == "w"
+        )
+        assert uploaded == sorted(
+            os.path.join(data_abspath, generate_identifier(n))
+            for n in ["c.png", "d.png"]
+        )
+        repaired = [c[1] for c in zone.calls if c[0] == "imeta_set"]
+        assert os.path.join(data_abspath, generate_identifier("b.png")) \
+            in repaired
+        proto_dataset.freeze()
+
+    dataset = DataSet.from_uri(proto_dataset.uri)
+    sizes = dict(
+        (p["relpath"], p["size_in_bytes"])
+        for p in dataset._manifest["items"].values()
+    )
+    assert sizes == {
+        "a.png": 276,
+        "b.png": 276,
+        "c.png": 276 + len(b"changed"),
+        "d.png": 276,
+    }
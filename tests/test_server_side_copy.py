@@ -0,0 +1,119 @@
+"""Test server side copies of datasets between iRODS collections."""
+
+import os
+
+from . import create_dataset
+from . import STAND_IN_COLLECTION
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+from . import tmp_directory
+
+
+def _create_dataset(base_uri):
+    dataset = create_dataset(
+        base_uri,
+        "server_side_copy",
+        items=["a.png", "sub/b.png"],
+        readme="---\ndescription: copied\n",
+        item_metadata={"animal": "dog"}
+    )
+    dataset.put_tag("copied")
+    dataset.put_annotation("project", "copy")
+    return dataset
+
+
+def test_server_side_copy(stand_in_zone):  # NOQA
+    from dtoolcore import DataSet
+    from dtool_irods.storagebroker import copy
+
+    zone, base_uri = stand_in_zone
+    src_dataset = _create_dataset(base_uri)
+
+    dest_collection = STAND_IN_COLLECTION + "-copy"
+    zone.collections.add(dest_collection)
+
+    del zone.calls[:]
+    dest_uri = copy(src_dataset.uri, "irods:" + dest_collection)
+
+    # The items were copied by the server, not downloaded and uploaded.
+    assert len([c for c in zone.calls if c[0] == "copy"]) == 2
+    assert not [c for c in zone.calls if c[0] in ("get", "put")]
+
+    dest_dataset = DataSet.from_uri(dest_uri)
+    assert dest_dataset.uuid == src_dataset.uuid
+    # The timestamps are those of the copies.
+    for identifier, properties in src_dataset._manifest["items"].items():
+        dest_properties = dest_dataset._manifest["items"][identifier]
+        for key in ["relpath", "size_in_bytes", "hash"]:
+            assert dest_properties[key] == properties[key]
+    assert len(dest_dataset._manifest["items"]) == 2
+    assert dest_dataset.get_readme_content() \
+        == src_dataset.get_readme_content()
+    assert dest_dataset.list_tags() == ["copied"]
+    assert dest_dataset.get_annotation("project") == "copy"
+    assert dest_dataset.get_overlay("animal") \
+        == src_dataset.get_overlay("animal")
+
+
+def test_checksum_mismatch_reported(stand_in_zone):  # NOQA
+    from dtoolcore import generate_admin_metadata, generate_proto_dataset
+    from dtool_irods.storagebroker import IrodsChecksumMismatchError
+
+    zone, base_uri = stand_in_zone
+    src_dataset = _create_dataset(base_uri)
+    src_storage_broker = src_dataset._storage_broker
+    identifier = sorted(src_dataset.identifiers)[0]
+    src_obj = zone.data_objects[
+        os.path.join(src_storage_broker._data_abspath, identifier)
+    ]
+    src_obj.checksum = "sha2:" + "A" * 43 + "="
+
+    proto_dataset = generate_proto_dataset(
+        generate_admin_metadata("copy"),
+        base_uri
+    )
+    proto_dataset.create()
+    failures = proto_dataset._storage_broker.copy_items_from(
+        src_storage_broker
+    )
+    assert list(failures.keys()) == [identifier]
+    assert isinstance(failures[identifier], IrodsChecksumMismatchError)
+
+
+def test_copy_to_disk_exports_items(stand_in_zone, monkeypatch):  # NOQA
+    from dtoolcore import DataSet
+    from dtool_irods.storagebroker import copy, IrodsStorageBroker
+
+    zone, base_uri = stand_in_zone
+    src_dataset = _create_dataset(base_uri)
+
+    # A single recursive transfer rather than one download per item.
+    def get_item_abspath(self, identifier):
+        raise(AssertionError("Item downloaded on its own"))
+
+    monkeypatch.setattr(
+        IrodsStorageBroker,
+        "get_item_abspath",
+        get_item_abspath
+    )
+
+    with tmp_directory() as dest:
+        dest_uri = copy(src_dataset.uri, "file://" + dest)
+
+        dest_dataset = DataSet.from_uri(dest_uri)
+        assert sorted(dest_dataset.identifiers) \
+            == sorted(src_dataset.identifiers)
+        for identifier, properties in src_dataset._manifest["items"].items():
+            dest_properties = dest_dataset.item_properties(identifier)
+            assert dest_properties["relpath"] == properties["relpath"]
+            assert dest_properties["size_in_bytes"] \
+                == properties["size_in_bytes"]
+        assert dest_dataset.get_readme_content() \
+            == src_dataset.get_readme_content()
+        assert dest_dataset.list_tags() == ["copied"]
+        assert dest_dataset.get_annotation("project") == "copy"
+        assert dest_dataset.get_overlay("animal") \
+            == src_dataset.get_overlay("animal")
+        data_abspath = dest_dataset._storage_broker._data_abspath
+        assert not [d for d in os.listdir(data_abspath)
+                    if d.startswith(".dtool-irods-staging-")]
@@ -0,0 +1,163 @@
+"""Test streaming reads of items that bypass the cache."""
+
+import os
+import subprocess
+
+import pytest
+
+from . import create_dataset
+from . import TEST_SAMPLE_DATA
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+def test_open_item(stand_in_zone, tmp_dir_fixture):  # NOQA
+    zone, base_uri = stand_in_zone
+    dataset = create_dataset(base_uri, "streaming")
+    identifier = list(dataset.identifiers)[0]
+    with open(os.path.join(TEST_SAMPLE_DATA, "tiny.png"), "rb") as fh:
+        expected = fh.read()
+
+    storage_broker = dataset._storage_broker
+    del zone.calls[:]
+    with storage_broker.open_item(identifier) as fh:
+        assert fh.read(4) == expected[:4]
+        assert fh.read() == expected[4:]
+
+    chunks = list(storage_broker.iter_item_chunks(identifier, 100))
+    assert [len(c) for c in chunks] == [100, 100, 76]
+    assert b"".join(chunks) == expected
+
+    # Nothing was downloaded into the cache.
+    assert not [c for c in zone.calls if c[0] == "get"]
+    assert not os.path.isdir(
+        os.path.join(tmp_dir_fixture, dataset.uuid)
+    )
+
+
+def test_early_close_releases_session(stand_in_zone):  # NOQA
+    zone, base_uri = stand_in_zone
+    dataset = create_dataset(base_uri, "streaming")
+    identifier = list(dataset.identifiers)[0]
+
+    storage_broker = dataset._storage_broker
+    pool = storage_broker._transport._pool
+    num_idle = pool._idle.qsize()
+
+    chunks = storage_broker.iter_item_chunks(identifier, 10)
+    assert len(next(chunks)) == 10
+    assert pool._idle.qsize() == num_idle - 1
+    chunks.close()
+    assert pool._idle.qsize() == num_idle
+
+
+def test_iget_stream_early_close(monkeypatch):
+    from dtool_irods import transport
+
+    processes = []
+
+    def popen(args, **kwargs):
+        # Stand-in for an iget of an endless data object.
+        p = subprocess.Popen(["yes"], **kwargs)
+        processes.append(p)
+        return p
+
+    monkeypatch.setattr(transport, "Popen", popen)
+
+    fh = transport._open_iget_stream("/zone/endless")
+    assert fh.read(4) == b"y\ny\n"
+    fh.close()
+    assert processes[0].returncode is not None
+
+
+def test_read_item_range(stand_in_zone):  # NOQA
+    zone, base_uri = stand_in_zone
+    dataset = create_dataset(base_uri, "streaming")
+    identifier = list(dataset.identifiers)[0]
+    with open(os.path.join(TEST_SAMPLE_DATA, "tiny.png"), "rb") as fh:
+        expected = fh.read()
+
+    storage_broker = dataset._storage_broker
+    assert storage_broker.read_item_range(identifier, 1, 3) == b"PNG"
+    assert storage_broker.read_item_range(identifier, 270, 100) \
+        == expected[270:]
+
+    fh = storage_broker.open_item_seekable(identifier, block_size=64)
+    fh.seek(-6, 2)
+    assert fh.read() == expected[-6:]
+    fh.seek(100)
+    assert fh.read(10) == expected[100:110]
+    assert fh.tell() == 110
+
+
+def test_range_reader_block_cache():
+    from dtool_irods.streaming import RangeReader
+
+    content = bytes(bytearray(range(256))) * 4
+    ranges = []
+
+    def read_range(offset, length):
+        ranges.append((offset, length))
+        return content[offset:offset + length]
+
+    fh = RangeReader(read_range, len(content), block_size=100, cache_blocks=3)
+    assert fh.read(10) == content[:10]
+    assert fh.read(10) == content[10:20]
+    assert ranges == [(0, 100)]
+
+    # Consecutive missing blocks are fetched together, cached ones reused.
+    fh.seek(50)
+    assert fh.read(200) == content[50:250]
+    assert ranges == [(0, 100), (100, 200)]
+
+    # Only the three most recently used blocks are kept.
+    fh.seek(900)
+    assert fh.read() == content[900:]
+    fh.seek(0)
+    assert fh.read(1) == content[:1]
+    assert ranges[2:] == [(900, 200), (0, 100)]
+
+    assert fh.read(0) == b""
+    fh.seek(2000)
+    assert fh.read() == b""
+
+
+def test_read_range_without_istream(monkeypatch):
+    from dtool_irods import transport
+
+    commands = []
+
+    def popen(args, **kwargs):
+        commands.append(args[0])
+        if args[0] == "istream":
+            raise(OSError())
+        # The command exits before its standard input is written to.
+        p = subprocess.Popen(["printf", "0123456789"], **kwargs)
+        p.wait()
+        return p
+
+    monkeypatch.setattr(transport, "Popen", popen)
+    monkeypatch.setattr(transport, "_istream_available", True)
+
+    assert transport._read_range("/zone/digits", 3, 4) == b"3456"
+    assert transport._read_range("/zone/digits", 8, 4) == b"89"
+    assert commands == ["istream", "iget", "iget"]
+
+
+def test_pipe_stream_reports_failed_command(monkeypatch):
+    from dtool_irods import transport
+
+    def popen(args, **kwargs):
+        p = subprocess.Popen(
+            ["sh", "-c", "echo 'USER_INPUT_PATH_ERR' >&2; exit 3"],
+            **kwargs
+        )
+        p.wait()
+        return p
+
+    monkeypatch.setattr(transport, "Popen", popen)
+
+    with pytest.raises(IOError) as excinfo:
+        with transport._open_iget_stream("/zone/missing") as fh:
+            fh.read()
+    assert "USER_INPUT_PATH_ERR" in str(excinfo.value)
@@ -0,0 +1,89 @@
+"""Test the number of parallel streams used to transfer items."""
+
+import os
+
+from . import tmp_env_var
+from . import TEST_SAMPLE_DATA
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+MiB = 1024 * 1024
+
+
+def test_transfer_threads_policy():
+    from dtool_irods.transport import transfer_threads
+
+    assert transfer_threads(10 * MiB, None) is None
+    assert transfer_threads(10 * MiB, "8") == 8
+    assert transfer_threads(10 * MiB, 8) == 8
+    assert transfer_threads(10 * MiB, "auto") == 1
+    assert transfer_threads(100 * MiB, "auto") == 2
+    assert transfer_threads(1024 * MiB, "AUTO") == 4
+    assert transfer_threads(100 * 1024 * MiB, "auto") == 16
+
+
+def test_icommands_thread_arguments(monkeypatch):
+    from dtool_irods import transport
+
+    commands = []
+    monkeypatch.setattr(
+        transport,
+        "_run_cmd",
+        lambda cmd, exit_on_failure=True: commands.append(cmd.args)
+    )
+
+    transport._cp("a.png", "/zone/a", threads=4)
+    transport._get_file_forcefully("/zone/a", "a.png", threads=4)
+    transport._get_file("/zone/a", "a.png")
+    assert commands == [
+        ["iput", "-f", "-N", "4", "a.png", "/zone/a"],
+        ["iget", "-f", "-N", "4", "/zone/a", "a.png"],
+        ["iget", "/zone/a", "a.png"],
+    ]
+
+
+def test_transfers_recorded(stand_in_zone):  # NOQA
+    from dtoolcore import (
+        DataSet,
+        generate_admin_metadata,
+        generate_proto_dataset,
+    )
+
+    zone, base_uri = stand_in_zone
+    with tmp_env_var("DTOOL_IRODS_TRANSFER_THREADS", "auto"):
+        admin_metadata = generate_admin_metadata("transfer_threads")
+        proto_dataset = generate_proto_dataset(admin_metadata, base_uri)
+        proto_dataset.create()
+        proto_dataset.put_item(
+            os.path.join(TEST_SAMPLE_DATA, "tiny.png"),
+            "a.png"
+        )
+        proto_dataset.freeze()
+        [put] = proto_dataset._storage_broker.get_transfer_records()
+
+        dataset = DataSet.from_uri(proto_dataset.uri)
+        identifier = list(dataset.identifiers)[0]
+        dataset.item_content_abspath(identifier)
+        [get] = dataset._storage_broker.get_transfer_records()
+
+    assert put.identifier == get.identifier == identifier
+    assert (put.direction, get.direction) == ("put", "get")
+    assert put.size_in_bytes == get.size_in_bytes == 276
+    assert put.threads == get.threads == 1
+    assert get.bytes_per_second is None or get.bytes_per_second > 0
+
+
+def test_native_parallel_put(stand_in_zone):  # NOQA
+    from dtool_irods.transport import get_transport
+
+    zone, base_uri = stand_in_zone
+    irods_path = os.path.join(base_uri.split(":", 1)[1], "tiny.png")
+    fpath = os.path.join(TEST_SAMPLE_DATA, "tiny.png")
+
+    transport = get_transport()
+    hexdigest = transport.put_file(fpath, irods_path, threads=4)
+
+    from dtoolcore.filehasher import sha256sum_hexdigest
+    assert hexdigest == sha256sum_hexdigest(fpath)
+    assert ("put", irods_path) in zone.calls
+    assert zone.data_objects[irods_path].size == 276
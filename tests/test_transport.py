@@ -0,0 +1,256 @@
+"""Test the iRODS transports."""
+
+import os
+import threading
+
+import pytest
+
+from . import tmp_env_var
+from . import TEST_SAMPLE_DATA
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+def test_default_transport_is_icommands():
+    from dtool_irods.transport import get_transport, IcommandsTransport
+    assert isinstance(get_transport(), IcommandsTransport)
+
+
+def test_unknown_transport_raises():
+    from dtool_irods.transport import get_transport
+    with tmp_env_var("DTOOL_IRODS_TRANSPORT", "carrier-pigeon"):
+        with pytest.raises(ValueError):
+            get_transport()
+
+
+def test_transport_shared_between_calls(stand_in_zone):  # NOQA
+    from dtool_irods.transport import get_transport, NativeTransport
+    transport = get_transport()
+    assert isinstance(transport, NativeTransport)
+    assert transport is get_transport()
+
+
+def test_command_wrapper_stdin():
+    from dtool_irods import CommandWrapper
+    cmd = CommandWrapper(["cat"], stdin=u"caf\u00e9".encode("utf-8"))
+    assert cmd() == u"caf\u00e9"
+
+
+def test_put_text_streams_from_memory(monkeypatch):
+    from dtool_irods import transport
+
+    commands = []
+
+    def run_cmd(cmd, exit_on_failure=True):
+        commands.append((cmd.args, cmd.stdin))
+        if cmd.args[0] == "istream" and not istream_installed:
+            raise(RuntimeError("No such command found in PATH"))
+        return cmd
+
+    monkeypatch.setattr(transport, "_run_cmd", run_cmd)
+    monkeypatch.setattr(transport, "_istream_available", True)
+
+    istream_installed = True
+    transport._put_obj("/zone/obj.json", {"a": [1, 2]})
+    assert commands == [
+        (["istream", "write", "/zone/obj.json"], b'{"a":[1,2]}'),
+    ]
+
+    # Without istream the text is put from a temporary file, and istream
+    # is not tried again.
+    del commands[:]
+    istream_installed = False
+    transport._put_text("/zone/a.txt", "a")
+    transport._put_text("/zone/b.txt", "b")
+    assert [args[0] for args, _ in commands] == ["istream", "iput", "iput"]
+
+
+def test_put_file_streams_and_hashes_in_one_pass(monkeypatch):
+    from dtoolcore.filehasher import sha256sum_hexdigest
+    from dtool_irods import transport
+
+    fpath = os.path.join(TEST_SAMPLE_DATA, "tiny.png")
+    commands = []
+
+    def run_cmd(cmd, exit_on_failure=True):
+        stdin = cmd.stdin
+        if cmd.args[0] == "istream":
+            stdin = b"".join(cmd.stdin)
+        commands.append((cmd.args, stdin))
+        return cmd
+
+    def sha256sum(fpath):
+        raise(AssertionError("File read for hashing only"))
+
+    monkeypatch.setattr(transport, "_run_cmd", run_cmd)
+    monkeypatch.setattr(transport, "_istream_available", True)
+    monkeypatch.setattr(transport, "sha256sum_hexdigest", sha256sum)
+
+    icommands = transport.IcommandsTransport()
+    hexdigest = icommands.put_file(fpath, "/zone/tiny.png")
+    with open(fpath, "rb") as fh:
+        assert commands == [
+            (["istream", "write", "/zone/tiny.png"], fh.read()),
+        ]
+    assert hexdigest == sha256sum_hexdigest(fpath)
+
+
+def test_put_file_registering_checksum_uses_iput(monkeypatch):
+    from dtool_irods import transport
+
+    commands = []
+
+    def run_cmd(cmd, exit_on_failure=True):
+        commands.append(cmd.args)
+        return cmd
+
+    monkeypatch.setattr(transport, "_run_cmd", run_cmd)
+    monkeypatch.setattr(transport, "_istream_available", True)
+
+    icommands = transport.IcommandsTransport()
+    fpath = os.path.join(TEST_SAMPLE_DATA, "tiny.png")
+    icommands.put_file(fpath, "/zone/tiny.png", checksum=True)
+    icommands.put_file(fpath, "/zone/tiny.png", threads=4)
+    assert commands == [
+        ["iput", "-f", "-k", fpath, "/zone/tiny.png"],
+        ["iput", "-f", "-N", "4", fpath, "/zone/tiny.png"],
+    ]
+
+
+def test_command_wrapper_streamed_stdin():
+    from dtool_irods import CommandWrapper
+    cmd = CommandWrapper(["cat"], stdin=iter([b"ab", b"c"]))
+    assert cmd() == "abc"
+
+    # A command exiting before reading its input still reports its failure.
+    cmd = CommandWrapper(["false"], stdin=iter([b"x" * 2 ** 20] * 4))
+    cmd(exit_on_failure=False)
+    assert not cmd.success()
+
+
+def test_session_pool_bounds_and_reuses_sessions():
+    from dtool_irods.transport import SessionPool
+
+    created = []
+    in_use = []
+    max_in_use = []
+    lock = threading.Lock()
+
+    class Session(object):
+        def cleanup(self):
+            pass
+
+    def factory():
+        with lock:
+            created.append(1)
+        return Session()
+
+    pool = SessionPool(factory, size=2)
+
+    def work():
+        for _ in range(20):
+            with pool.session():
+                with lock:
+                    in_use.append(1)
+                    max_in_use.append(len(in_use))
+                with lock:
+                    in_use.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(created) <= 2
+    assert max(max_in_use) <= 2
+
+    pool.close()
+
+
+def test_native_transport_operations(stand_in_zone, tmp_dir_fixture):  # NOQA
+    from dtool_irods.transport import get_transport, IrodsNoMetaDataSetError
+
+    zone, base_uri = stand_in_zone
+    collection = base_uri.split(":", 1)[1]
+    transport = get_transport()
+
+    subcollection = os.path.join(collection, "sub")
+    assert not transport.path_exists(subcollection)
+    transport.mkdir_if_missing(subcollection)
+    assert transport.path_exists(subcollection)
+
+    text_path = os.path.join(subcollection, "hello.txt")
+    transport.put_text(text_path, u"Hello \u00e9")
+    assert transport.get_text(text_path) == u"Hello \u00e9"
+    assert transport.ls(subcollection) == ["hello.txt"]
+
+    item_path = os.path.join(subcollection, "tiny.png")
+    transport.put_file(os.path.join(TEST_SAMPLE_DATA, "tiny.png"), item_path)
+    size, timestamp = transport.get_size_and_timestamp(item_path)
+    assert size == 276
+
+    local_path = os.path.join(tmp_dir_fixture, "tiny.png")
+    transport.get_file(item_path, local_path)
+    transport.get_file(item_path, local_path, force=True)
+    assert os.path.getsize(local_path) == 276
+
+    transport.mkdir(os.path.join(subcollection, "nested"))
+    transport.put_text(os.path.join(subcollection, "nested", "a.txt"), "a")
+    local_dir = os.path.join(tmp_dir_fixture, "sub")
+    transport.get_collection(subcollection, local_dir)
+    assert sorted(os.listdir(local_dir)) \
+        == ["hello.txt", "nested", "tiny.png"]
+    with open(os.path.join(local_dir, "nested", "a.txt")) as fh:
+        assert fh.read() == "a"
+
+    with pytest.raises(IrodsNoMetaDataSetError):
+        transport.get_metadata(item_path, "handle")
+    transport.put_metadata(item_path, "handle", "tiny.png")
+    transport.put_metadata(item_path, "handle", "tiny2.png")
+    assert transport.get_metadata(item_path, "handle") == "tiny2.png"
+
+    assert ":" not in transport.get_checksum(item_path)
+
+    transport.rm_if_exists(subcollection)
+    assert not transport.path_exists(subcollection)
+    assert not transport.path_exists(item_path)
+
+    # Everything above went through a single pooled session.
+    assert zone.num_sessions == 1
+
+
+def test_basic_workflow_native_transport(stand_in_zone):  # NOQA
+
+    zone, base_uri = stand_in_zone
+
+    from dtoolcore import (
+        DataSet,
+        generate_admin_metadata,
+        generate_proto_dataset,
+    )
+    from dtoolcore.utils import generate_identifier
+    from dtoolcore.filehasher import sha256sum_hexdigest
+
+    admin_metadata = generate_admin_metadata("my_dataset")
+    proto_dataset = generate_proto_dataset(admin_metadata, base_uri)
+    proto_dataset.create()
+
+    local_file_path = os.path.join(TEST_SAMPLE_DATA, "tiny.png")
+    proto_dataset.put_item(local_file_path, "tiny.png")
+    proto_dataset.add_item_metadata("tiny.png", "animal", "dog")
+    proto_dataset.put_readme("Hello world!")
+    proto_dataset.freeze()
+
+    dataset = DataSet.from_uri(proto_dataset.uri)
+    identifier = generate_identifier("tiny.png")
+    assert list(dataset.identifiers) == [identifier]
+    assert dataset.get_readme_content() == "Hello world!"
+    assert dataset.get_overlay("animal") == {identifier: "dog"}
+    assert dataset.item_properties(identifier)["hash"] \
+        == sha256sum_hexdigest(local_file_path)
+
+    fpath = dataset.item_content_abspath(identifier)
+    assert sha256sum_hexdigest(fpath) == sha256sum_hexdigest(local_file_path)
+
+    assert zone.num_sessions == 1
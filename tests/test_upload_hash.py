@@ -0,0 +1,39 @@
+"""Test hashing items whilst uploading them."""
+
+import os
+
+import pytest
+
+from . import create_dataset
+from . import TEST_SAMPLE_DATA
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+def test_get_hash_after_upload_without_network(stand_in_zone):  # NOQA
+    from dtoolcore.filehasher import sha256sum_hexdigest
+
+    zone, base_uri = stand_in_zone
+    proto_dataset = create_dataset(base_uri, "upload_hash", freeze=False)
+    storage_broker = proto_dataset._storage_broker
+
+    del zone.calls[:]
+    assert storage_broker.get_hash("a.png") \
+        == sha256sum_hexdigest(os.path.join(TEST_SAMPLE_DATA, "tiny.png"))
+    assert zone.calls == []
+
+
+def test_checksum_mismatch_detected_on_freeze(stand_in_zone, monkeypatch):  # NOQA
+    from dtool_irods.storagebroker import IrodsChecksumMismatchError
+
+    zone, base_uri = stand_in_zone
+    monkeypatch.setenv("DTOOL_IRODS_CHECKSUM_ON_UPLOAD", "true")
+    proto_dataset = create_dataset(base_uri, "upload_hash", freeze=False)
+
+    # Simulate the replica getting corrupted on the way into iRODS.
+    key = proto_dataset._storage_broker._get_item_key_from_handle("a.png")
+    zone.data_objects[key].checksum = \
+        "sha2:n4bQgYhMfWWaL+qgxVrQFaO/TxsrC4Is0V1sFbDwCgg="
+
+    with pytest.raises(IrodsChecksumMismatchError):
+        proto_dataset.freeze()
@@ -0,0 +1,144 @@
+"""Test reading items straight from the vault file system."""
+
+import os
+import shutil
+
+import pytest
+
+from . import tmp_env_var
+from . import TEST_SAMPLE_DATA
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+@pytest.fixture
+def vault_dataset(stand_in_zone, tmp_dir_fixture):  # NOQA
+    """Dataset whose items are registered in a vault in the cache directory,
+    so that they can be hard linked."""
+    from dtoolcore import generate_admin_metadata, generate_proto_dataset
+
+    zone, base_uri = stand_in_zone
+    vault = os.path.join(tmp_dir_fixture, "vault")
+    os.mkdir(vault)
+    for name in ["a.png", "b.png"]:
+        shutil.copyfile(
+            os.path.join(TEST_SAMPLE_DATA, "tiny.png"),
+            os.path.join(vault, name)
+        )
+
+    with tmp_env_var("DTOOL_IRODS_REGISTER_PREFIX", vault):
+        admin_metadata = generate_admin_metadata("vault")
+        proto_dataset = generate_proto_dataset(admin_metadata, base_uri)
+        proto_dataset.create()
+        for name in ["a.png", "b.png"]:
+            proto_dataset.put_item(os.path.join(vault, name), name)
+        proto_dataset.freeze()
+    return zone, vault, proto_dataset.uri
+
+
+def _identifiers_by_relpath(dataset):
+    return dict(
+        (dataset.item_properties(i)["relpath"], i) for i in dataset.identifiers
+    )
+
+
+def test_vault_read_path(vault_dataset):
+    from dtoolcore import DataSet
+
+    zone, vault, uri = vault_dataset
+    with tmp_env_var("DTOOL_IRODS_VAULT_READ", "path"):
+        dataset = DataSet.from_uri(uri)
+        identifiers = _identifiers_by_relpath(dataset)
+        del zone.calls[:]
+        for name in ["a.png", "b.png"]:
+            assert dataset.item_content_abspath(identifiers[name]) \
+                == os.path.join(vault, name)
+
+    # The physical paths are resolved in bulk; nothing is downloaded.
+    assert zone.calls.count(("query",)) == 1
+    assert not [c for c in zone.calls if c[0] == "get"]
+
+
+def test_vault_read_mounts(vault_dataset, tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+
+    zone, vault, uri = vault_dataset
+    mount = os.path.join(tmp_dir_fixture, "mount")
+    os.symlink(vault, mount)
+    with tmp_env_var("DTOOL_IRODS_VAULT_READ", "path"):
+        with tmp_env_var("DTOOL_IRODS_VAULT_MOUNTS", vault + "=" + mount):
+            dataset = DataSet.from_uri(uri)
+            identifier = _identifiers_by_relpath(dataset)["a.png"]
+            assert dataset.item_content_abspath(identifier) \
+                == os.path.join(mount, "a.png")
+
+
+def test_vault_read_link(vault_dataset):
+    from dtoolcore import DataSet
+
+    zone, vault, uri = vault_dataset
+    with tmp_env_var("DTOOL_IRODS_VAULT_READ", "link"):
+        dataset = DataSet.from_uri(uri)
+        identifier = _identifiers_by_relpath(dataset)["a.png"]
+        abspath = dataset.item_content_abspath(identifier)
+
+    assert abspath != os.path.join(vault, "a.png")
+    assert os.path.samefile(abspath, os.path.join(vault, "a.png"))
+    assert not [c for c in zone.calls if c[0] == "get"]
+
+
+def test_vault_read_stale_replicas(vault_dataset):
+    from dtoolcore import DataSet
+
+    zone, vault, uri = vault_dataset
+
+    # The file on the mount was changed behind the back of iRODS.
+    with open(os.path.join(vault, "a.png"), "ab") as fh:
+        fh.write(b"changed")
+    # The catalog records a checksum not matching the manifest.
+    dataset = DataSet.from_uri(uri)
+    identifiers = _identifiers_by_relpath(dataset)
+    data_abspath = dataset._storage_broker._data_abspath
+    zone.data_objects[
+        os.path.join(data_abspath, identifiers["b.png"])
+    ].checksum = "sha2:" + "A" * 43 + "="
+
+    with tmp_env_var("DTOOL_IRODS_VAULT_READ", "path"):
+        dataset = DataSet.from_uri(uri)
+        for name in ["a.png", "b.png"]:
+            abspath = dataset.item_content_abspath(identifiers[name])
+            assert abspath != os.path.join(vault, name)
+            assert os.path.getsize(abspath) == 276
+
+    assert len([c for c in zone.calls if c[0] == "get"]) == 2
+
+
+def test_vault_read_path_prefetch(vault_dataset):
+    from dtoolcore import DataSet
+
+    zone, vault, uri = vault_dataset
+    with open(os.path.join(vault, "a.png"), "ab") as fh:
+        fh.write(b"changed")
+
+    with tmp_env_var("DTOOL_IRODS_VAULT_READ", "path"):
+        dataset = DataSet.from_uri(uri)
+        identifiers = _identifiers_by_relpath(dataset)
+        del zone.calls[:]
+        abspaths = dataset._storage_broker.prefetch(dataset.identifiers)
+
+        # Only the item without a usable replica is downloaded.
+        assert len([c for c in zone.calls if c[0] == "get"]) == 1
+        assert abspaths[identifiers["b.png"]] == os.path.join(vault, "b.png")
+        assert abspaths[identifiers["a.png"]] \
+            != os.path.join(vault, "a.png")
+        for identifier, abspath in abspaths.items():
+            assert dataset.item_content_abspath(identifier) == abspath
+
+
+def test_unknown_vault_read_mode(stand_in_zone):  # NOQA
+    from dtoolcore import generate_admin_metadata, generate_proto_dataset
+
+    zone, base_uri = stand_in_zone
+    with tmp_env_var("DTOOL_IRODS_VAULT_READ", "teleport"):
+        with pytest.raises(ValueError):
+            generate_proto_dataset(generate_admin_metadata("x"), base_uri)
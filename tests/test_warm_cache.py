@@ -0,0 +1,50 @@
+"""Test that getting the path of cached items does not call iRODS."""
+
+import os
+
+from . import TEST_SAMPLE_DATA
+from . import tmp_dir_fixture  # NOQA
+from . import stand_in_zone  # NOQA
+
+
+def test_warm_get_item_abspath_makes_no_irods_calls(stand_in_zone):  # NOQA
+    from dtoolcore import (
+        DataSet,
+        generate_admin_metadata,
+        generate_proto_dataset,
+    )
+
+    zone, base_uri = stand_in_zone
+
+    admin_metadata = generate_admin_metadata("warm")
+    proto_dataset = generate_proto_dataset(admin_metadata, base_uri)
+    proto_dataset.create()
+    for f in os.listdir(TEST_SAMPLE_DATA):
+        proto_dataset.put_item(os.path.join(TEST_SAMPLE_DATA, f), f)
+    proto_dataset.freeze()
+
+    dataset = DataSet.from_uri(proto_dataset.uri)
+    identifiers = list(dataset.identifiers)
+    abspaths = dict(
+        (i, dataset.item_content_abspath(i)) for i in identifiers
+    )
+    for identifier, abspath in abspaths.items():
+        relpath = dataset.item_properties(identifier)["relpath"]
+        _, ext = os.path.splitext(relpath)
+        assert abspath.endswith(identifier + ext)
+
+    # The extensions are read from beside the cache by a new broker; only
+    # the admin metadata is read from iRODS, once.
+    dataset = DataSet.from_uri(proto_dataset.uri)
+    del zone.calls[:]
+    for identifier in identifiers:
+        assert dataset.item_content_abspath(identifier) \
+            == abspaths[identifier]
+    assert len(zone.calls) == 1
+    assert zone.calls[0][0] == "open"
+    assert zone.calls[0][1].endswith("/.dtool/dtool")
+
+    del zone.calls[:]
+    for identifier in identifiers:
+        dataset.item_content_abspath(identifier)
+    assert zone.calls == []